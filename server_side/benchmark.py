@@ -0,0 +1,519 @@
+"""End-to-end benchmarks of the predictor and delivery services at production scale.
+
+Synthetic sales histories (stores x products x days) and customer lists drive
+the real endpoints through Flask's test client. Calls go to fake_twilio and
+recordings are served by a local HTTP server, so nothing leaves the machine.
+Each service runs in its own spawned process with a scratch working directory,
+so model files, call stores and peak memory are per service.
+
+    python benchmark.py run --stores 20 --products 50 --days 120 --customers 1000
+    python benchmark.py run --scenarios predict predict_stream --env MODEL_FORMAT=flat
+    python benchmark.py compare bench_results/old.json bench_results/new.json
+
+`run` writes one JSON file per run (commit, parameters, machine, and per
+scenario throughput, p50/p99 latency, peak RSS and mean stage times) to
+--out. `compare` prints the change per metric and exits with status 1 when a
+metric got worse by more than --threshold.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+PREDICTOR_DIR = os.path.join(SERVER_DIR, 'predictor')
+DELIVERY_DIR = os.path.join(SERVER_DIR, 'delivery_helper')
+
+# Each scenario runs after the ones it needs (a model to predict with, customers to call)
+SCENARIOS = {
+    'train': ('predictor', []),
+    'predict': ('predictor', ['train']),
+    'predict_cached': ('predictor', ['train']),
+    'predict_stream': ('predictor', ['train']),
+    'upload_customers': ('delivery', []),
+    'trigger_calls': ('delivery', ['upload_customers']),
+    'voice': ('delivery', ['upload_customers']),
+    'recording': ('delivery', ['upload_customers']),
+}
+# Metrics compared between runs, and whether a larger value is better
+COMPARED_METRICS = {
+    'throughput': True,
+    'p50_ms': False,
+    'p99_ms': False,
+    'peak_rss_mb': False,
+}
+
+
+def sales_history(stores, products, days, seed=0):
+    """predictor/bench.py's seasonal_sales for stores x products, with string ids like a real upload."""
+    from bench import seasonal_sales
+
+    history = seasonal_sales(stores * products, days, seed=seed, n_products=products)
+    return history.assign(store_id='Store' + history['store_id'].astype(str).str.zfill(4),
+                          product_id='Product' + history['product_id'].astype(str).str.zfill(5))
+
+
+def customer_list(customers, seed=0):
+    """Customers in the upload format of demo_data/input.csv."""
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    numbers = rng.choice(10 ** 9, size=customers, replace=False) + 9 * 10 ** 9
+    return pd.DataFrame({
+        'mobile_number': [f'91{n}' for n in numbers],
+        'name': [f'Customer {i}' for i in range(customers)],
+        'order_details': [f'Order #{100000 + i}: {rng.integers(1, 6)} items' for i in range(customers)],
+    })
+
+
+def _wav_bytes(seconds=3.0, rate=8000):
+    import math
+    import struct
+    frames = b''.join(struct.pack('<h', int(8000 * math.sin(2 * math.pi * 440 * i / rate)))
+                      for i in range(int(seconds * rate)))
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(frames)
+    return buffer.getvalue()
+
+
+class RecordingServer:
+    """Serves the same short WAV for every `<anything>.wav` path, standing in for Twilio's recording URLs.
+
+    Other paths get a 404, as Twilio answers for formats it is still
+    processing. Runs on 127.0.0.1 on a free port in a daemon thread.
+    """
+
+    def __init__(self, seconds=3.0):
+        body = _wav_bytes(seconds)
+        self.requests = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.requests += 1
+                if self.path.endswith('.wav'):
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'audio/x-wav')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                else:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self._httpd.server_address[1]}'
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='recording-server', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def summarize(latencies, seconds, units, unit, peak_rss_mb, **extra):
+    """One scenario's result: `units` of work done in `seconds`, per-request latencies in seconds."""
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'seconds': round(seconds, 4),
+        'throughput': round(units / seconds, 2) if seconds else None,
+        'throughput_unit': unit,
+        'p50_ms': round(_percentile(ordered, 0.5) * 1000, 3) if ordered else None,
+        'p99_ms': round(_percentile(ordered, 0.99) * 1000, 3) if ordered else None,
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3) if ordered else None,
+        'peak_rss_mb': peak_rss_mb,
+        **extra,
+    }
+
+
+def _reset_peak_rss():
+    """Restart the process's peak RSS count (Linux); elsewhere the peak is since process start."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _upload(body, name):
+    return {'file': (io.BytesIO(body), name)}
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def _stage_means(metrics):
+    """Mean milliseconds per stage_seconds label set, from the service's metrics registry."""
+    _, histograms = metrics.snapshot()
+    means = {}
+    for (name, labels), values in histograms.items():
+        if name == 'stage_seconds' and values[-1]:
+            labels = dict(labels)
+            stage = labels.pop('stage', '')
+            key = stage + (f"[{','.join(f'{label}={value}' for label, value in labels.items())}]" if labels else '')
+            means[key] = round(values[-2] / values[-1] * 1000, 3)
+    return dict(sorted(means.items()))
+
+
+def _import_service(directory, module_name, workdir, env):
+    """Import a service module as `python <module>.py` would see it, with cwd and env set first."""
+    import importlib
+    import warnings
+    warnings.filterwarnings('ignore')
+    os.chdir(workdir)
+    os.environ.update(env)
+    sys.path.insert(0, directory)
+    return importlib.import_module(module_name)
+
+
+def _run_predictor(config, scenarios, workdir, env):
+    service = _import_service(PREDICTOR_DIR, 'app', workdir, env)
+    from jobs import TERMINAL_STATUSES
+    from instrumentation import metrics
+
+    client = service.app.test_client()
+    history = sales_history(config['stores'], config['products'], config['days'], seed=config['seed'])
+    train_csv = history.to_csv(index=False).encode()
+    recent = history[history['date'] >= sorted(history['date'].unique())[-config['predict_days']]]
+    predict_csv = recent.to_csv(index=False).encode()
+    groups = config['stores'] * config['products']
+    forecast_rows = groups * 7
+    del history, recent
+    results = {}
+
+    if 'train' in scenarios:
+        _reset_peak_rss()
+        latencies = []
+        start = time.perf_counter()
+        for i in range(config['train_repeat']):
+            # A trailing blank line changes the upload hash without changing the data, so no job is deduplicated
+            body = train_csv + b'\n' * i
+            t0 = time.perf_counter()
+            response = client.post('/api/train', data=_upload(body, 'sales.csv'))
+            if response.status_code != 202:
+                raise RuntimeError(f'/api/train returned {response.status_code}: {response.get_data(as_text=True)}')
+            job_id = response.get_json()['job_id']
+            while True:
+                job = client.get(f'/api/train/{job_id}').get_json()
+                if job['status'] in TERMINAL_STATUSES:
+                    break
+                time.sleep(0.05)
+            if job['status'] != 'succeeded':
+                raise RuntimeError(f'Training job failed: {job.get("error")}')
+            latencies.append(time.perf_counter() - t0)
+        seconds = time.perf_counter() - start
+        # The fit itself runs in the training pool's process, outside this peak
+        results['train'] = summarize(latencies, seconds, len(train_csv.splitlines()) * len(latencies), 'rows/s',
+                                     _peak_rss_mb(), mse=job.get('mse'), fit_seconds=job.get('fit_seconds'))
+
+    def predict(name, query, vary, stream=False):
+        _reset_peak_rss()
+        latencies, first_bytes = [], []
+        start = time.perf_counter()
+        for i in range(config['repeat']):
+            body = predict_csv + (b'\n' * (i + 1) if vary else b'')
+            t0 = time.perf_counter()
+            response = client.post(f'/api/predict{query}', data=_upload(body, 'sales.csv'))
+            if response.status_code != 200:
+                raise RuntimeError(f'/api/predict returned {response.status_code}')
+            if stream:
+                chunks = iter(response.response)
+                next(chunks, None)
+                first_bytes.append(time.perf_counter() - t0)
+                for _ in chunks:
+                    pass
+            else:
+                response.get_data()
+            # Closing runs the response callbacks, which record the request metrics
+            response.close()
+            latencies.append(time.perf_counter() - t0)
+        extra = {'ttfb_p50_ms': round(_percentile(sorted(first_bytes), 0.5) * 1000, 3)} if first_bytes else {}
+        results[name] = summarize(latencies, time.perf_counter() - start, forecast_rows * len(latencies),
+                                  'forecast rows/s', _peak_rss_mb(), groups=groups, **extra)
+
+    if 'predict' in scenarios:
+        # Every upload is new: parse, features, scoring and rendering on each request
+        predict('predict', '', vary=True)
+    if 'predict_cached' in scenarios:
+        predict('predict_cached', '', vary=False)
+    if 'predict_stream' in scenarios:
+        predict('predict_stream', '?stream=1&format=ndjson', vary=True, stream=True)
+    # Pool processes would otherwise keep this process from exiting
+    service.train_queue.shutdown()
+    service.forecaster.shutdown()
+    return results, _stage_means(metrics)
+
+
+def _run_delivery(config, scenarios, workdir, env):
+    service = _import_service(DELIVERY_DIR, 'delivery_call', workdir, env)
+    from instrumentation import metrics
+    from transcription import PENDING_STATUSES
+
+    client = service.app.test_client()
+    customers = config['customers']
+    customers_csv = customer_list(customers, seed=config['seed']).to_csv(index=False).encode()
+    results = {}
+
+    if 'upload_customers' in scenarios:
+        _reset_peak_rss()
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(config['repeat']):
+            response, seconds = _timed(lambda: client.post('/api/upload_customers',
+                                                           data=_upload(customers_csv, 'customers.csv')))
+            if response.status_code != 200:
+                raise RuntimeError(f'/api/upload_customers returned {response.status_code}')
+            latencies.append(seconds)
+        results['upload_customers'] = summarize(latencies, time.perf_counter() - start, customers * len(latencies),
+                                                'customers/s', _peak_rss_mb())
+
+    if 'trigger_calls' in scenarios:
+        _reset_peak_rss()
+        # Per call: time from the request until its progress line arrives
+        latencies, failed = [], 0
+        start = time.perf_counter()
+        response = client.post('/api/trigger_calls', json={'webhook_base_url': 'http://localhost:5000'})
+        for line in response.response:
+            result = json.loads(line)
+            if result['status'] == 'completed':
+                break
+            latencies.append(time.perf_counter() - start)
+            failed += result['status'] != 'initiated'
+        response.close()
+        seconds = time.perf_counter() - start
+        results['trigger_calls'] = summarize(latencies, seconds, len(latencies), 'calls/s', _peak_rss_mb(),
+                                             failed_calls=failed, first_call_ms=round(latencies[0] * 1000, 3)
+                                             if latencies else None)
+
+    if 'voice' in scenarios:
+        _reset_peak_rss()
+        latencies = []
+        start = time.perf_counter()
+        for row in range(customers):
+            response, seconds = _timed(lambda: client.post(f'/voice/{row}'))
+            response.close()
+            latencies.append(seconds)
+        results['voice'] = summarize(latencies, time.perf_counter() - start, len(latencies), 'requests/s',
+                                     _peak_rss_mb())
+
+    if 'recording' in scenarios:
+        _reset_peak_rss()
+        latencies = []
+        start = time.perf_counter()
+        for row in range(customers):
+            form = {'RecordingUrl': f"{config['recording_url']}/Recordings/RE{row:032d}",
+                    'RecordingDuration': '3', 'RecordingSid': f'RE{row:032d}'}
+            response, seconds = _timed(lambda: client.post(f'/recording/{row}', data=form))
+            response.close()
+            latencies.append(seconds)
+        webhooks_done = time.perf_counter()
+        # Downloads and transcription finish on the pipeline's threads after the webhooks returned
+        deadline = webhooks_done + config['timeout']
+        while service.store.pending_transcriptions(PENDING_STATUSES):
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"Transcriptions still pending after {config['timeout']}s")
+            time.sleep(0.02)
+        seconds = time.perf_counter() - start
+        frame = service.store.to_frame()
+        results['recording'] = summarize(latencies, seconds, customers, 'transcriptions/s', _peak_rss_mb(),
+                                         webhook_seconds=round(webhooks_done - start, 4),
+                                         transcribed=int((frame['transcription_status'] == 'done').sum()))
+    return results, _stage_means(metrics)
+
+
+SERVICES = {'predictor': _run_predictor, 'delivery': _run_delivery}
+
+
+def _service_env(service, args, recording_url):
+    env = {'LOG_LEVEL': args.log_level, 'METRICS_ENABLED': '1'}
+    if service == 'delivery':
+        env.update({
+            'USE_FAKE_TWILIO': '1',
+            'FAKE_TWILIO_LATENCY': str(args.twilio_latency),
+            'FAKE_TWILIO_ERROR_RATE': str(args.twilio_error_rate),
+            'TWILIO_PHONE_NUMBER': '+15550000000',
+            'DIAL_RATE_PER_SEC': str(args.dial_rate),
+            'DIAL_BACKOFF_SECONDS': '0.05',
+            'TRANSCRIBE_BACKEND': 'stub',
+            'RECORDINGS_DIR': '.',
+            'PUBLIC_BASE_URL': '',
+        })
+    env.update(dict(item.split('=', 1) for item in args.env))
+    return env
+
+
+def _git(*command):
+    try:
+        return subprocess.run(['git', *command], cwd=SERVER_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    selected = []
+    for name in args.scenarios:
+        for needed in [*SCENARIOS[name][1], name]:
+            if needed not in selected:
+                selected.append(needed)
+    config = {key: getattr(args, key) for key in ('stores', 'products', 'days', 'predict_days', 'customers',
+                                                   'repeat', 'train_repeat', 'seed', 'timeout')}
+    report = {
+        'commit': _git('rev-parse', 'HEAD'),
+        'dirty': bool(_git('status', '--porcelain', '--', '.')),
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                    'cpus': os.cpu_count()},
+        'config': {**config, 'scenarios': selected, 'env': args.env, 'dial_rate': args.dial_rate,
+                   'twilio_latency': args.twilio_latency, 'twilio_error_rate': args.twilio_error_rate},
+        'results': {},
+        'stages_ms': {},
+    }
+    with RecordingServer() as recordings:
+        config['recording_url'] = recordings.url
+        for service, runner in SERVICES.items():
+            scenarios = [name for name in selected if SCENARIOS[name][0] == service]
+            if not scenarios:
+                continue
+            print(f'⏱️  {service}: {", ".join(scenarios)}', flush=True)
+            with tempfile.TemporaryDirectory(prefix=f'bench-{service}-') as workdir, \
+                    ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+                results, stages = pool.submit(runner, config, scenarios, workdir,
+                                              _service_env(service, args, recordings.url)).result()
+            report['results'].update(results)
+            report['stages_ms'][service] = stages
+
+    print_report(report)
+    os.makedirs(args.out, exist_ok=True)
+    commit = (report['commit'] or 'nogit')[:10] + ('-dirty' if report['dirty'] else '')
+    path = os.path.join(args.out, f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}-{commit}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\n💾 Results saved to {path}')
+
+
+def print_report(report):
+    print(f"\n{'scenario':<18}{'throughput':>24}{'p50 ms':>11}{'p99 ms':>11}{'peak RSS MB':>13}")
+    for name, result in report['results'].items():
+        throughput = f"{result['throughput']} {result['throughput_unit']}"
+        print(f"{name:<18}{throughput:>24}{result['p50_ms']:>11}{result['p99_ms']:>11}{result['peak_rss_mb']:>13}")
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        old = json.load(f)
+    with open(args.candidate) as f:
+        new = json.load(f)
+    print(f"baseline  {(old['commit'] or '?')[:10]}  {old['started_at']}")
+    print(f"candidate {(new['commit'] or '?')[:10]}  {new['started_at']}")
+    if old['config'] != new['config']:
+        print('⚠️  The runs used different parameters; changes may not be comparable')
+    regressions = 0
+    print(f"\n{'scenario':<18}{'metric':<13}{'baseline':>12}{'candidate':>12}{'change':>9}")
+    for name in new['results']:
+        if name not in old['results']:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            before, after = old['results'][name].get(metric), new['results'][name].get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = -change if higher_is_better else change
+            flag = ''
+            if worse > args.threshold:
+                flag = '  ❌ regression'
+                regressions += 1
+            elif -worse > args.threshold:
+                flag = '  ✅'
+            print(f'{name:<18}{metric:<13}{before:>12}{after:>12}{change:>+9.1%}{flag}')
+    if regressions:
+        print(f'\n{regressions} metric(s) worse by more than {args.threshold:.0%}')
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end service benchmarks on synthetic data.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    bench = commands.add_parser('run', help='run scenarios and save the results')
+    bench.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    bench.add_argument('--stores', type=int, default=20)
+    bench.add_argument('--products', type=int, default=50)
+    bench.add_argument('--days', type=int, default=120, help='days of sales history used for training')
+    bench.add_argument('--predict-days', type=int, default=30, help='most recent days uploaded to /api/predict')
+    bench.add_argument('--customers', type=int, default=1000)
+    bench.add_argument('--repeat', type=int, default=20, help='requests per predict and upload scenario')
+    bench.add_argument('--train-repeat', type=int, default=1)
+    bench.add_argument('--seed', type=int, default=0)
+    bench.add_argument('--dial-rate', type=float, default=200, help='DIAL_RATE_PER_SEC for trigger_calls')
+    bench.add_argument('--twilio-latency', type=float, default=0.05, help='fake Twilio API latency (seconds)')
+    bench.add_argument('--twilio-error-rate', type=float, default=0.0)
+    bench.add_argument('--timeout', type=float, default=600, help='seconds to wait for transcriptions')
+    bench.add_argument('--env', nargs='*', default=[], metavar='KEY=VALUE',
+                       help='extra service settings, e.g. MODEL_FORMAT=flat PREDICT_WORKERS=2')
+    bench.add_argument('--log-level', default='WARNING')
+    bench.add_argument('--out', default='bench_results')
+
+    diff = commands.add_parser('compare', help='compare two saved runs')
+    diff.add_argument('baseline')
+    diff.add_argument('candidate')
+    diff.add_argument('--threshold', type=float, default=0.1, help='relative change reported as a regression')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+import json
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+RESULT_COLUMNS = ['response', 'recording_duration', 'recording_sid', 'transcription', 'transcription_status']
+# Process (pid) working on a row's transcription; kept out of the exported results
+OWNER_COLUMN = 'transcription_owner'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    row_id INTEGER PRIMARY KEY,
+    mobile_number TEXT NOT NULL,
+    name TEXT,
+    data TEXT NOT NULL,
+    response TEXT,
+    recording_duration TEXT,
+    recording_sid TEXT,
+    transcription TEXT,
+    transcription_status TEXT,
+    transcription_owner TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_customers_mobile_number ON customers (mobile_number);
+CREATE TABLE IF NOT EXISTS retries (
+    row_id INTEGER PRIMARY KEY,
+    attempts INTEGER NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_retries_next_attempt_at ON retries (next_attempt_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _clean(value):
+    # pandas/numpy scalars -> plain JSON values, NaN -> None
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+
+class CallStore:
+    """Customer list and per-call results in SQLite (WAL mode).
+
+    Rows keep the position they had in the uploaded CSV as `row_id`, which is the
+    index used in the /voice/<row_index> and /recording/<row_index> webhooks. Each
+    webhook reads or updates a single row, so its cost does not grow with the
+    size of the campaign, and concurrent callbacks no longer overwrite each other.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            existing = {row['name'] for row in conn.execute('PRAGMA table_info(customers)')}
+            for col in RESULT_COLUMNS + [OWNER_COLUMN]:
+                if col not in existing:
+                    # Databases created before the column existed
+                    conn.execute(f'ALTER TABLE customers ADD COLUMN {col} TEXT')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def import_frame(self, df):
+        """Replace the customer list with `df` (must have name and mobile_number)."""
+        columns = [str(c) for c in df.columns]
+        rows = []
+        for row_id, values in enumerate(df.itertuples(index=False, name=None)):
+            record = {col: _clean(value) for col, value in zip(columns, values)}
+            results = [record.pop(col, None) for col in RESULT_COLUMNS]
+            rows.append((row_id, str(record['mobile_number']), record.get('name'),
+                         json.dumps(record), *results))
+        with self._connect() as conn:
+            conn.execute('DELETE FROM customers')
+            conn.execute('DELETE FROM retries')
+            conn.executemany(
+                f'INSERT INTO customers (row_id, mobile_number, name, data, {", ".join(RESULT_COLUMNS)}) '
+                f'VALUES (?, ?, ?, ?, {", ".join("?" for _ in RESULT_COLUMNS)})', rows)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('columns', ?)",
+                         (json.dumps([c for c in columns if c not in RESULT_COLUMNS]),))
+        return len(rows)
+
+    def import_csv(self, path):
+        return self.import_frame(pd.read_csv(path))
+
+    def count(self):
+        return self._connect().execute('SELECT COUNT(*) FROM customers').fetchone()[0]
+
+    def _record(self, row):
+        record = json.loads(row['data'])
+        for col in RESULT_COLUMNS:
+            record[col] = row[col]
+        record['row_id'] = row['row_id']
+        return record
+
+    def get(self, row_id):
+        row = self._connect().execute('SELECT * FROM customers WHERE row_id = ?', (row_id,)).fetchone()
+        return None if row is None else self._record(row)
+
+    def find_by_number(self, mobile_number):
+        rows = self._connect().execute(
+            'SELECT row_id FROM customers WHERE mobile_number = ? ORDER BY row_id', (str(mobile_number),))
+        return [row['row_id'] for row in rows]
+
+    def numbers(self):
+        """(row_id, mobile_number) for every customer, in upload order."""
+        rows = self._connect().execute('SELECT row_id, mobile_number FROM customers ORDER BY row_id')
+        return [(row['row_id'], row['mobile_number']) for row in rows]
+
+    def pending(self):
+        """Customers with no recorded response yet, in upload order."""
+        rows = self._connect().execute(
+            "SELECT * FROM customers WHERE response IS NULL OR TRIM(response) = '' ORDER BY row_id")
+        return [self._record(row) for row in rows]
+
+    def pending_transcriptions(self, statuses):
+        """(row_id, recording_url, owner) for rows whose transcription_status is one of `statuses`."""
+        placeholders = ', '.join('?' for _ in statuses)
+        rows = self._connect().execute(
+            f'SELECT row_id, response, {OWNER_COLUMN} FROM customers '
+            f'WHERE transcription_status IN ({placeholders}) ORDER BY row_id', tuple(statuses))
+        return [(row['row_id'], row['response'], row[OWNER_COLUMN]) for row in rows]
+
+    def claim_transcription(self, row_id, owner, previous_owner, statuses):
+        """Make `owner` the owner of a pending transcription still owned by `previous_owner`.
+
+        One conditional UPDATE, so when several processes try to take over the
+        same row only one of them gets True.
+        """
+        placeholders = ', '.join('?' for _ in statuses)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f'UPDATE customers SET {OWNER_COLUMN} = ?, updated_at = ? WHERE row_id = ? '
+                f'AND {OWNER_COLUMN} IS ? AND transcription_status IN ({placeholders})',
+                (owner, time.time(), row_id, previous_owner, *statuses))
+        return cursor.rowcount == 1
+
+    def update(self, row_id, **fields):
+        """Set result columns (or OWNER_COLUMN) on one row in a single transaction; False if the row is unknown."""
+        unknown = set(fields) - set(RESULT_COLUMNS) - {OWNER_COLUMN}
+        if unknown:
+            raise ValueError(f'Not a result column: {unknown}')
+        assignments = ', '.join(f'{col} = ?' for col in fields)
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f'UPDATE customers SET {assignments}, updated_at = ? WHERE row_id = ?',
+                (*fields.values(), time.time(), row_id))
+        return cursor.rowcount == 1
+
+    def get_retry(self, row_id):
+        row = self._connect().execute('SELECT * FROM retries WHERE row_id = ?', (row_id,)).fetchone()
+        return None if row is None else dict(row)
+
+    def set_retry(self, row_id, attempts, next_attempt_at, last_error=None):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO retries (row_id, attempts, next_attempt_at, last_error) '
+                         'VALUES (?, ?, ?, ?)', (row_id, attempts, next_attempt_at, last_error))
+
+    def clear_retry(self, row_id):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM retries WHERE row_id = ?', (row_id,))
+
+    def due_retries(self, now, max_attempts, limit=None):
+        """Customers whose next retry is due and who have attempts left, soonest first.
+
+        Each record carries its retry state as `attempts` and `last_error`.
+        """
+        rows = self._connect().execute(
+            'SELECT customers.*, retries.attempts, retries.last_error FROM retries '
+            'JOIN customers ON customers.row_id = retries.row_id '
+            'WHERE retries.next_attempt_at <= ? AND retries.attempts < ? '
+            'ORDER BY retries.next_attempt_at LIMIT ?', (now, max_attempts, -1 if limit is None else limit))
+        return [{**self._record(row), 'attempts': row['attempts'], 'last_error': row['last_error']}
+                for row in rows]
+
+    def retries(self):
+        """The whole retry queue, soonest first."""
+        rows = self._connect().execute('SELECT * FROM retries ORDER BY next_attempt_at, row_id')
+        return [dict(row) for row in rows]
+
+    def to_frame(self):
+        """All customers with their results, in upload order (the old output.csv layout)."""
+        conn = self._connect()
+        meta = conn.execute("SELECT value FROM meta WHERE key = 'columns'").fetchone()
+        columns = json.loads(meta['value']) if meta else ['mobile_number', 'name']
+        records = [self._record(row) for row in conn.execute('SELECT * FROM customers ORDER BY row_id')]
+        if not records:
+            return pd.DataFrame(columns=columns + RESULT_COLUMNS)
+        df = pd.DataFrame.from_records(records, index='row_id')
+        df.index.name = None
+        return df[columns + RESULT_COLUMNS]
+
+    def export_csv(self, path):
+        self.to_frame().to_csv(path, index=False)
@@ -2,18 +2,30 @@ import pandas as pd
 from twilio.rest import Client
 from flask import Flask, request, Response, jsonify
 import os
-import time
-import urllib.request
-import base64
-import speech_recognition as sr
+import sys
+import json
+import threading
+from functools import partial
 from flask_cors import CORS
 from dotenv import load_dotenv
+# instrumentation.py is shared with the predictor service and lives one directory up.
+# This entry point puts it on sys.path once, before any module of the service imports it.
+if (_shared_dir := os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) not in sys.path:
+    sys.path.append(_shared_dir)
+from call_store import CallStore
+from dialer import Campaign, Dialer
+from instrumentation import get_logger, instrument_app, metrics
+from retry_missed_calls import RetryScheduler
+from transcription import NO_RECORDING, TranscriptionPipeline, make_backend
 load_dotenv()
 
 app = Flask(__name__)
 # Enable CORS for all origins with all methods and headers
 CORS(app, origins="*", methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"], 
      allow_headers=["Content-Type", "Authorization", "Access-Control-Allow-Credentials"])
+# Request timers, GET /metrics and sampled request profiles
+instrument_app(app, 'delivery')
+log = get_logger('delivery')
 
 # Load sensitive credentials from environment variables
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
@@ -23,55 +35,94 @@ TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
 # CSV paths (can be overridden by env or API)
 INPUT_CSV = os.getenv('INPUT_CSV', 'input.csv')
 OUTPUT_CSV = os.getenv('OUTPUT_CSV', 'output.csv')
+# Customer list and call results live here; the CSVs are only import/export formats
+CALLS_DB = os.getenv('CALLS_DB', 'calls.sqlite3')
 
-def load_data(input_csv=INPUT_CSV):
-    df = pd.read_csv(input_csv)
-    if 'response' not in df.columns:
-        df['response'] = ''
-    if 'recording_duration' not in df.columns:
-        df['recording_duration'] = ''
-    if 'recording_sid' not in df.columns:
-        df['recording_sid'] = ''
-    if 'transcription' not in df.columns:
-        df['transcription'] = ''
-    return df
-
-def save_data(df, output_csv=OUTPUT_CSV):
-    df.to_csv(output_csv, index=False)
-
-client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-
-def make_call(row, row_index, webhook_base_url):
-    to_number = str(row['mobile_number'])
-    name = row['name']
-    
-    # Ensure the URL has https:// protocol
-    if not webhook_base_url.startswith('http'):
-        webhook_base_url = f'https://{webhook_base_url}'
-    
-    webhook_url = f'{webhook_base_url}/voice/{row_index}'
-    print(f"🔗 Using webhook URL: {webhook_url}")
+store = CallStore(CALLS_DB)
+if store.count() == 0 and os.path.exists(INPUT_CSV):
+    # First start after switching to the call store: pick up the existing customer list
+    log.info("📥 Imported customers", customers=store.import_csv(INPUT_CSV), path=INPUT_CSV)
+
+# Background recording download + speech-to-text
+TRANSCRIBE_WORKERS = int(os.getenv('TRANSCRIBE_WORKERS', '2'))
+# google (network), vosk (offline, needs VOSK_MODEL_PATH) or stub (tests)
+TRANSCRIBE_BACKEND = os.getenv('TRANSCRIBE_BACKEND', 'google')
+RECORDINGS_DIR = os.getenv('RECORDINGS_DIR', '.')
+# How long to keep polling for a recording Twilio has not finished processing
+RECORDING_MAX_WAIT_SECONDS = float(os.getenv('RECORDING_MAX_WAIT_SECONDS', '60'))
+
+transcriber = TranscriptionPipeline(store, TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN,
+                                    backend=make_backend(TRANSCRIBE_BACKEND), workers=TRANSCRIBE_WORKERS,
+                                    audio_dir=RECORDINGS_DIR, max_wait=RECORDING_MAX_WAIT_SECONDS)
+resumed = transcriber.resume()
+if resumed:
+    log.info("🔁 Resumed unfinished transcriptions", count=resumed)
+
+def load_data():
+    """All customers and their call results as a DataFrame indexed by row id."""
+    return store.to_frame()
+
+# Outbound dialing: Twilio's default limit is 1 call per second per account
+DIAL_RATE_PER_SEC = float(os.getenv('DIAL_RATE_PER_SEC', '1'))
+DIAL_WORKERS = int(os.getenv('DIAL_WORKERS', '8'))
+DIAL_MAX_ATTEMPTS = int(os.getenv('DIAL_MAX_ATTEMPTS', '3'))
+DIAL_BACKOFF_SECONDS = float(os.getenv('DIAL_BACKOFF_SECONDS', '1'))
+# Set USE_FAKE_TWILIO=1 to load-test against fake_twilio.FakeTwilioClient instead of the real API
+USE_FAKE_TWILIO = os.getenv('USE_FAKE_TWILIO', '').lower() in ('1', 'true', 'yes')
+
+if USE_FAKE_TWILIO:
+    from fake_twilio import FakeTwilioClient
+    client = FakeTwilioClient(latency=float(os.getenv('FAKE_TWILIO_LATENCY', '0.2')),
+                              error_rate=float(os.getenv('FAKE_TWILIO_ERROR_RATE', '0')))
+else:
+    client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+
+def make_dialer():
+    return Dialer(client, TWILIO_PHONE_NUMBER, rate=DIAL_RATE_PER_SEC, workers=DIAL_WORKERS,
+                  max_attempts=DIAL_MAX_ATTEMPTS, backoff=DIAL_BACKOFF_SECONDS)
+
+# Customers whose call could not be placed are re-dialed later, with backoff, up to RETRY_MAX_ATTEMPTS rounds
+RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '5'))
+RETRY_BASE_DELAY_SECONDS = float(os.getenv('RETRY_BASE_DELAY_SECONDS', '60'))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv('RETRY_MAX_DELAY_SECONDS', '3600'))
+RETRY_POLL_SECONDS = float(os.getenv('RETRY_POLL_SECONDS', '10'))
+# Set RETRY_LOOP=1 to retry due customers in the background instead of only via /api/retry_calls
+RETRY_LOOP = os.getenv('RETRY_LOOP', '').lower() in ('1', 'true', 'yes')
+
+retry_scheduler = RetryScheduler(store, make_dialer(), max_attempts=RETRY_MAX_ATTEMPTS,
+                                 base_delay=RETRY_BASE_DELAY_SECONDS, max_delay=RETRY_MAX_DELAY_SECONDS,
+                                 poll_interval=RETRY_POLL_SECONDS)
+retry_scheduler.webhook_base_url = os.getenv('PUBLIC_BASE_URL')
+if RETRY_LOOP:
+    retry_scheduler.start()
 
-    try:
-        call = client.calls.create(
-            to=to_number,
-            from_=TWILIO_PHONE_NUMBER,
-            url=webhook_url
-        )
-        print(f"✅ Calling {name} at {to_number}... (Call SID: {call.sid})")
-        return True
-    except Exception as e:
-        if "unverified" in str(e).lower():
-            print(f"❌ ERROR: {name} ({to_number}) is not verified for Twilio trial account!")
-            print("   Please verify this number at: https://console.twilio.com/us1/develop/phone-numbers/manage/verified")
-        else:
-            print(f"❌ ERROR calling {name} at {to_number}: {str(e)}")
-        return False
+
+def _retry_queue_sizes():
+    status = retry_scheduler.status()
+    return {(('state', state),): status[state] for state in ('queued', 'exhausted')}
+
+
+metrics.gauge('retry_queue', _retry_queue_sizes, 'Customers waiting for a retry or past RETRY_MAX_ATTEMPTS')
+
+# The running /api/trigger_calls campaign; a second request follows it instead of dialing everyone again.
+# Per process: with several server workers, only one should receive campaign requests.
+_campaign = None
+_campaign_lock = threading.Lock()
+
+def _log_call_error(name, number, error):
+    if "unverified" in error.lower():
+        log.error("❌ Number is not verified for Twilio trial account", name=name, number=number,
+                  verify_at="https://console.twilio.com/us1/develop/phone-numbers/manage/verified")
+    else:
+        log.error("❌ Error calling customer", name=name, number=number, error=error)
 
 @app.route('/voice/<int:row_index>', methods=['GET', 'POST'])
 def voice(row_index):
-    df = load_data()
-    name = df.loc[row_index, 'name']
+    customer = store.get(row_index)
+    if customer is None:
+        return Response("<Response><Say>Sorry, we could not find your delivery. Goodbye!</Say></Response>",
+                        mimetype='text/xml', status=404)
+    name = customer['name']
     
     # Build absolute URL for /recording route
     webhook_base_url = request.url_root.strip('/')  # e.g., https://xxxx.ngrok-free.app
@@ -94,7 +145,6 @@ def home():
 
 @app.route('/recording/<int:row_index>', methods=['GET', 'POST'])
 def recording(row_index):
-    df = load_data()
     # Handle both GET and POST requests
     if request.method == 'GET':
         recording_url = request.args.get('RecordingUrl', '')
@@ -105,66 +155,30 @@ def recording(row_index):
         recording_duration = request.form.get('RecordingDuration', '')
         recording_sid = request.form.get('RecordingSid', '')
 
-    print(f"🎙️  Recording data received for row {row_index}:")
-    print(f"   URL: {recording_url}")
-    print(f"   Duration: {recording_duration}")
-    print(f"   SID: {recording_sid}")
+    log.info("🎙️  Recording data received", row=row_index, url=recording_url, duration=recording_duration,
+             recording_sid=recording_sid)
 
     # Save recording details
-    df.loc[row_index, 'response'] = recording_url
-    df.loc[row_index, 'recording_duration'] = recording_duration
-    df.loc[row_index, 'recording_sid'] = recording_sid
-
-    # Download the audio file (WAV/MP3 format) with Twilio authentication, with retry and fallback
-    transcription = ''
-    if recording_url:
-        audio_filename = f"recording_{row_index}"
-        credentials = f"{TWILIO_ACCOUNT_SID}:{TWILIO_AUTH_TOKEN}"
-        encoded_credentials = base64.b64encode(credentials.encode('utf-8')).decode('utf-8')
-        headers = {'Authorization': f'Basic {encoded_credentials}'}
-        formats = ['.wav', '.mp3', '']
-        success = False
-        time.sleep(7)  # Wait for Twilio to process the recording
-        for ext in formats:
-            try:
-                req = urllib.request.Request(recording_url + ext, headers=headers)
-                with urllib.request.urlopen(req) as response, open(audio_filename + (ext if ext else '.audio'), 'wb') as out_file:
-                    out_file.write(response.read())
-                print(f"✅ Audio downloaded: {audio_filename + (ext if ext else '.audio')}")
-                # Try to transcribe
-                try:
-                    recognizer = sr.Recognizer()
-                    with sr.AudioFile(audio_filename + (ext if ext else '.audio')) as source:
-                        audio_data = recognizer.record(source)
-                        transcription = recognizer.recognize_google(audio_data)
-                        print(f"✅ Transcription: {transcription}")
-                except Exception as e:
-                    print(f'❌ Speech recognition failed: {e}')
-                    transcription = '[Speech recognition failed]'
-                success = True
-                break
-            except Exception as e:
-                print(f"❌ Failed to download audio with extension '{ext}': {e}")
-        if not success:
-            transcription = '[Audio download failed]'
+    # Download and transcription happen on the pipeline's workers; Twilio gets its TwiML right away
+    if not store.update(row_index, response=recording_url, recording_duration=recording_duration,
+                        recording_sid=recording_sid):
+        log.warning("⚠️  No customer at row, recording not stored", row=row_index)
+    elif recording_url:
+        transcriber.submit(row_index, recording_url)
     else:
-        transcription = '[No recording URL]'
-
-    df.loc[row_index, 'transcription'] = transcription
-    save_data(df)
-    print(f"✅ Recording and transcription saved for row {row_index}: {recording_url}")
+        store.update(row_index, transcription='[No recording URL]', transcription_status=NO_RECORDING)
 
     return Response("<Response><Say>Thank you. Your response has been recorded. Goodbye!</Say></Response>", mimetype='text/xml')
 
 def check_verified_numbers():
-    print("Checking verified numbers...")
+    log.info("Checking verified numbers...")
     try:
         verified_numbers = client.outgoing_caller_ids.list()
         verified_list = [num.phone_number for num in verified_numbers]
-        print(f"✅ Verified numbers: {verified_list}")
+        log.info("✅ Verified numbers", numbers=verified_list)
         return verified_list
     except Exception as e:
-        print(f"⚠️  Could not fetch verified numbers: {str(e)}")
+        log.warning("⚠️  Could not fetch verified numbers", error=str(e))
         return []
 
 def start_flask_server():
@@ -177,7 +191,7 @@ def save_missed_calls(missed_rows):
             writer = csv.DictWriter(f, fieldnames=missed_rows[0].keys())
             writer.writeheader()
             writer.writerows(missed_rows)
-        print(f"Missed calls saved to missed_calls.csv ({len(missed_rows)} numbers)")
+        log.info("Missed calls saved", path='missed_calls.csv', numbers=len(missed_rows))
 
 @app.route('/api/upload_customers', methods=['POST', 'OPTIONS'])
 def upload_customers():
@@ -204,16 +218,37 @@ def upload_customers():
     required_columns = {'name', 'mobile_number'}
     if not required_columns.issubset(df.columns):
         return jsonify({'status': 'error', 'message': f'Missing required columns: {required_columns - set(df.columns)}'}), 400
-    df.to_csv(INPUT_CSV, index=False)
+    imported = store.import_frame(df)
+    retry_scheduler.reindex()
+    log.info("📥 Imported customers", customers=imported)
     
     # Add CORS headers to response
     response = jsonify({'status': 'success', 'message': 'CSV uploaded and validated.'})
     response.headers['Access-Control-Allow-Origin'] = '*'
     return response, 200
 
+def _dial_customers(customers, dialer, webhook_base_url):
+    """Dial `customers` and record every outcome; yields the dialer's results. Runs on a Campaign thread."""
+    by_row = {customer['row_id']: customer for customer in customers}
+    missed_rows = []
+    for result in dialer.dial(customers, webhook_base_url):
+        if result['status'] == 'initiated':
+            # Answered this campaign, so an entry left by an earlier failed one must not re-dial them
+            retry_scheduler.record_success(result['row'])
+            log.info("✅ Calling customer", name=result['name'], number=result['number'], call_sid=result['sid'])
+        else:
+            missed = dict(by_row[result['row']])
+            missed.pop('row_id')
+            missed_rows.append(missed)
+            retry_scheduler.record_failure(result['row'], result['error'])
+            _log_call_error(result['name'], result['number'], result['error'])
+        yield result
+    if missed_rows:
+        save_missed_calls(missed_rows)
+
 @app.route('/api/trigger_calls', methods=['POST', 'OPTIONS'])
 def trigger_calls():
-    """Trigger delivery calls to all customers in the input CSV."""
+    """Trigger delivery calls to every customer without a response, streaming progress as NDJSON."""
     # Handle preflight OPTIONS request
     if request.method == 'OPTIONS':
         response = Response()
@@ -228,7 +263,7 @@ def trigger_calls():
         # Fallback to frontend-provided value (for local/ngrok)
         webhook_base_url = request.json.get('webhook_base_url')
     if not webhook_base_url:
-        print('[ERROR] webhook_base_url missing!')
+        log.error('webhook_base_url missing!')
         response = jsonify({'status': 'error', 'message': 'webhook_base_url required (set PUBLIC_BASE_URL or provide in request)'})
         response.headers['Access-Control-Allow-Origin'] = '*'
         return response, 400
@@ -236,49 +271,89 @@ def trigger_calls():
         webhook_base_url = f'https://{webhook_base_url}'
 
     # Check Twilio credentials
-    if not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN or not TWILIO_PHONE_NUMBER:
-        print('[ERROR] Twilio credentials missing!')
+    if not USE_FAKE_TWILIO and (not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN or not TWILIO_PHONE_NUMBER):
+        log.error('Twilio credentials missing!')
         response = jsonify({'status': 'error', 'message': 'Twilio credentials missing!'})
         response.headers['Access-Control-Allow-Origin'] = '*'
         return response, 500
 
-    df = load_data()
-    successful_calls = 0
-    failed_calls = 0
-    missed_rows = []
-    error_details = []
-    for idx, row in df.iterrows():
-        response_value = df.at[idx, 'response']
-        if response_value is None or pd.isna(response_value) or str(response_value).strip() == '':
-            to_number = str(row['mobile_number'])
-            if not to_number.startswith('+'):
-                print(f'[WARNING] Number {to_number} is not in E.164 format!')
-            print(f'[INFO] Attempting call to {row.get("name", "(no name)")} at {to_number}')
-            try:
-                if make_call(row, idx, webhook_base_url):
-                    successful_calls += 1
-                else:
-                    failed_calls += 1
-                    missed_rows.append(row.to_dict())
-                    error_details.append({'row': idx, 'number': to_number, 'error': 'Call failed'})
-            except Exception as e:
-                print(f'[ERROR] Exception during call: {e}')
+    global _campaign
+    with _campaign_lock:
+        if _campaign is not None and not _campaign.done:
+            log.info('Campaign already running, following it', customers=_campaign.total)
+        else:
+            customers = store.pending()
+            retry_scheduler.webhook_base_url = webhook_base_url
+            log.info('Dialing customers', customers=len(customers), rate_per_sec=DIAL_RATE_PER_SEC)
+            _campaign = Campaign(partial(_dial_customers, customers, make_dialer(), webhook_base_url),
+                                 total=len(customers)).start()
+        campaign = _campaign
+
+    def generate():
+        """One NDJSON line per call as it completes, then a summary line; the campaign goes on without it."""
+        successful_calls = failed_calls = 0
+        for result in campaign.follow():
+            if result['status'] == 'initiated':
+                successful_calls += 1
+            else:
                 failed_calls += 1
-                missed_rows.append(row.to_dict())
-                error_details.append({'row': idx, 'number': to_number, 'error': str(e)})
-            time.sleep(2)
-    if failed_calls > 0:
-        save_missed_calls(missed_rows)
-    
-    # Add CORS headers to response
-    response = jsonify({
-        'status': 'completed',
-        'successful_calls': successful_calls,
-        'failed_calls': failed_calls,
-        'missed': missed_rows,
-        'errors': error_details
-    })
+            yield json.dumps(result) + '\n'
+        yield json.dumps({
+            'status': 'completed' if campaign.error is None else 'error',
+            'total_calls': campaign.total,
+            'successful_calls': successful_calls,
+            'failed_calls': failed_calls,
+        }) + '\n'
+
+    response = Response(generate(), mimetype='application/x-ndjson')
     response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/retry_calls', methods=['GET', 'POST', 'OPTIONS'])
+def retry_calls():
+    """GET: the retry queue. POST: re-dial every customer whose retry is due, streaming NDJSON."""
+    # Handle preflight OPTIONS request
+    if request.method == 'OPTIONS':
+        response = Response()
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        return response
+
+    if request.method == 'GET':
+        return jsonify(retry_scheduler.status())
+
+    webhook_base_url = (os.getenv('PUBLIC_BASE_URL') or (request.get_json(silent=True) or {}).get('webhook_base_url')
+                        or retry_scheduler.webhook_base_url)
+    if not webhook_base_url:
+        return jsonify({'status': 'error', 'message': 'webhook_base_url required (set PUBLIC_BASE_URL or provide in request)'}), 400
+    if not webhook_base_url.startswith('http'):
+        webhook_base_url = f'https://{webhook_base_url}'
+    retry_scheduler.webhook_base_url = webhook_base_url
+
+    # Like a campaign, the round finishes even if the client disconnects
+    retry_round = Campaign(partial(retry_scheduler.run_once, webhook_base_url)).start()
+
+    def generate():
+        successful_calls = failed_calls = 0
+        for result in retry_round.follow():
+            if result['status'] == 'initiated':
+                successful_calls += 1
+            else:
+                failed_calls += 1
+            yield json.dumps(result) + '\n'
+        status = retry_scheduler.status()
+        yield json.dumps({
+            'status': 'completed' if retry_round.error is None else 'error',
+            'successful_calls': successful_calls,
+            'failed_calls': failed_calls,
+            'queued': status['queued'],
+            'exhausted': status['exhausted'],
+        }) + '\n'
+
+    response = Response(generate(), mimetype='application/x-ndjson')
+    response.headers['X-Accel-Buffering'] = 'no'
     return response
 
 @app.route('/api/results', methods=['GET', 'OPTIONS'])
@@ -292,8 +367,12 @@ def get_results():
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
         return response
     
-    df = load_data(OUTPUT_CSV)
-    response = Response(df.to_json(orient='records'), mimetype='application/json')
+    df = load_data()
+    if request.args.get('format') == 'csv':
+        response = Response(df.to_csv(index=False), mimetype='text/csv')
+        response.headers['Content-Disposition'] = f'attachment; filename={os.path.basename(OUTPUT_CSV)}'
+    else:
+        response = Response(df.to_json(orient='records'), mimetype='application/json')
     response.headers['Access-Control-Allow-Origin'] = '*'
     return response
 
@@ -0,0 +1,168 @@
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Run as a script: instrumentation.py is not on sys.path yet (see delivery_call.py)
+if __name__ == '__main__':
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import get_logger, metrics
+
+log = get_logger('delivery.dialer')
+
+
+class TokenBucket:
+    """Thread-safe token bucket: at most `rate` acquisitions per second, bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_retryable(error):
+    """Throttling, server errors and network failures are worth retrying; other 4xx are not."""
+    status = getattr(error, 'status', None)
+    if status is None:
+        return True
+    return status == 429 or status >= 500
+
+
+class Dialer:
+    """Places outbound calls on a bounded thread pool under a calls-per-second limit.
+
+    `client` is anything with `client.calls.create(to=, from_=, url=)` (a twilio
+    Client or fake_twilio.FakeTwilioClient). Failed attempts are retried per number
+    with exponential backoff and jitter; every attempt, retries included, takes a
+    token from the rate limiter.
+    """
+
+    def __init__(self, client, from_number, rate=1.0, workers=8, max_attempts=3, backoff=1.0):
+        self.client = client
+        self.from_number = from_number
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    def _dial_one(self, customer, webhook_base_url):
+        row_index = customer['row_id']
+        to_number = str(customer['mobile_number'])
+        webhook_url = f'{webhook_base_url}/voice/{row_index}'
+        result = {'row': row_index, 'number': to_number, 'name': customer.get('name')}
+        for attempt in range(1, self.max_attempts + 1):
+            with metrics.stage('rate_limit'):
+                self.bucket.acquire()
+            try:
+                with metrics.stage('dial'):
+                    call = self.client.calls.create(to=to_number, from_=self.from_number, url=webhook_url)
+            except Exception as e:
+                if attempt == self.max_attempts or not is_retryable(e):
+                    metrics.inc('calls_failed_total', reason='unverified' if 'unverified' in str(e).lower() else
+                                'retries_exhausted' if is_retryable(e) else 'rejected')
+                    return {**result, 'status': 'failed', 'attempts': attempt, 'error': str(e)}
+                metrics.inc('call_attempt_retries_total')
+                time.sleep(self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+                continue
+            metrics.inc('calls_placed_total')
+            return {**result, 'status': 'initiated', 'attempts': attempt, 'sid': call.sid}
+
+    def dial(self, customers, webhook_base_url):
+        """Yield one result dict per customer, in completion order."""
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='dialer')
+        try:
+            futures = [pool.submit(self._dial_one, customer, webhook_base_url) for customer in customers]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # Stop queued calls if the caller stops iterating (e.g. a Campaign's run raised)
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+class Campaign:
+    """A round of calls that runs to the end on its own thread, whoever is watching.
+
+    `run` is a zero-argument callable returning an iterator of result dicts,
+    typically a generator over Dialer.dial that records each outcome. Consuming
+    it here rather than in an HTTP response means a client that disconnects
+    early does not cancel the calls not yet placed. follow() yields every result
+    so far and then the new ones as they arrive, until the run ends.
+    """
+
+    def __init__(self, run, total=None):
+        self.total = total
+        self.results = []
+        self.done = False
+        self.error = None
+        self._run = run
+        self._changed = threading.Condition()
+        self._thread = threading.Thread(target=self._consume, name='campaign', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _consume(self):
+        try:
+            for result in self._run():
+                with self._changed:
+                    self.results.append(result)
+                    self._changed.notify_all()
+        except Exception as e:
+            self.error = str(e)
+            log.error("❌ Campaign failed", exc_info=True, error=self.error, dialed=len(self.results))
+        finally:
+            with self._changed:
+                self.done = True
+                self._changed.notify_all()
+
+    def follow(self):
+        seen = 0
+        while True:
+            with self._changed:
+                while seen == len(self.results) and not self.done:
+                    self._changed.wait()
+                new, done = self.results[seen:], self.done
+            seen += len(new)
+            yield from new
+            if done:
+                return
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+        return self.done
+
+
+if __name__ == '__main__':
+    # Load test against the local fake: python dialer.py [customers] [rate] [workers]
+    from fake_twilio import FakeTwilioClient
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 50
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+    dialer = Dialer(FakeTwilioClient(latency=0.3, error_rate=0.1), '+10000000000', rate=rate,
+                    workers=workers, backoff=0.2)
+    customers = [{'row_id': i, 'mobile_number': f'+1555{i:07d}', 'name': f'Customer {i}'} for i in range(n)]
+    start = time.perf_counter()
+    results = list(dialer.dial(customers, 'http://localhost:5000'))
+    elapsed = time.perf_counter() - start
+    failed = sum(r['status'] == 'failed' for r in results)
+    retried = sum(r['attempts'] > 1 for r in results)
+    print(f"{n} calls in {elapsed:.2f}s ({n / elapsed:.1f} calls/s, limit {rate}/s) - "
+          f"{failed} failed, {retried} needed a retry")
@@ -0,0 +1,43 @@
+import itertools
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from twilio.base.exceptions import TwilioRestException
+
+
+class _FakeCalls:
+    def __init__(self, owner):
+        self._owner = owner
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create(self, to, from_, url, **kwargs):
+        owner = self._owner
+        time.sleep(max(0.0, owner.rng.gauss(owner.latency, owner.jitter)))
+        if owner.rng.random() < owner.error_rate:
+            # Mostly throttling, some server errors - the kinds the dialer retries
+            status = 429 if owner.rng.random() < 0.7 else 503
+            raise TwilioRestException(status, '/Calls.json', f'Simulated HTTP {status}')
+        with self._lock:
+            sid = f'CAFAKE{next(self._ids):026d}'
+            owner.placed.append({'sid': sid, 'to': to, 'from': from_, 'url': url})
+        return SimpleNamespace(sid=sid, to=to, status='queued')
+
+
+class FakeTwilioClient:
+    """Stand-in for twilio.rest.Client for local load tests.
+
+    calls.create sleeps for a simulated API latency and fails `error_rate` of the
+    time with a TwilioRestException. Successful calls are recorded in `placed`.
+    """
+
+    def __init__(self, latency=0.2, jitter=0.05, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.placed = []
+        self.calls = _FakeCalls(self)
+        self.outgoing_caller_ids = SimpleNamespace(list=lambda: [])
@@ -1,44 +1,229 @@
+import argparse
+import os
+import random
+import re
+import sys
+import threading
+import time
+
 import pandas as pd
-from delivery_call import make_call, load_data, save_data
 
-def retry_missed_calls(webhook_base_url):
+# Run as a script: instrumentation.py is not on sys.path yet (see delivery_call.py)
+if __name__ == '__main__':
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import get_logger
+
+log = get_logger('delivery.retry')
+
+# Country code assumed for numbers uploaded without one (e.g. 8817577592)
+DEFAULT_COUNTRY_CODE = os.getenv('DEFAULT_COUNTRY_CODE', '91')
+
+
+def normalize_e164(number, country_code=DEFAULT_COUNTRY_CODE):
+    """Normalize a phone number as it appears in a customer CSV to E.164 (+<digits>).
+
+    Handles separators, CSV floats (918817577592.0), 00 international prefixes,
+    national numbers with a leading trunk 0 and numbers without a country code.
+    Returns None for values that cannot be a phone number.
+    """
+    if number is None or (isinstance(number, float) and number != number):
+        return None
+    text = str(number).strip()
+    if re.fullmatch(r'\+?\d+\.0+', text):
+        text = text.split('.')[0]
+    international = text.startswith('+')
+    digits = re.sub(r'\D', '', text)
+    if not international and digits.startswith('00'):
+        digits, international = digits[2:], True
+    if not international:
+        if len(digits) == 11 and digits.startswith('0'):
+            digits = country_code + digits[1:]
+        elif len(digits) <= 10:
+            digits = country_code + digits
+    if not 8 <= len(digits) <= 15:
+        return None
+    return f'+{digits}'
+
+
+class RetryScheduler:
+    """Re-dials customers whose calls could not be placed, with backoff per customer.
+
+    The retry queue lives in the call store (`retries` table): each entry has the
+    number of retry rounds so far and the time the customer is next eligible, so
+    the queue survives restarts. Due customers are dialed concurrently through a
+    dialer.Dialer (and its rate limit). After a failed round a customer waits
+    `base_delay * 2**(attempts - 1)` seconds (capped at `max_delay`, with jitter),
+    and is given up on after `max_attempts` rounds.
+
+    Missed numbers are matched to customers through a normalized E.164 index
+    built once from the store; call reindex() after a new customer upload.
+    """
+
+    def __init__(self, store, dialer, max_attempts=5, base_delay=60.0, max_delay=3600.0,
+                 poll_interval=10.0, country_code=DEFAULT_COUNTRY_CODE):
+        self.store = store
+        self.dialer = dialer
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.country_code = country_code
+        self.webhook_base_url = None
+        self._index = None
+        self._round_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def reindex(self):
+        index = {}
+        for row_id, number in self.store.numbers():
+            # Keep the first row for numbers that appear more than once, as before
+            index.setdefault(normalize_e164(number, self.country_code), row_id)
+        index.pop(None, None)
+        self._index = index
+        return len(index)
+
+    def lookup(self, number):
+        if self._index is None:
+            self.reindex()
+        return self._index.get(normalize_e164(number, self.country_code))
+
+    def _delay(self, attempts):
+        delay = min(self.base_delay * 2 ** max(attempts - 1, 0), self.max_delay)
+        return delay * random.uniform(0.5, 1.5)
+
+    def record_failure(self, row_id, error=None, now=None):
+        """Queue (or re-queue) a customer after a failed call."""
+        now = time.time() if now is None else now
+        entry = self.store.get_retry(row_id)
+        attempts = entry['attempts'] if entry else 0
+        self.store.set_retry(row_id, attempts, now + self._delay(attempts), error)
+
+    def record_success(self, row_id):
+        """Drop a customer from the retry queue once a call to them was placed (by a campaign or a retry)."""
+        self.store.clear_retry(row_id)
+
+    def due(self, now=None):
+        """Queued customers whose next retry is due and who have attempts left, soonest first."""
+        return self.store.due_retries(time.time() if now is None else now, self.max_attempts)
+
+    def schedule_missed(self, missed_rows, now=None):
+        """Queue customers from missed-call rows (dicts with mobile_number); returns (queued, unmatched)."""
+        now = time.time() if now is None else now
+        queued, unmatched = 0, []
+        for row in missed_rows:
+            row_id = self.lookup(row.get('mobile_number'))
+            if row_id is None:
+                unmatched.append(row.get('mobile_number'))
+            elif self.store.get_retry(row_id) is None:
+                self.store.set_retry(row_id, 0, now)
+                queued += 1
+        return queued, unmatched
+
+    def run_once(self, webhook_base_url=None, now=None):
+        """Dial every customer that is due now; yields dialer result dicts (plus `retry`).
+
+        Yields nothing if another round is already running.
+        """
+        webhook_base_url = webhook_base_url or self.webhook_base_url
+        if not webhook_base_url:
+            raise ValueError('webhook_base_url is required to place retry calls')
+        if not self._round_lock.acquire(blocking=False):
+            return
+        try:
+            due = self.due(now)
+            if not due:
+                return
+            attempts = {customer['row_id']: customer['attempts'] + 1 for customer in due}
+            for customer in due:
+                customer['mobile_number'] = (normalize_e164(customer['mobile_number'], self.country_code)
+                                             or customer['mobile_number'])
+            for result in self.dialer.dial(due, webhook_base_url):
+                row_id = result['row']
+                if result['status'] == 'initiated':
+                    self.record_success(row_id)
+                else:
+                    done = attempts[row_id]
+                    self.store.set_retry(row_id, done, time.time() + self._delay(done), result['error'])
+                yield {**result, 'retry': attempts[row_id]}
+        finally:
+            self._round_lock.release()
+
+    def _loop(self):
+        while not self._stop.wait(self.poll_interval):
+            if not self.webhook_base_url:
+                continue
+            try:
+                for result in self.run_once():
+                    status = '✅' if result['status'] == 'initiated' else '❌'
+                    log.info(f"🔁 {status} Retry", retry=result['retry'], name=result['name'], number=result['number'],
+                             error=result.get('error'))
+            except Exception as e:
+                log.error("❌ Retry round failed", exc_info=True, error=str(e))
+
+    def start(self):
+        """Run retry rounds every `poll_interval` seconds on a daemon thread."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='retry-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def status(self):
+        queue = self.store.retries()
+        return {
+            'queued': sum(entry['attempts'] < self.max_attempts for entry in queue),
+            'exhausted': sum(entry['attempts'] >= self.max_attempts for entry in queue),
+            'max_attempts': self.max_attempts,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'entries': queue,
+        }
+
+
+def retry_missed_calls(webhook_base_url, missed_csv='missed_calls.csv', loop=False):
+    """Queue the customers in `missed_csv` and re-dial them through the app's retry scheduler."""
+    from delivery_call import retry_scheduler
+
     try:
-        missed_df = pd.read_csv('missed_calls.csv')
+        missed_df = pd.read_csv(missed_csv, dtype={'mobile_number': str})
     except Exception as e:
-        print(f"No missed_calls.csv found or error reading: {e}")
-        return
-    if missed_df.empty:
-        print("No missed calls to retry.")
-        return
-    df = load_data()
-    successful = 0
-    failed = 0
-    new_missed = []
-    for idx, row in missed_df.iterrows():
-        print(f"Retrying call to {row['name']} ({row['mobile_number']})...")
-        # Find the index in the main df
-        main_idx = df.index[df['mobile_number'] == row['mobile_number']].tolist()
-        if main_idx:
-            main_idx = main_idx[0]
-        else:
-            print(f"Number {row['mobile_number']} not found in main CSV, skipping.")
-            continue
-        if make_call(row, main_idx, webhook_base_url):
-            successful += 1
-        else:
-            failed += 1
-            new_missed.append(row.to_dict())
-    print(f"\nRetry Summary: {successful} successful, {failed} failed.")
-    if new_missed:
-        pd.DataFrame(new_missed).to_csv('missed_calls.csv', index=False)
-        print(f"Missed calls updated in missed_calls.csv.")
-    else:
-        print("All missed calls succeeded. Removing missed_calls.csv.")
-        import os
-        os.remove('missed_calls.csv')
+        print(f"No {missed_csv} found or error reading: {e}")
+        missed_df = pd.DataFrame(columns=['mobile_number'])
+    queued, unmatched = retry_scheduler.schedule_missed(missed_df.to_dict('records'))
+    for number in unmatched:
+        print(f"Number {number} not found in the customer list, skipping.")
+    print(f"Queued {queued} missed calls for retry")
+
+    while True:
+        results = list(retry_scheduler.run_once(webhook_base_url))
+        successful = sum(result['status'] == 'initiated' for result in results)
+        if results:
+            print(f"Retry round: {successful} successful, {len(results) - successful} failed.")
+        status = retry_scheduler.status()
+        if not loop:
+            break
+        if not status['queued']:
+            print("Retry queue is empty.")
+            break
+        time.sleep(retry_scheduler.poll_interval)
+    print(f"{status['queued']} customers waiting for a retry, {status['exhausted']} gave up after "
+          f"{status['max_attempts']} attempts.")
+
 
 if __name__ == '__main__':
-    webhook_base_url = input("Enter your ngrok URL (e.g., https://xxxx.ngrok-free.app): ").strip()
+    parser = argparse.ArgumentParser(description='Retry calls that could not be placed.')
+    parser.add_argument('--webhook-base-url', default=os.getenv('PUBLIC_BASE_URL'),
+                        help='public URL of this server (e.g. https://xxxx.ngrok-free.app)')
+    parser.add_argument('--missed-csv', default='missed_calls.csv')
+    parser.add_argument('--loop', action='store_true', help='keep retrying until the queue is empty')
+    args = parser.parse_args()
+    if not args.webhook_base_url:
+        parser.error('--webhook-base-url or PUBLIC_BASE_URL is required')
+    webhook_base_url = args.webhook_base_url
     if not webhook_base_url.startswith('http'):
         webhook_base_url = f'https://{webhook_base_url}'
-    retry_missed_calls(webhook_base_url)
+    retry_missed_calls(webhook_base_url, args.missed_csv, args.loop)
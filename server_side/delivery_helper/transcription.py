@@ -0,0 +1,378 @@
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import requests
+import speech_recognition as sr
+
+# Run as a script: instrumentation.py is not on sys.path yet (see delivery_call.py)
+if __name__ == '__main__':
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import get_logger, metrics
+
+log = get_logger('delivery.transcription')
+
+# Tried in this order; Twilio serves the same recording in each format
+RECORDING_FORMATS = ['.wav', '.mp3', '']
+# Files every backend can read (sr.AudioFile: WAV, AIFF, FLAC). '.audio' is a
+# download saved without an extension, which Twilio serves as WAV.
+AUDIO_EXTENSIONS = ('.wav', '.audio', '.aif', '.aiff', '.aifc', '.flac')
+
+# Values of the transcription_status column
+QUEUED = 'queued'
+DOWNLOADING = 'downloading'
+TRANSCRIBING = 'transcribing'
+DONE = 'done'
+FAILED = 'failed'
+NO_RECORDING = 'no_recording'
+PENDING_STATUSES = (QUEUED, DOWNLOADING, TRANSCRIBING)
+
+# One transcribed clip: text is None when error is set; seconds is wall time spent on it
+ClipResult = namedtuple('ClipResult', ['path', 'text', 'error', 'seconds', 'audio_seconds'])
+
+
+def _read_audio(path):
+    with sr.AudioFile(path) as source:
+        return sr.Recognizer().record(source)
+
+
+class TranscriptionBackend:
+    """Speech-to-text engine. Subclasses load their recognizer/model once in __init__
+    and reuse it for every clip, from any thread."""
+
+    name = None
+
+    def transcribe(self, path):
+        raise NotImplementedError
+
+    def transcribe_batch(self, paths):
+        """Transcribe `paths` in order; a clip that fails does not fail the batch."""
+        results = []
+        for path in paths:
+            start = time.perf_counter()
+            try:
+                text, error = self.transcribe(path), None
+            except Exception as e:
+                text, error = None, str(e)
+            try:
+                with sr.AudioFile(path) as source:
+                    audio_seconds = source.DURATION
+            except Exception:
+                audio_seconds = None
+            results.append(ClipResult(path, text, error, time.perf_counter() - start, audio_seconds))
+        return results
+
+
+class GoogleBackend(TranscriptionBackend):
+    """Google Web Speech API (network). One sr.Recognizer per thread."""
+
+    name = 'google'
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def transcribe(self, path):
+        recognizer = getattr(self._local, 'recognizer', None)
+        if recognizer is None:
+            recognizer = self._local.recognizer = sr.Recognizer()
+        with sr.AudioFile(path) as source:
+            audio_data = recognizer.record(source)
+        return recognizer.recognize_google(audio_data)
+
+
+class VoskBackend(TranscriptionBackend):
+    """Offline recognition with a Vosk model, loaded once and shared by all clips.
+
+    Needs `pip install vosk` and a model directory from https://alphacephei.com/vosk/models
+    (VOSK_MODEL_PATH, default ./vosk-model).
+    """
+
+    name = 'vosk'
+    sample_rate = 16000
+
+    def __init__(self, model_path=None):
+        try:
+            import vosk
+        except ImportError:
+            raise RuntimeError('The vosk transcription backend needs `pip install vosk`')
+        vosk.SetLogLevel(-1)
+        self._vosk = vosk
+        self.model = vosk.Model(model_path or os.getenv('VOSK_MODEL_PATH', 'vosk-model'))
+
+    def transcribe(self, path):
+        pcm = _read_audio(path).get_raw_data(convert_rate=self.sample_rate, convert_width=2)
+        recognizer = self._vosk.KaldiRecognizer(self.model, self.sample_rate)
+        recognizer.AcceptWaveform(pcm)
+        return json.loads(recognizer.FinalResult()).get('text', '')
+
+
+class StubBackend(TranscriptionBackend):
+    """Fixed text after an optional simulated delay, for tests and pipeline benchmarks."""
+
+    name = 'stub'
+
+    def __init__(self, text='yes please deliver after 5 pm', delay=0.0):
+        self.text = text
+        self.delay = float(delay)
+
+    def transcribe(self, path):
+        _read_audio(path)
+        if self.delay:
+            time.sleep(self.delay)
+        return self.text
+
+
+BACKENDS = {backend.name: backend for backend in (GoogleBackend, VoskBackend, StubBackend)}
+
+
+def make_backend(name, **kwargs):
+    try:
+        return BACKENDS[name](**kwargs)
+    except KeyError:
+        raise ValueError(f'Unknown transcription backend {name!r}, choose from {sorted(BACKENDS)}')
+
+
+_worker_backend = None
+_worker_error = None
+
+
+def _init_worker(name, kwargs):
+    # A backend that cannot load (missing package/model) is reported per clip
+    # instead of killing the worker and breaking the whole pool
+    global _worker_backend, _worker_error
+    try:
+        _worker_backend = make_backend(name, **kwargs)
+    except Exception as e:
+        _worker_error = str(e)
+
+
+def _transcribe_in_worker(paths):
+    if _worker_backend is None:
+        return [ClipResult(path, None, _worker_error, 0.0, None) for path in paths]
+    return _worker_backend.transcribe_batch(paths)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def transcribe_files(paths, backend='google', workers=None, batch_size=8, **backend_kwargs):
+    """Transcribe many files across `workers` processes; yields ClipResults in input order.
+
+    Each worker process builds the backend once and then takes batches of
+    `batch_size` clips, so model loading is paid per process rather than per clip.
+    """
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(backend, backend_kwargs)) as pool:
+        for results in pool.map(_transcribe_in_worker, batches):
+            yield from results
+
+
+class TranscriptionPipeline:
+    """Downloads and transcribes call recordings off the webhook request path.
+
+    The /recording webhook only calls submit(). Worker threads then poll for the
+    recording (Twilio returns 404 until it has finished processing) with
+    exponential backoff, download it over one authenticated keep-alive session,
+    transcribe it and write the result back to the call store. Progress is kept in
+    the store's transcription_status column, and unfinished jobs are picked up
+    again by resume() after a restart.
+
+    Every job is owned by the process (pid) that runs it. resume() only takes over
+    rows whose owner has exited, with an atomic claim, so server workers that all
+    resume at start-up never transcribe the same recording twice. SQLite stores
+    are local to one host, so pids identify the processes sharing it.
+    """
+
+    def __init__(self, store, account_sid, auth_token, backend=None, workers=2, audio_dir='.',
+                 max_wait=60.0, initial_delay=1.0, max_delay=15.0, request_timeout=30.0, owner=None):
+        self.store = store
+        self._owner = owner
+        # Rows this process has queued or is working on
+        self._running = set()
+        self._running_lock = threading.Lock()
+        self.backend = backend or GoogleBackend()
+        self.audio_dir = audio_dir
+        self.max_wait = max_wait
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.request_timeout = request_timeout
+        self.session = requests.Session()
+        self.session.auth = (account_sid or '', auth_token or '')
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='transcribe')
+
+    @property
+    def owner(self):
+        # Looked up on every use: a pipeline built before a server forks its workers has no single pid
+        return self._owner or str(os.getpid())
+
+    def _start(self, row_index, recording_url):
+        with self._running_lock:
+            self._running.add(row_index)
+        self._pool.submit(self._process, row_index, recording_url)
+
+    def submit(self, row_index, recording_url):
+        self.store.update(row_index, transcription_status=QUEUED, transcription_owner=self.owner)
+        self._start(row_index, recording_url)
+
+    def resume(self):
+        """Re-queue recordings left in flight by processes that have exited; returns how many."""
+        owner, resumed = self.owner, 0
+        for row_index, recording_url, previous in self.store.pending_transcriptions(PENDING_STATUSES):
+            with self._running_lock:
+                if row_index in self._running:
+                    continue
+            # Our own pid on a row we are not running is left from an earlier process that had it
+            if previous is not None and previous != owner and _process_alive(previous):
+                continue
+            if self.store.claim_transcription(row_index, owner, previous, PENDING_STATUSES):
+                self._start(row_index, recording_url)
+                resumed += 1
+        return resumed
+
+    def _download(self, row_index, recording_url):
+        deadline = time.monotonic() + self.max_wait
+        delay = self.initial_delay
+        while True:
+            for ext in RECORDING_FORMATS:
+                try:
+                    with metrics.stage('download'):
+                        response = self.session.get(recording_url + ext, timeout=self.request_timeout)
+                except requests.RequestException as e:
+                    log.warning("❌ Failed to download audio", row=row_index, ext=ext, error=str(e))
+                    continue
+                if response.ok:
+                    path = os.path.join(self.audio_dir, f"recording_{row_index}{ext or '.audio'}")
+                    with open(path, 'wb') as out_file:
+                        out_file.write(response.content)
+                    metrics.inc('recordings_downloaded_total')
+                    log.info("✅ Audio downloaded", row=row_index, path=path, bytes=len(response.content))
+                    return path
+                if response.status_code != 404:
+                    log.warning("❌ Failed to download audio", row=row_index, ext=ext, status=response.status_code)
+            if time.monotonic() + delay > deadline:
+                return None
+            # Recording not ready yet (or a transient error): back off and poll again
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_delay)
+
+    def _process(self, row_index, recording_url):
+        try:
+            self.store.update(row_index, transcription_status=DOWNLOADING)
+            path = self._download(row_index, recording_url)
+            if path is None:
+                metrics.inc('transcriptions_failed_total', stage='download')
+                self.store.update(row_index, transcription='[Audio download failed]', transcription_status=FAILED)
+                return
+
+            self.store.update(row_index, transcription_status=TRANSCRIBING)
+            try:
+                with metrics.stage('transcribe', backend=type(self.backend).__name__):
+                    transcription = self.backend.transcribe(path)
+                metrics.inc('calls_transcribed_total')
+                log.info("✅ Transcription", row=row_index, text=transcription)
+                status = DONE
+            except Exception as e:
+                metrics.inc('transcriptions_failed_total', stage='transcribe')
+                log.warning("❌ Speech recognition failed", row=row_index, error=str(e))
+                transcription, status = '[Speech recognition failed]', FAILED
+            self.store.update(row_index, transcription=transcription, transcription_status=status)
+            log.info("✅ Recording and transcription saved", row=row_index, url=recording_url)
+        except Exception as e:
+            metrics.inc('transcriptions_failed_total', stage='pipeline')
+            log.error("❌ Transcription job failed", exc_info=True, row=row_index, error=str(e))
+            self.store.update(row_index, transcription_status=FAILED)
+        finally:
+            with self._running_lock:
+                self._running.discard(row_index)
+
+
+def _synthesize_wavs(directory, count, seconds=3.0, rate=8000):
+    """Write `count` short tone WAVs named like downloaded recordings (for benchmarks)."""
+    import math
+    import struct
+    import wave
+    os.makedirs(directory, exist_ok=True)
+    frames = b''.join(struct.pack('<h', int(8000 * math.sin(2 * math.pi * 440 * i / rate)))
+                      for i in range(int(seconds * rate)))
+    for row_index in range(count):
+        with wave.open(os.path.join(directory, f'recording_{row_index}.wav'), 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(rate)
+            w.writeframes(frames)
+
+
+def recording_paths(directory):
+    """Sorted recording_* files in `directory` the backends can read, and the number skipped."""
+    paths = sorted(glob.glob(os.path.join(directory, 'recording_*')))
+    readable = [path for path in paths if os.path.splitext(path)[1].lower() in AUDIO_EXTENSIONS]
+    return readable, len(paths) - len(readable)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcribe the backlog of recording_* files and report throughput.')
+    parser.add_argument('directory', nargs='?', default='.')
+    parser.add_argument('--backend', default=os.getenv('TRANSCRIBE_BACKEND', 'google'), choices=sorted(BACKENDS))
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--stub-delay', type=float, default=0.0, help='simulated seconds per clip (stub backend)')
+    parser.add_argument('--store', help='call store (sqlite) to write transcriptions back to')
+    parser.add_argument('--synthesize', type=int, default=0, help='first write N sample WAVs into directory')
+    args = parser.parse_args()
+
+    if args.synthesize:
+        _synthesize_wavs(args.directory, args.synthesize)
+    paths, skipped = recording_paths(args.directory)
+    if skipped:
+        print(f"Skipping {skipped} recording_* files not in {', '.join(AUDIO_EXTENSIONS)}")
+    if not paths:
+        print(f"No readable recording_* files in {args.directory}")
+        return
+    backend_kwargs = {'delay': args.stub_delay} if args.backend == 'stub' else {}
+    store = None
+    if args.store:
+        from call_store import CallStore
+        store = CallStore(args.store)
+
+    start = time.perf_counter()
+    latencies, audio_total, failed = [], 0.0, 0
+    for result in transcribe_files(paths, args.backend, args.workers, args.batch_size, **backend_kwargs):
+        latencies.append(result.seconds)
+        audio_total += result.audio_seconds or 0
+        failed += result.error is not None
+        print(f"{os.path.basename(result.path):<24} {result.seconds * 1000:8.1f}ms  "
+              f"{result.text if result.error is None else '[error] ' + result.error}")
+        match = re.search(r'recording_(\d+)\.', os.path.basename(result.path))
+        if store is not None and match:
+            if result.error is None:
+                store.update(int(match.group(1)), transcription=result.text, transcription_status=DONE)
+            else:
+                store.update(int(match.group(1)), transcription='[Speech recognition failed]',
+                             transcription_status=FAILED)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"\n{len(paths)} clips ({failed} failed) with backend={args.backend} workers={args.workers}: "
+          f"{elapsed:.2f}s, {len(paths) / elapsed:.1f} clips/s, {audio_total / elapsed:.1f} audio-s/s, "
+          f"per-clip p50={p50 * 1000:.1f}ms p99={p99 * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+"""Metrics, stage timers, request profiling and structured logs shared by the predictor and delivery services.
+
+It lives in the directory above both services. Their entry points (app.py,
+delivery_call.py and the standalone scripts) put that directory on sys.path
+once; every other module just does `from instrumentation import metrics`.
+
+Metrics are kept per process. Behind a multi-worker server, scrape each worker
+(or run one worker per port); work done in pool processes is timed by the
+process that waits for it.
+"""
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# text (human readable) or json (one object per line)
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# Fraction of requests run under the stack sampler; 0 disables profiling
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_SECONDS', 0.005))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+METRIC_PREFIX = 'predelix_'
+_NULL_TIMER = nullcontext()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels, extra=()):
+    items = [*labels, *extra]
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in items) + '}' if items else ''
+
+
+class Metrics:
+    """Process-local counters and latency histograms in the Prometheus text format.
+
+    Updates are a dict lookup under a lock; with `enabled` False they return
+    immediately and timers are a shared no-op context manager.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, enabled=METRICS_ENABLED):
+        self.buckets = tuple(buckets)
+        self.enabled = enabled
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._gauges = []
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        bucket = bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # One count per bucket plus +Inf, then sum and count
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            histogram[bucket] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def timer(self, name, **labels):
+        """Context manager that observes its duration into histogram `name`."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return self._timer(name, labels)
+
+    @contextmanager
+    def _timer(self, name, labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def stage(self, stage, **labels):
+        """Time one processing stage (parse, predict, dial, transcribe, ...)."""
+        return self.timer('stage_seconds', stage=stage, **labels)
+
+    def gauge(self, name, fn, help_text=None):
+        """Report fn() (a number, or a {labels tuple: value} dict) as gauge `name` at every scrape."""
+        self._gauges.append((name, fn))
+        if help_text:
+            self.describe(name, help_text)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters), {key: list(value) for key, value in self._histograms.items()}
+
+    def render(self):
+        counters, histograms = self.snapshot()
+        lines = []
+
+        def header(name, kind):
+            full = METRIC_PREFIX + name
+            lines.append(f'# HELP {full} {self._help.get(name, name.replace("_", " "))}')
+            lines.append(f'# TYPE {full} {kind}')
+            return full
+
+        for name in sorted({name for name, _ in counters}):
+            full = header(name, 'counter')
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{full}{_labels(labels)} {value}')
+        for name in sorted({name for name, _ in histograms}):
+            full = header(name, 'histogram')
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip([*self.buckets, '+Inf'], values):
+                    cumulative += count
+                    lines.append(f'{full}_bucket{_labels(labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{full}_sum{_labels(labels)} {values[-2]:.6f}')
+                lines.append(f'{full}_count{_labels(labels)} {values[-1]}')
+        for name, fn in self._gauges:
+            try:
+                value = fn()
+            except Exception as e:
+                get_logger('metrics').warning('⚠️  Gauge failed', gauge=name, error=str(e))
+                continue
+            full = header(name, 'gauge')
+            for labels, number in (value.items() if isinstance(value, dict) else [((), value)]):
+                lines.append(f'{full}{_labels(labels)} {number}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+metrics.describe('stage_seconds', 'Time spent in each processing stage')
+metrics.describe('http_request_seconds', 'Request latency by endpoint, until the response body is fully sent')
+metrics.describe('http_requests_total', 'Requests by endpoint and status')
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return line
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'ts': round(record.created, 3), 'level': record.levelname.lower(), 'logger': record.name,
+                 'msg': record.getMessage(), **getattr(record, 'fields', {})}
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class StructuredLogger:
+    """logging.Logger wrapper taking key=value fields: log.info('✅ Loaded model', version=v).
+
+    The level check comes first, so a disabled call costs one cached comparison.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def _log(self, level, msg, fields, exc_info=False):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, msg, extra={'fields': fields}, exc_info=exc_info)
+
+    def debug(self, msg, **fields):
+        self._log(logging.DEBUG, msg, fields)
+
+    def info(self, msg, **fields):
+        self._log(logging.INFO, msg, fields)
+
+    def warning(self, msg, **fields):
+        self._log(logging.WARNING, msg, fields)
+
+    def error(self, msg, exc_info=False, **fields):
+        self._log(logging.ERROR, msg, fields, exc_info)
+
+    def enabled(self, level=logging.DEBUG):
+        return self.logger.isEnabledFor(level)
+
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    """Send every service logger to one stdout handler (text or json); safe to call again."""
+    global _configured
+    with _configure_lock:
+        root = logging.getLogger('predelix')
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        handler = logging.StreamHandler(stream or sys.stdout)
+        handler.setFormatter(_JsonFormatter() if fmt == 'json' else
+                             _TextFormatter('%(asctime)s %(levelname)-7s %(message)s'))
+        root.addHandler(handler)
+        root.setLevel(level)
+        root.propagate = False
+        _configured = True
+
+
+def get_logger(name):
+    if not _configured:
+        configure_logging()
+    return StructuredLogger(logging.getLogger(f'predelix.{name}'))
+
+
+class StackSampler:
+    """Sampling profiler for one thread: reads its Python stack every `interval` seconds.
+
+    A helper thread looks at sys._current_frames(), so the profiled code is not
+    traced and runs at full speed. Stacks are counted in the collapsed format
+    flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL_SECONDS):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def stop(self, path=None):
+        """Stop sampling; write the collapsed stacks to `path` if given. Returns the sample counts."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if path and self.samples:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'w') as f:
+                f.writelines(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+        return self.samples
+
+
+def instrument_app(app, service, profiler=StackSampler, profile_rate=PROFILE_SAMPLE_RATE, profile_dir=PROFILE_DIR):
+    """Time every request of a Flask app, serve GET /metrics and sample-profile a fraction of requests.
+
+    Request time runs until the response body has been sent, so streamed
+    responses count in full. Endpoints are labelled by route rule, not by path.
+    `profiler` is any class with start() and stop(path); a profiled request
+    writes `<profile_dir>/<service>-<endpoint>-<ns>.folded`.
+    """
+    from flask import Response, g, request
+
+    log = get_logger(service)
+    start_time = time.time()
+    metrics.gauge('process_start_time_seconds', lambda: start_time, 'Unix time the process started')
+
+    @app.before_request
+    def _start_request():
+        g.instrumentation_start = time.perf_counter()
+        if profile_rate and random.random() < profile_rate:
+            g.instrumentation_profiler = profiler().start()
+
+    @app.after_request
+    def _finish_request(response):
+        start = g.pop('instrumentation_start', None)
+        if start is None:
+            return response
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        method, status = request.method, response.status_code
+        sampler = g.pop('instrumentation_profiler', None)
+
+        def done():
+            seconds = time.perf_counter() - start
+            metrics.observe('http_request_seconds', seconds, service=service, endpoint=endpoint, method=method)
+            metrics.inc('http_requests_total', service=service, endpoint=endpoint, method=method, status=status)
+            if sampler is not None:
+                name = re.sub(r'[^A-Za-z0-9]+', '_', endpoint).strip('_') or 'root'
+                path = os.path.join(profile_dir, f'{service}-{name}-{time.time_ns()}.folded')
+                sampler.stop(path)
+                log.info('🔬 Request profile written', path=path, endpoint=endpoint, seconds=round(seconds, 4))
+            log.debug('request', method=method, endpoint=endpoint, status=status, seconds=round(seconds, 4))
+
+        if response.direct_passthrough:
+            # send_file responses go to the server as they are and never run close callbacks
+            done()
+        else:
+            response.call_on_close(done)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    return app
@@ -1,18 +1,86 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file
 import pandas as pd
 from io import BytesIO
 from flask_cors import CORS
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_squared_error
-import joblib
 import os
+import sys
+
+# instrumentation.py is shared with the delivery service and lives one directory up.
+# This entry point puts it on sys.path once, before any module of the service imports it.
+if (_shared_dir := os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) not in sys.path:
+    sys.path.append(_shared_dir)
+
+from artifact import FLAT_SUFFIX
+from cache import CachedResult, ResultCache, stream_sha256
+from features import FEATURE_HISTORY_DAYS, FeatureStore, entity_features
+from forecast import (MAX_HORIZON_DAYS, forecast_distribution, forecast_with_model, forecast_fallback, iter_fallback,
+                      iter_forecast)
+from ingest import IngestError, iter_sales_chunks, read_sales_window
+from instrumentation import get_logger, instrument_app, metrics
+from jobs import JobStore, TrainingQueue, spool_upload
+from partition import PartitionedForecaster
+from registry import ModelStore
+from render import DEFAULT_QUANTILES, PREDICT_STREAM_CHUNK_GROUPS, STREAM_FORMATS, columnar_json, gzip_chunks
+from training import TRAIN_N_JOBS, TRAINING_MODES, run_training_job
 
 app = Flask(__name__)
 CORS(app)
+# Request timers, GET /metrics and sampled request profiles
+instrument_app(app, 'predictor')
+log = get_logger('predictor')
+
+# 'pickle' (joblib) or 'flat' (artifact.FlatForest: compact, mmap-loaded, carries its metadata)
+MODEL_FORMAT = os.environ.get('MODEL_FORMAT', 'pickle')
+# Set MODEL_MMAP_MODE to an empty string to load the forest fully into memory
+MODEL_MMAP_MODE = os.environ.get('MODEL_MMAP_MODE', 'r') or None
+# One versioned model per tenant or dataset id (see registry.ModelStore)
+MODELS_DIR = os.environ.get('MODELS_DIR', 'models')
+# Model used by requests that do not name one
+DEFAULT_MODEL_ID = os.environ.get('DEFAULT_MODEL_ID', 'default')
+# Loaded models kept in memory, by count and by approximate tree bytes
+MODEL_CACHE_MAX_MODELS = int(os.environ.get('MODEL_CACHE_MAX_MODELS', 64))
+MODEL_CACHE_MAX_BYTES = int(os.environ.get('MODEL_CACHE_MAX_BYTES', 4 * 2 ** 30))
+# Published versions kept on disk per model, for rollback
+MODEL_KEEP_VERSIONS = int(os.environ.get('MODEL_KEEP_VERSIONS', 3))
+# The single model file of earlier releases; imported as DEFAULT_MODEL_ID on first start
+LEGACY_MODEL_PATH = 'stock_predictor_model' + (FLAT_SUFFIX if MODEL_FORMAT == 'flat' else '.pkl')
+LEGACY_MAPPING_PATH = 'id_mappings.pkl'
+
+# Uploads and job status files for background training
+TRAIN_JOBS_DIR = os.environ.get('TRAIN_JOBS_DIR', 'train_jobs')
+# Training jobs allowed to run at once in this process
+TRAIN_MAX_CONCURRENT = int(os.environ.get('TRAIN_MAX_CONCURRENT', 1))
+# Training history kept between uploads for incremental training, one directory per model id
+TRAINING_DATA_DIR = os.environ.get('TRAINING_DATA_DIR', 'training_data')
+
+# Rendered forecasts keyed by upload hash, model version and format
+PREDICT_CACHE_MAX_BYTES = int(os.environ.get('PREDICT_CACHE_MAX_BYTES', 256 * 2 ** 20))
+# Optional on-disk tier so cached forecasts survive a restart
+PREDICT_CACHE_DIR = os.environ.get('PREDICT_CACHE_DIR') or None
+PREDICT_CACHE_DISK_MAX_BYTES = int(os.environ.get('PREDICT_CACHE_DISK_MAX_BYTES', 2 * 2 ** 30))
+
+# Per-upload entity feature tables, so a repeat predict skips parsing and feature building
+FEATURE_STORE_DIR = os.environ.get('FEATURE_STORE_DIR') or None
+FEATURE_STORE_MAX_ENTRIES = int(os.environ.get('FEATURE_STORE_MAX_ENTRIES', 32))
+
+model_store = ModelStore(MODELS_DIR, MODEL_FORMAT, mmap_mode=MODEL_MMAP_MODE, max_models=MODEL_CACHE_MAX_MODELS,
+                         max_bytes=MODEL_CACHE_MAX_BYTES, keep_versions=MODEL_KEEP_VERSIONS)
+if model_store.current_version(DEFAULT_MODEL_ID) is None and os.path.exists(LEGACY_MODEL_PATH) and (
+        LEGACY_MODEL_PATH.endswith(FLAT_SUFFIX) or os.path.exists(LEGACY_MAPPING_PATH)):
+    log.info("📥 Imported model", path=LEGACY_MODEL_PATH, model_id=DEFAULT_MODEL_ID,
+             version=model_store.import_files(DEFAULT_MODEL_ID, LEGACY_MODEL_PATH, LEGACY_MAPPING_PATH))
+job_store = JobStore(TRAIN_JOBS_DIR)
+train_queue = TrainingQueue(job_store, max_concurrent=TRAIN_MAX_CONCURRENT)
+result_cache = ResultCache(PREDICT_CACHE_MAX_BYTES, PREDICT_CACHE_DIR, PREDICT_CACHE_DISK_MAX_BYTES)
+feature_store = FeatureStore(FEATURE_STORE_DIR, max_entries=FEATURE_STORE_MAX_ENTRIES)
+# Store-sharded scoring across PREDICT_WORKERS processes (see partition.py)
+forecaster = PartitionedForecaster()
 
-MODEL_PATH = 'stock_predictor_model.pkl'
-MAPPING_PATH = 'id_mappings.pkl'
+metrics.gauge('predict_cache_bytes', lambda: result_cache.stats()['bytes'], 'Bytes of rendered forecasts cached')
+metrics.gauge('predict_cache_entries', lambda: result_cache.stats()['entries'], 'Rendered forecasts cached')
+metrics.gauge('model_loads', lambda: model_store.loads, 'Model artifacts loaded by this process')
+metrics.gauge('models_loaded', lambda: model_store.stats()['loaded'], 'Models resident in memory')
+metrics.gauge('models_bytes', lambda: model_store.stats()['bytes'], 'Approximate tree bytes of resident models')
 
 
 @app.route('/', methods=['GET'])
@@ -23,6 +91,18 @@ def home():
     })
 
 
+def _model_id():
+    """The model a request names with ?model_id=, a model_id form field or X-Model-Id; None if invalid."""
+    model_id = (request.args.get('model_id') or request.form.get('model_id') or request.headers.get('X-Model-Id')
+                or DEFAULT_MODEL_ID)
+    return model_id if ModelStore.valid_id(model_id) else None
+
+
+def _invalid_model_id():
+    return jsonify({'error': 'Invalid model_id: use 1-64 letters, digits, "_", "-" or "." '
+                             '(starting with a letter or digit)'}), 400
+
+
 @app.route('/api/train', methods=['POST'])
 def api_train():
     if 'file' not in request.files:
@@ -30,123 +110,284 @@ def api_train():
     file = request.files['file']
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
+    model_id = _model_id()
+    if model_id is None:
+        return _invalid_model_id()
+    mode = request.args.get('mode') or request.form.get('mode') or 'full'
+    if mode not in TRAINING_MODES:
+        return jsonify({'error': f'Unknown training mode {mode!r}, expected one of {list(TRAINING_MODES)}'}), 400
+
+    upload_path, dataset_hash = spool_upload(file, TRAIN_JOBS_DIR)
     try:
-        df = pd.read_csv(file)
-    except Exception as e:
-        return jsonify({'error': f'Failed to read CSV: {str(e)}'}), 400
+        # Reject malformed uploads now rather than as a failed job
+        next(iter_sales_chunks(upload_path, chunk_rows=1000), None)
+    except IngestError as e:
+        os.remove(upload_path)
+        return jsonify({'error': str(e)}), 400
 
-    required_cols = {'store_id', 'product_id', 'date', 'sales', 'stock'}
-    if not required_cols.issubset(df.columns):
-        return jsonify({'error': f'Missing columns. Required: {required_cols}'}), 400
+    job, created = train_queue.submit(f'{model_id}.{dataset_hash}.{mode}', run_training_job, upload_path,
+                                      TRAIN_JOBS_DIR, MODELS_DIR, model_id, MODEL_FORMAT, TRAINING_DATA_DIR, mode,
+                                      TRAIN_N_JOBS, dataset_hash)
+    if not created:
+        os.remove(upload_path)
+    return jsonify({
+        'message': 'Training job queued' if created else 'Identical dataset is already being trained',
+        'model_id': model_id,
+        'job_id': job['id'],
+        'status': job['status'],
+        'status_url': f"/api/train/{job['id']}",
+    }), 202
 
-    try:
-        df['date'] = pd.to_datetime(df['date'])
-    except Exception as e:
-        return jsonify({'error': f'Invalid date format: {str(e)}'}), 400
 
-    df['date_ordinal'] = df['date'].map(pd.Timestamp.toordinal)
-    df['store_id'] = df['store_id'].astype('category')
-    df['product_id'] = df['product_id'].astype('category')
+@app.route('/api/train/<job_id>', methods=['GET'])
+def api_train_status(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown training job'}), 404
+    return jsonify(job)
+
 
-    # Save mapping of encoded to original values
-    store_mapping = dict(enumerate(df['store_id'].cat.categories))
-    product_mapping = dict(enumerate(df['product_id'].cat.categories))
-    joblib.dump({'store': store_mapping, 'product': product_mapping}, MAPPING_PATH)
+@app.route('/api/predict', methods=['POST'])
+def api_predict():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part in request'}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+    model_id = _model_id()
+    if model_id is None:
+        return _invalid_model_id()
+    fmt = request.args.get('format') if request.args.get('format') in STREAM_FORMATS else 'json'
+    # A model id that was never trained gets the sales-average fallback, like a fresh install
+    snapshot = model_store.get(model_id)
+    model_version = 'fallback' if snapshot is None else snapshot.name
+    upload_hash = stream_sha256(file.stream)
+    if fmt == 'ndjson' or request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return _stream_prediction(file, snapshot, model_version, upload_hash, fmt)
+    cache_key = f'{upload_hash}.{fmt}'
+    cached = result_cache.get(model_version, cache_key, namespace=model_id)
+    if cached is not None:
+        metrics.inc('predict_cache_total', result='hit')
+        return _cached_response(cached, fmt, 'HIT')
+    metrics.inc('predict_cache_total', result='miss')
 
-    df['store_id'] = df['store_id'].cat.codes
-    df['product_id'] = df['product_id'].cat.codes
+    stored = feature_store.get(upload_hash) if snapshot is not None else None
+    if stored is not None:
+        # Features for this upload were built by an earlier request: lookup plus score
+        metrics.inc('feature_store_total', result='hit')
+        entities, last_date = stored
+        pred_df = forecast_with_model(None, last_date, snapshot.model, snapshot.encoders['store'],
+                                      snapshot.encoders['product'], entities=entities, forecaster=forecaster)
+    else:
+        try:
+            with metrics.stage('parse'):
+                window = read_sales_window(file, window=FEATURE_HISTORY_DAYS)
+        except IngestError as e:
+            return jsonify({'error': str(e)}), 400
+        df = window.frame
 
-    X = df[['store_id', 'product_id', 'date_ordinal', 'sales']]
-    y = df['stock']
+        if window.last_date is None:
+            pred_df = pd.DataFrame()
+        elif snapshot is not None:
+            metrics.inc('feature_store_total', result='miss')
+            with metrics.stage('features'):
+                entities = entity_features(df)
+            feature_store.put(upload_hash, entities, window.last_date)
+            pred_df = forecast_with_model(df, window.last_date, snapshot.model, snapshot.encoders['store'],
+                                          snapshot.encoders['product'], entities=entities, forecaster=forecaster)
+        else:
+            # Fallback logic
+            with metrics.stage('fallback'):
+                pred_df = forecast_fallback(df, window.last_date)
+    unseen_groups = pred_df.attrs.get('unseen_groups', 0)
+    if unseen_groups:
+        metrics.inc('unseen_groups_total', unseen_groups)
+        log.warning("⚠️  Store/product groups not seen in training, used sales average", groups=unseen_groups)
 
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-    model = RandomForestRegressor(n_estimators=100, random_state=42)
-    model.fit(X_train, y_train)
-    y_pred = model.predict(X_test)
-    mse = mean_squared_error(y_test, y_pred)
+    headers = {'X-Unseen-Groups': str(unseen_groups), 'X-Model-Version': model_version}
+    with metrics.stage('serialize', format=fmt):
+        if fmt == 'csv':
+            output = BytesIO()
+            pred_df.to_csv(output, index=False)
+            cached = CachedResult(output.getvalue(), 'text/csv', headers)
+        else:
+            cached = CachedResult(jsonify(pred_df.to_dict(orient='records')).get_data(), 'application/json', headers)
+    result_cache.put(model_version, cache_key, cached, namespace=model_id)
+    return _cached_response(cached, fmt, 'MISS')
 
-    joblib.dump(model, MODEL_PATH)
-    return jsonify({'message': 'Model trained and saved successfully!', 'mse': mse})
 
+def _stream_prediction(file, snapshot, model_version, upload_hash, fmt):
+    """Write the forecast as it is scored, one chunk of stores at a time.
 
-@app.route('/api/predict', methods=['POST'])
-def api_predict():
+    Time to first byte and memory depend on the chunk size rather than on the
+    number of groups. Streamed results bypass the rendered-result cache; the
+    feature store still applies. Gzipped when the client accepts it.
+    """
+    metrics.inc('predict_cache_total', result='bypass')
+    stored = feature_store.get(upload_hash) if snapshot is not None else None
+    unseen_groups, frames = 0, iter(())
+    if stored is None:
+        try:
+            with metrics.stage('parse'):
+                window = read_sales_window(file, window=FEATURE_HISTORY_DAYS)
+        except IngestError as e:
+            return jsonify({'error': str(e)}), 400
+        if window.last_date is not None and snapshot is not None:
+            with metrics.stage('features'):
+                entities = entity_features(window.frame)
+            stored = feature_store.put(upload_hash, entities, window.last_date)
+        elif window.last_date is not None:
+            frames = iter_fallback(window.frame, window.last_date, PREDICT_STREAM_CHUNK_GROUPS)
+    if stored is not None:
+        entities, last_date = stored
+        unseen_groups, frames = iter_forecast(entities, last_date, snapshot.model, snapshot.encoders['store'],
+                                              snapshot.encoders['product'], forecaster, PREDICT_STREAM_CHUNK_GROUPS)
+        if unseen_groups:
+            metrics.inc('unseen_groups_total', unseen_groups)
+            log.warning("⚠️  Store/product groups not seen in training, used sales average", groups=unseen_groups)
+
+    write, mimetype = STREAM_FORMATS[fmt]
+    body = write(frames)
+    response = Response(body, mimetype=mimetype)
+    if request.accept_encodings.quality('gzip') > 0:
+        response.response = gzip_chunks(body)
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if fmt == 'csv':
+        response.headers['Content-Disposition'] = 'attachment; filename=predicted_stock.csv'
+    response.headers['X-Unseen-Groups'] = str(unseen_groups)
+    response.headers['X-Model-Version'] = model_version
+    response.headers['X-Cache'] = 'BYPASS'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _cached_response(cached, fmt, cache_status):
+    if fmt == 'csv':
+        response = send_file(BytesIO(cached.body), mimetype=cached.mimetype, as_attachment=True,
+                             download_name='predicted_stock.csv')
+    else:
+        response = Response(cached.body, mimetype=cached.mimetype)
+    response.headers.update(cached.headers)
+    response.headers['X-Cache'] = cache_status
+    return response
+
+
+def _forecast_params():
+    """(horizon, quantiles) from ?horizon=&quantiles=0.1,0.9 (or form fields); raises ValueError."""
+    horizon = request.args.get('horizon') or request.form.get('horizon') or '7'
+    quantiles = request.args.get('quantiles') or request.form.get('quantiles')
+    try:
+        horizon = int(horizon)
+        quantiles = DEFAULT_QUANTILES if quantiles is None else tuple(
+            sorted({float(q) for q in quantiles.split(',') if q.strip()}))
+    except ValueError:
+        raise ValueError('horizon must be an integer and quantiles comma-separated numbers') from None
+    if not 1 <= horizon <= MAX_HORIZON_DAYS:
+        raise ValueError(f'horizon must be between 1 and {MAX_HORIZON_DAYS} days')
+    if len(quantiles) > 20 or not all(0 <= q <= 1 for q in quantiles):
+        raise ValueError('quantiles must be at most 20 values between 0 and 1')
+    return horizon, quantiles
+
+
+@app.route('/api/forecast', methods=['POST'])
+def api_forecast():
+    """Mean and quantile stock forecasts for 1 to MAX_HORIZON_DAYS days as columnar JSON.
+
+    All horizon days and quantiles come from one scoring pass; the quantiles
+    are spread across the forest's trees (see forecast.forecast_distribution).
+    """
     if 'file' not in request.files:
         return jsonify({'error': 'No file part in request'}), 400
     file = request.files['file']
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
+    model_id = _model_id()
+    if model_id is None:
+        return _invalid_model_id()
     try:
-        df = pd.read_csv(file)
-    except Exception as e:
-        return jsonify({'error': f'Failed to read CSV: {str(e)}'}), 400
+        horizon, quantiles = _forecast_params()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    snapshot = model_store.get(model_id)
+    model_version = 'fallback' if snapshot is None else snapshot.name
+    upload_hash = stream_sha256(file.stream)
+    cache_key = f"{upload_hash}.forecast.{horizon}.{','.join(map(str, quantiles))}"
+    cached = result_cache.get(model_version, cache_key, namespace=model_id)
+    if cached is not None:
+        metrics.inc('predict_cache_total', result='hit')
+        return _cached_response(cached, 'json', 'HIT')
+    metrics.inc('predict_cache_total', result='miss')
 
-    required_cols = {'store_id', 'product_id', 'date', 'sales', 'stock'}
-    if not required_cols.issubset(df.columns):
-        return jsonify({'error': f'Missing columns. Required: {required_cols}'}), 400
+    stored = feature_store.get(upload_hash)
+    if stored is not None:
+        metrics.inc('feature_store_total', result='hit')
+    else:
+        try:
+            with metrics.stage('parse'):
+                window = read_sales_window(file, window=FEATURE_HISTORY_DAYS)
+        except IngestError as e:
+            return jsonify({'error': str(e)}), 400
+        if window.last_date is None:
+            return jsonify({'error': 'No sales rows in upload'}), 400
+        metrics.inc('feature_store_total', result='miss')
+        with metrics.stage('features'):
+            entities = entity_features(window.frame)
+        stored = feature_store.put(upload_hash, entities, window.last_date)
+    entities, last_date = stored
 
-    try:
-        df['date'] = pd.to_datetime(df['date'])
-    except Exception as e:
-        return jsonify({'error': f'Invalid date format: {str(e)}'}), 400
-
-    prediction_rows = []
-
-    if os.path.exists(MODEL_PATH) and os.path.exists(MAPPING_PATH):
-        model = joblib.load(MODEL_PATH)
-        mappings = joblib.load(MAPPING_PATH)
-        store_mapping = mappings['store']
-        product_mapping = mappings['product']
-
-        df['date_ordinal'] = df['date'].map(pd.Timestamp.toordinal)
-        df['store_id'] = df['store_id'].astype('category')
-        df['product_id'] = df['product_id'].astype('category')
-        df['store_code'] = df['store_id'].cat.codes
-        df['product_code'] = df['product_id'].cat.codes
-
-        last_date = df['date'].max()
-
-        for (store, product), group in df.groupby(['store_code', 'product_code']):
-            store_name = store_mapping.get(store, store)
-            product_name = product_mapping.get(product, product)
-            store_code = store
-            product_code = product
-            sales = group['sales'].tail(7).mean() if len(group) >= 7 else group['sales'].mean()
-
-            for i in range(1, 8):
-                pred_date = last_date + pd.Timedelta(days=i)
-                features = [[store_code, product_code, pred_date.toordinal(), sales]]
-                pred_stock = model.predict(features)[0]
-                prediction_rows.append({
-                    'store_id': store_name,
-                    'product_id': product_name,
-                    'date': pred_date.strftime('%Y-%m-%d'),
-                    'predicted_stock': max(0, round(pred_stock))
-                })
+    if snapshot is None:
+        with metrics.stage('fallback'):
+            forecast = forecast_distribution(entities, last_date, None, None, None, horizon, quantiles)
     else:
-        # Fallback logic
-        df['date'] = pd.to_datetime(df['date'])
-        last_date = df['date'].max()
-        for (store, product), group in df.groupby(['store_id', 'product_id']):
-            avg_sales = group['sales'].tail(7).mean() if len(group) >= 7 else group['sales'].mean()
-            for i in range(1, 8):
-                pred_date = last_date + pd.Timedelta(days=i)
-                prediction_rows.append({
-                    'store_id': store,
-                    'product_id': product,
-                    'date': pred_date.strftime('%Y-%m-%d'),
-                    'predicted_stock': max(0, round(avg_sales))
-                })
-
-    pred_df = pd.DataFrame(prediction_rows)
-
-    if request.args.get('format') == 'csv':
-        output = BytesIO()
-        pred_df.to_csv(output, index=False)
-        output.seek(0)
-        return send_file(output, mimetype='text/csv', as_attachment=True, download_name='predicted_stock.csv')
-
-    return jsonify(pred_df.to_dict(orient='records'))
+        forecast = forecast_distribution(entities, last_date, snapshot.model, snapshot.encoders['store'],
+                                         snapshot.encoders['product'], horizon, quantiles, forecaster)
+    if forecast.unseen_groups:
+        metrics.inc('unseen_groups_total', forecast.unseen_groups)
+        log.warning("⚠️  Store/product groups not seen in training, used sales average",
+                    groups=forecast.unseen_groups)
+
+    with metrics.stage('serialize', format='columnar'):
+        body = columnar_json(forecast, model_id=model_id, model_version=model_version)
+    cached = CachedResult(body, 'application/json', {'X-Unseen-Groups': str(forecast.unseen_groups),
+                                                     'X-Model-Version': model_version})
+    result_cache.put(model_version, cache_key, cached, namespace=model_id)
+    return _cached_response(cached, 'json', 'MISS')
+
+
+@app.route('/api/models', methods=['GET'])
+def api_models():
+    return jsonify({
+        'models': [{'model_id': model_id, 'version': model_store.current_version(model_id)}
+                   for model_id in model_store.model_ids()],
+        'cache': model_store.stats(),
+    })
+
+
+@app.route('/api/models/<model_id>', methods=['GET'])
+def api_model_versions(model_id):
+    versions = model_store.versions(model_id) if ModelStore.valid_id(model_id) else []
+    if not versions:
+        return jsonify({'error': 'Unknown model'}), 404
+    return jsonify({'model_id': model_id, 'versions': versions})
+
+
+@app.route('/api/models/<model_id>/publish', methods=['POST'])
+def api_model_publish(model_id):
+    """Serve another stored version of a model, e.g. to roll back a bad retrain."""
+    version = (request.get_json(silent=True) or {}).get('version') or request.args.get('version')
+    if not ModelStore.valid_id(model_id) or not version:
+        return jsonify({'error': 'A model id and a version are required'}), 400
+    try:
+        model_store.publish(model_id, version)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    return jsonify({'model_id': model_id, 'version': version})
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+def api_cache_stats():
+    return jsonify(result_cache.stats())
 
 
 if __name__ == '__main__':
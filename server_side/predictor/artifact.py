@@ -0,0 +1,239 @@
+import json
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+# Model files ending in this are flat forests (see FlatForest), anything else is a joblib pickle
+FLAT_SUFFIX = '.forest'
+_MAGIC = b'PREDELIX-FOREST\x01'
+_ALIGN = 64
+# (row, tree) pairs walked at once by FlatForest.predict
+FOREST_BLOCK_PAIRS = int(os.environ.get('FOREST_BLOCK_PAIRS', 1 << 18))
+# Hyper-parameters that bound tree size; kept so incremental updates grow alike trees
+TREE_PARAMS = ('max_depth', 'min_samples_leaf', 'max_leaf_nodes', 'ccp_alpha')
+
+
+def _json_ids(mapping):
+    """{code: id} -> ids in code order, as plain JSON values."""
+    return [value.item() if isinstance(value, np.generic) else value
+            for value in (mapping[code] for code in range(len(mapping)))]
+
+
+def tree_mean(per_tree):
+    """Row means of (rows, trees) predictions."""
+    # Summed tree by tree in order, as sklearn accumulates them, so results match exactly
+    total = np.zeros(len(per_tree), dtype=np.float64)
+    for t in range(per_tree.shape[1]):
+        total += per_tree[:, t]
+    return total / per_tree.shape[1]
+
+
+class FlatForest:
+    """A fitted random forest regressor as a handful of flat node arrays.
+
+    Every tree's nodes are stored back to back: split feature (-1 for a leaf),
+    threshold, left/right child (global node indexes), missing-value direction
+    and node value. That is 27 bytes a node against sklearn's 64-byte node struct
+    plus the impurity and sample counts the pickle also carries.
+
+    The file is a JSON header (array layout plus metadata: feature schema, id
+    mappings, mse, training data hash, tree parameters) followed by the arrays,
+    64-byte aligned. `load` maps it read-only, so opening a model only parses
+    the header and every worker process shares the same page-cache pages.
+    Predictions match the sklearn forest it was built from.
+    """
+
+    def __init__(self, arrays, metadata):
+        self.arrays = arrays
+        self.metadata = metadata
+        self.roots = arrays['roots']
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.left = arrays['left']
+        self.right = arrays['right']
+        self.missing_left = arrays['missing_left']
+        self.value = arrays['value']
+        self.feature_names_in_ = np.array(metadata['feature_names'], dtype=object)
+        self.n_features_in_ = len(metadata['feature_names'])
+        self.n_estimators = len(self.roots)
+        self.params = metadata.get('params', {})
+        # Scoring is single threaded; kept so callers can treat this like the sklearn model
+        self.n_jobs = 1
+        self.path = None
+
+    @classmethod
+    def from_model(cls, model, metadata=None):
+        """Flatten a fitted RandomForestRegressor (single output)."""
+        trees = [estimator.tree_ for estimator in model.estimators_]
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+        parts = {name: [] for name in ('feature', 'threshold', 'left', 'right', 'missing_left', 'value')}
+        for offset, tree in zip(offsets, trees):
+            leaf = tree.children_left == -1
+            parts['feature'].append(np.where(leaf, -1, tree.feature))
+            parts['threshold'].append(tree.threshold)
+            parts['left'].append(np.where(leaf, -1, tree.children_left + offset))
+            parts['right'].append(np.where(leaf, -1, tree.children_right + offset))
+            missing_left = getattr(tree, 'missing_go_to_left', None)
+            parts['missing_left'].append(np.zeros(tree.node_count, np.uint8) if missing_left is None else missing_left)
+            parts['value'].append(tree.value[:, 0, 0])
+        n_features = model.n_features_in_
+        arrays = {
+            'roots': offsets[:-1].astype(np.int64),
+            'feature': np.concatenate(parts['feature']).astype(np.int16 if n_features < 2 ** 15 else np.int32),
+            'threshold': np.concatenate(parts['threshold']).astype(np.float64),
+            'left': np.concatenate(parts['left']).astype(np.int32),
+            'right': np.concatenate(parts['right']).astype(np.int32),
+            'missing_left': np.concatenate(parts['missing_left']).astype(np.uint8),
+            'value': np.concatenate(parts['value']).astype(np.float64),
+        }
+        names = getattr(model, 'feature_names_in_', None)
+        params = model.get_params()
+        meta = {
+            'feature_names': [str(n) for n in names] if names is not None else [f'x{i}' for i in range(n_features)],
+            'params': {key: params[key] for key in TREE_PARAMS if key in params},
+            'max_depth_grown': max(estimator.tree_.max_depth for estimator in model.estimators_),
+        }
+        meta.update(metadata or {})
+        return cls(arrays, meta)
+
+    def append(self, other, max_trees=None):
+        """Forest with `other`'s trees after these, keeping only the newest `max_trees`."""
+        offset = len(self.feature)
+        arrays = {}
+        for name in self.arrays:
+            extra = other.arrays[name]
+            if name == 'roots':
+                extra = extra + offset
+            elif name in ('left', 'right'):
+                extra = np.where(extra < 0, -1, extra + offset).astype(extra.dtype)
+            arrays[name] = np.concatenate([self.arrays[name], extra.astype(self.arrays[name].dtype)])
+        metadata = {**self.metadata, 'max_depth_grown': max(self.metadata.get('max_depth_grown', 0),
+                                                              other.metadata.get('max_depth_grown', 0))}
+        forest = FlatForest(arrays, metadata)
+        if max_trees is not None and forest.n_estimators > max_trees:
+            forest = forest._newest(max_trees)
+        return forest
+
+    def _newest(self, n_trees):
+        start = int(self.roots[-n_trees])
+        arrays = {name: np.array(values[start:]) for name, values in self.arrays.items() if name != 'roots'}
+        for name in ('left', 'right'):
+            arrays[name] = np.where(arrays[name] < 0, -1, arrays[name] - start).astype(arrays[name].dtype)
+        arrays['roots'] = self.roots[-n_trees:] - start
+        return FlatForest(arrays, self.metadata)
+
+    def _input(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f'X has shape {X.shape}, expected (n, {self.n_features_in_})')
+        return X
+
+    def _leaf_value_blocks(self, X):
+        """(start, leaf values (rows, trees)) for consecutive blocks of rows."""
+        # All trees walk a block of rows together; blocks bound the (row, tree) arrays
+        block = max(1, FOREST_BLOCK_PAIRS // max(1, self.n_estimators))
+        for start in range(0, len(X), block):
+            yield start, self._leaf_values(X[start:start + block])
+
+    def predict(self, X):
+        """Mean of the trees' leaf values; X is compared as float32, like sklearn does."""
+        X = self._input(X)
+        out = np.empty(len(X), dtype=np.float64)
+        for start, leaf_values in self._leaf_value_blocks(X):
+            out[start:start + len(leaf_values)] = tree_mean(leaf_values)
+        return out
+
+    def predict_trees(self, X):
+        """Every tree's prediction for every row, as a (rows, trees) array."""
+        X = self._input(X)
+        out = np.empty((len(X), self.n_estimators), dtype=np.float64)
+        for start, leaf_values in self._leaf_value_blocks(X):
+            out[start:start + len(leaf_values)] = leaf_values
+        return out
+
+    def _leaf_values(self, X):
+        n, n_trees = len(X), self.n_estimators
+        node = np.tile(self.roots, n)
+        row = np.repeat(np.arange(n), n_trees)
+        # Step only the (row, tree) pairs that have not reached a leaf yet
+        active = np.flatnonzero(self.feature[node] >= 0)
+        while len(active):
+            current = node[active]
+            x = X[row[active], self.feature[current]]
+            go_left = x <= self.threshold[current]
+            missing = np.isnan(x)
+            if missing.any():
+                go_left[missing] = self.missing_left[current[missing]].astype(bool)
+            current = np.where(go_left, self.left[current], self.right[current])
+            node[active] = current
+            active = active[self.feature[current] >= 0]
+        return self.value[node].reshape(n, n_trees)
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in self.arrays.values())
+
+    def save(self, path):
+        """Write to a temp file then rename, so readers never see a partial artifact."""
+        layout, offset = {}, 0
+        for name, values in self.arrays.items():
+            layout[name] = {'dtype': values.dtype.str, 'shape': list(values.shape), 'offset': offset}
+            offset += -(-values.nbytes // _ALIGN) * _ALIGN
+        header = json.dumps({'arrays': layout, 'metadata': self.metadata}).encode()
+        start = -(-(len(_MAGIC) + 8 + len(header)) // _ALIGN) * _ALIGN
+        tmp_path = f'{path}.tmp.{os.getpid()}.{threading.get_ident()}'
+        with open(tmp_path, 'wb') as f:
+            f.write(_MAGIC + struct.pack('<Q', len(header)) + header)
+            for name, values in self.arrays.items():
+                f.seek(start + layout[name]['offset'])
+                f.write(np.ascontiguousarray(values).tobytes())
+            f.truncate(start + offset)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Open a saved forest; with `mmap` the arrays are read-only views of the mapped file."""
+        with open(path, 'rb') as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f'{path} is not a flat forest artifact')
+            (header_len,) = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_len))
+        start = -(-(len(_MAGIC) + 8 + header_len) // _ALIGN) * _ALIGN
+        buffer = np.memmap(path, dtype=np.uint8, mode='r') if mmap else np.fromfile(path, dtype=np.uint8)
+        arrays = {}
+        for name, spec in header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            count = int(np.prod(spec['shape']))
+            arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                         offset=start + spec['offset']).reshape(spec['shape'])
+        forest = cls(arrays, header['metadata'])
+        forest.path = path
+        return forest
+
+    def __reduce__(self):
+        if self.path is not None:
+            # Spawned workers map the same file instead of receiving a copy of the arrays
+            return FlatForest.load, (self.path,)
+        return FlatForest, ({name: np.asarray(values) for name, values in self.arrays.items()}, self.metadata)
+
+
+def save_flat_model(path, model, mappings, **metadata):
+    """Write `model` (sklearn forest or FlatForest) with its id mappings and metadata as one flat artifact."""
+    metadata = {**metadata, 'mappings': {key: _json_ids(mapping) for key, mapping in mappings.items()},
+                'saved_at': time.time()}
+    if isinstance(model, FlatForest):
+        forest = FlatForest(model.arrays, {**model.metadata, **metadata})
+    else:
+        forest = FlatForest.from_model(model, metadata)
+    forest.save(path)
+    return forest
+
+
+def load_flat_model(path, mmap=True):
+    """(forest, mappings) from a flat artifact; mappings are {code: id} like id_mappings.pkl."""
+    forest = FlatForest.load(path, mmap=mmap)
+    mappings = {key: dict(enumerate(ids)) for key, ids in forest.metadata['mappings'].items()}
+    return forest, mappings
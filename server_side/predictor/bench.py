@@ -0,0 +1,653 @@
+"""Micro-benchmarks for the predictor service.
+
+    python bench.py forecast --groups 1000 10000 100000
+    python bench.py ingest --rows 100000 1000000 5000000
+    python bench.py encoding
+    python bench.py incremental --groups 2000 --days 365
+    python bench.py features --groups 500 --days 120
+    python bench.py partition --groups 100000 --workers 1 2 4 8
+    python bench.py stream --groups 10000 100000
+    python bench.py artifact --groups 2000 --configs full depth=16 depth=12 leaf=5
+    python bench.py models --models 200 --cache-models 200 50
+    python bench.py horizon --groups 5000 --horizons 7 14 30 60 90
+"""
+import argparse
+import io
+import os
+import pickle
+import resource
+import sys
+import tempfile
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+
+# Like app.py, put instrumentation.py (one directory up) on sys.path for the service modules
+if (_shared_dir := os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) not in sys.path:
+    sys.path.append(_shared_dir)
+
+from encoding import IdEncoder
+from forecast import forecast_with_model
+from ingest import read_sales_window, read_training_frame
+
+
+def synthetic_sales(n_groups, days=14, seed=0):
+    rng = np.random.default_rng(seed)
+    n_products = max(1, int(np.sqrt(n_groups)))
+    groups = np.arange(n_groups)
+    dates = pd.date_range('2024-01-01', periods=days)
+    return pd.DataFrame({
+        'store_id': np.repeat(groups // n_products, days),
+        'product_id': np.repeat(groups % n_products, days),
+        'date': np.tile(dates, n_groups),
+        'sales': rng.integers(0, 50, n_groups * days),
+        'stock': rng.integers(0, 200, n_groups * days),
+    })
+
+
+def fit_model(df, n_estimators=100):
+    X = pd.DataFrame({
+        'store_id': df['store_id'],
+        'product_id': df['product_id'],
+        'date_ordinal': df['date'].map(pd.Timestamp.toordinal),
+        'sales': df['sales'],
+    })
+    model = RandomForestRegressor(n_estimators=n_estimators, max_depth=12, random_state=42, n_jobs=-1)
+    model.fit(X, df['stock'])
+    return model
+
+
+def encode(df):
+    df = df.copy()
+    df['store_code'] = df['store_id'].astype('category').cat.codes
+    df['product_code'] = df['product_id'].astype('category').cat.codes
+    return df
+
+
+def legacy_forecast(df, model, store_mapping, product_mapping, max_groups=None):
+    """The original per-row loop from api_predict, kept as the reference implementation."""
+    prediction_rows = []
+    last_date = df['date'].max()
+    for n, ((store, product), group) in enumerate(df.groupby(['store_code', 'product_code'])):
+        if max_groups is not None and n >= max_groups:
+            break
+        store_name = store_mapping.get(store, store)
+        product_name = product_mapping.get(product, product)
+        sales = group['sales'].tail(7).mean() if len(group) >= 7 else group['sales'].mean()
+        for i in range(1, 8):
+            pred_date = last_date + pd.Timedelta(days=i)
+            pred_stock = model.predict([[store, product, pred_date.toordinal(), sales]])[0]
+            prediction_rows.append({
+                'store_id': store_name,
+                'product_id': product_name,
+                'date': pred_date.strftime('%Y-%m-%d'),
+                'predicted_stock': max(0, round(pred_stock))
+            })
+    return pd.DataFrame(prediction_rows)
+
+
+def bench_forecast(args):
+    for n_groups in args.groups:
+        df = synthetic_sales(n_groups)
+        model = fit_model(df.sample(min(len(df), 50000), random_state=0), args.trees)
+        df = encode(df)
+        store_encoder = IdEncoder.fit(df['store_id'])
+        product_encoder = IdEncoder.fit(df['product_id'])
+        store_mapping, product_mapping = store_encoder.to_mapping(), product_encoder.to_mapping()
+
+        start = time.perf_counter()
+        batched = forecast_with_model(df, df['date'].max(), model, store_encoder, product_encoder)
+        batched_s = time.perf_counter() - start
+
+        # The legacy loop is far too slow at 100k groups; time a prefix and extrapolate
+        sample = min(n_groups, args.legacy_groups)
+        start = time.perf_counter()
+        legacy = legacy_forecast(df, model, store_mapping, product_mapping, max_groups=sample)
+        legacy_s = (time.perf_counter() - start) * n_groups / sample
+
+        identical = legacy.equals(batched.head(len(legacy)))
+        print(f"groups={n_groups:>7}  rows={len(batched):>8}  batched={batched_s:8.3f}s  "
+              f"legacy~{legacy_s:10.3f}s  speedup~{legacy_s / batched_s:8.1f}x  identical={identical}")
+
+
+def write_sales_csv(path, rows, n_groups=1000, seed=0):
+    """Append-only synthetic history: a fixed catalog of `n_groups` with more days as rows grow."""
+    days = -(-rows // n_groups)
+    with open(path, 'w') as f:
+        f.write('store_id,product_id,date,sales,stock\n')
+        for start in range(0, days, 100):
+            block = synthetic_sales(n_groups, days=min(100, days - start), seed=seed + start)
+            block['date'] += pd.Timedelta(days=start)
+            block.sort_values('date', kind='stable').to_csv(f, header=False, index=False)
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _ingest_once(path, mode):
+    baseline = _peak_rss_mb()
+    start = time.perf_counter()
+    if mode == 'legacy':
+        df = pd.read_csv(path)
+        df['date'] = pd.to_datetime(df['date'])
+        df['date_ordinal'] = df['date'].map(pd.Timestamp.toordinal)
+        groups = df.groupby(['store_id', 'product_id'])['sales'].apply(lambda s: s.tail(7).mean())
+    else:
+        window = read_sales_window(path)
+        groups = window.frame.groupby(['store_id', 'product_id'], observed=True)['sales'].mean()
+    return time.perf_counter() - start, _peak_rss_mb() - baseline, len(groups)
+
+
+def bench_ingest(args):
+    ctx = get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            path = os.path.join(tmp, f'sales_{rows}.csv')
+            write_sales_csv(path, rows, args.groups)
+            size_mb = os.path.getsize(path) / 2 ** 20
+            for mode in args.modes:
+                # Fresh process per run so ru_maxrss is not polluted by the previous one
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                    elapsed, peak_mb, n_groups = pool.submit(_ingest_once, path, mode).result()
+                print(f"rows={rows:>9}  file={size_mb:8.1f}MB  mode={mode:<9}  time={elapsed:8.2f}s  "
+                      f"peak_rss=+{peak_mb:8.1f}MB  groups={n_groups}")
+
+
+def bench_encoding(args):
+    """Not a timing run: subset and shuffled uploads must score exactly like the full file."""
+    def upload(client, path, df):
+        body = df.to_csv(index=False).encode()
+        response = client.post(path, data={'file': (io.BytesIO(body), 'sales.csv')})
+        assert response.status_code in (200, 202), response.get_data(as_text=True)
+        return response.get_json()
+
+    rng = np.random.default_rng(1)
+    df = synthetic_sales(args.groups)
+    df['store_id'] = 'S' + df['store_id'].astype(str)
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            import app as predictor
+            client = predictor.app.test_client()
+            job = upload(client, '/api/train', df)
+            status_url = job['status_url']
+            while job['status'] not in ('succeeded', 'failed'):
+                time.sleep(0.2)
+                job = client.get(status_url).get_json()
+            full = pd.DataFrame(upload(client, '/api/predict', df)).set_index(['store_id', 'product_id', 'date'])
+
+            stores = df['store_id'].unique()
+            subset = df[df['store_id'].isin(rng.choice(stores, len(stores) // 3, replace=False))]
+            shuffled = df.sample(frac=1, random_state=2)
+            for name, part in [('subset', subset), ('shuffled', shuffled), ('shuffled subset', subset.sample(frac=1))]:
+                got = pd.DataFrame(upload(client, '/api/predict', part)).set_index(['store_id', 'product_id', 'date'])
+                identical = got['predicted_stock'].equals(full.loc[got.index, 'predicted_stock'])
+                print(f"{name:<16} groups={len(got) // 7:>6}  identical_to_full={identical}")
+        finally:
+            os.chdir(cwd)
+
+
+def bench_incremental(args):
+    """Full retrain on the whole history vs an incremental update with one new day."""
+    from jobs import JobStore
+    from training import run_training_job
+
+    df = synthetic_sales(args.groups, days=args.days + args.new_days)
+    last_history_day = df['date'].min() + pd.Timedelta(days=args.days - 1)
+    history, new = df[df['date'] <= last_history_day], df[df['date'] > last_history_day]
+    with tempfile.TemporaryDirectory() as tmp:
+        def run(name, frame, mode):
+            upload_path = os.path.join(tmp, f'{name}.csv')
+            frame.to_csv(upload_path, index=False)
+            start = time.perf_counter()
+            run_training_job(name, upload_path, tmp, os.path.join(tmp, 'models'), 'bench', 'pickle',
+                             os.path.join(tmp, 'data'), mode)
+            job = JobStore(tmp).get(name)
+            assert job['status'] == 'succeeded', job
+            print(f"{name:<12} rows={len(frame):>9}  history={job['history_rows']:>9}  "
+                  f"fit={job.get('fit_seconds', 0):7.2f}s  job={time.perf_counter() - start:7.2f}s  "
+                  f"mse={job.get('mse', float('nan')):8.2f}  trees={job.get('trees', '-')}")
+            return job
+
+        run('full', history, 'full')
+        # Re-uploading the full history plus the new days, as a nightly export would
+        job = run('incremental', df, 'incremental')
+        print(f"new rows appended: {job['new_rows']}, estimated full retrain "
+              f"{job['full_retrain_seconds_estimate']:.2f}s, speedup {job['speedup']}x")
+        run('duplicate', new, 'incremental')
+
+
+def seasonal_sales(n_groups, days, seed=0, n_products=None):
+    """Sales with per-group level, trend and weekly seasonality; stock follows recent demand.
+
+    Groups are numbered store by store, `n_products` (default about sqrt(n_groups)) per store.
+    """
+    rng = np.random.default_rng(seed)
+    n_products = n_products or max(1, int(np.sqrt(n_groups)))
+    dates = pd.date_range('2024-01-01', periods=days)
+    level = rng.uniform(5, 60, (n_groups, 1))
+    trend = rng.normal(0, 0.004, (n_groups, 1))
+    weekly = np.array([0.8, 0.9, 1.0, 1.0, 1.2, 1.5, 1.3])[dates.dayofweek.to_numpy()]
+    sales = rng.poisson(level * weekly * (1 + trend * np.arange(days)).clip(0.1))
+    recent = pd.DataFrame(sales.T).rolling(7, min_periods=1).mean().shift(1).bfill().to_numpy().T
+    stock = np.rint(2.5 * recent + 8 * weekly + rng.normal(0, 4, sales.shape)).clip(0).astype(int)
+    groups = np.arange(n_groups)
+    return pd.DataFrame({
+        'store_id': np.repeat(groups // n_products, days),
+        'product_id': np.repeat(groups % n_products, days),
+        'date': np.tile(dates, n_groups),
+        'sales': sales.ravel(),
+        'stock': stock.ravel(),
+    })
+
+
+def bench_features(args):
+    """Basic vs rolling feature set: hold-out accuracy on the last week and predict latency."""
+    from features import FEATURE_HISTORY_DAYS, entity_features
+    from training import train_model
+
+    df = seasonal_sales(args.groups, args.days)
+    cutoff = df['date'].max() - pd.Timedelta(days=7)
+    history, actual = df[df['date'] <= cutoff], df[df['date'] > cutoff]
+    body = history.to_csv(index=False).encode()
+    actual = actual.assign(date=actual['date'].dt.strftime('%Y-%m-%d')).set_index(['store_id', 'product_id', 'date'])
+
+    for feature_set in ('basic', 'rolling'):
+        start = time.perf_counter()
+        model, mappings, _ = train_model(read_training_frame(io.BytesIO(body)), feature_set=feature_set)
+        fit_seconds = time.perf_counter() - start
+        encoders = [IdEncoder.from_mapping(mappings[key]) for key in ('store', 'product')]
+
+        start = time.perf_counter()
+        window = read_sales_window(io.BytesIO(body), window=FEATURE_HISTORY_DAYS)
+        entities = entity_features(window.frame)
+        parse_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        pred = forecast_with_model(None, window.last_date, model, *encoders, entities=entities)
+        score_seconds = time.perf_counter() - start
+
+        pred = pred.set_index(['store_id', 'product_id', 'date'])['predicted_stock']
+        error = pred - actual.loc[pred.index, 'stock']
+        print(f"{feature_set:<8} fit={fit_seconds:6.2f}s  mae={error.abs().mean():7.2f}  "
+              f"rmse={np.sqrt((error ** 2).mean()):7.2f}  predict cold={(parse_seconds + score_seconds) * 1000:8.1f}ms  "
+              f"feature store hit={score_seconds * 1000:8.1f}ms")
+
+
+def _private_mb(pid, keys=('Private_Clean', 'Private_Dirty')):
+    """Private (unshared) memory of a process in MB, from /proc (Linux only)."""
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return float('nan')
+    kb = sum(int(fields[key].split()[0]) for key in keys)
+    return kb / 1024
+
+
+def bench_partition(args):
+    """Throughput of store-sharded scoring by worker count; output must equal the serial forecast."""
+    from features import entity_features
+    from partition import PREDICT_START_METHOD, PartitionedForecaster
+    from training import train_model
+
+    df = seasonal_sales(args.groups, days=35)
+    frame = read_sales_window(io.BytesIO(df.to_csv(index=False).encode()), window=28)
+    # Every store and product appears in the training slice, so every group is scored by the model
+    sample = df[(df['store_id'] + df['product_id']) % args.train_every == 0]
+    model, mappings, _ = train_model(read_training_frame(io.BytesIO(sample.to_csv(index=False).encode())))
+    encoders = [IdEncoder.from_mapping(mappings[key]) for key in ('store', 'product')]
+    entities = entity_features(frame.frame)
+    model.set_params(n_jobs=1)
+
+    def run(forecaster):
+        start = time.perf_counter()
+        pred = forecast_with_model(None, frame.last_date, model, *encoders, entities=entities, forecaster=forecaster)
+        return pred, time.perf_counter() - start
+
+    serial, serial_seconds = run(None)
+    model_mb = len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)) / 2 ** 20
+    print(f"cores={os.cpu_count()}  groups={args.groups}  trees={len(model.estimators_)} ({model_mb:.0f}MB)  "
+          f"serial: {serial_seconds:.2f}s ({args.groups / serial_seconds:,.0f} groups/s)")
+    for workers in args.workers:
+        forecaster = PartitionedForecaster(workers=workers, shard_groups=args.shard_groups,
+                                           start_method=args.start_method or PREDICT_START_METHOD,
+                                           flat_workers=not args.pickled)
+        run(forecaster)  # start the pool
+        pred, seconds = run(forecaster)
+        pools = [pool for _, pool in forecaster._pools.values()] + [forecaster._shared_pool]
+        private = [_private_mb(pid) for pool in pools if pool for pid in (pool._processes or {})]
+        print(f"workers={workers:<3} {seconds:7.2f}s  {args.groups / seconds:>10,.0f} groups/s  "
+              f"speedup={serial_seconds / seconds:5.2f}x  identical={pred.equals(serial)}"
+              + (f"  worker private mem={np.mean(private):.0f}MB" if private else ''))
+        forecaster.shutdown()
+
+
+def bench_stream(args):
+    """Buffered vs streamed /api/predict: time to first byte, total time and peak traced memory."""
+    import tracemalloc
+    from training import train_model
+
+    variants = [('buffered json', '', {}), ('buffered csv', '?format=csv', {}),
+                ('stream json', '?stream=1', {}), ('stream ndjson', '?format=ndjson', {}),
+                ('stream ndjson gzip', '?format=ndjson', {'Accept-Encoding': 'gzip'})]
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            import app as predictor
+            client = predictor.app.test_client()
+            for n_groups in args.groups:
+                body = seasonal_sales(n_groups, days=28).to_csv(index=False).encode()
+                train = read_training_frame(io.BytesIO(body))
+                train = train[train['store_id'].cat.codes % args.train_every == 0]
+                model, mappings, _ = train_model(train)
+                predictor.model_store.save(predictor.DEFAULT_MODEL_ID, model, mappings)
+                for label, query, headers in variants:
+                    # Fresh caches so every variant parses and scores the upload
+                    predictor.result_cache = type(predictor.result_cache)(predictor.PREDICT_CACHE_MAX_BYTES)
+                    predictor.feature_store = type(predictor.feature_store)()
+                    tracemalloc.start()
+                    start = time.perf_counter()
+                    response = client.post('/api/predict' + query, data={'file': (io.BytesIO(body), 'sales.csv')},
+                                           headers=headers, buffered=False)
+                    chunks = response.iter_encoded()
+                    size = len(next(chunks, b''))
+                    ttfb = time.perf_counter() - start
+                    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                    # What is still allocated or newly allocated while the rest of the body is written
+                    tracemalloc.reset_peak()
+                    size += sum(len(chunk) for chunk in chunks)
+                    total = time.perf_counter() - start
+                    body_peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                    tracemalloc.stop()
+                    response.close()
+                    print(f"groups={n_groups:>7}  {label:<19} ttfb={ttfb * 1000:8.1f}ms  total={total * 1000:8.1f}ms  "
+                          f"peak_to_first_byte={peak:6.1f}MB  peak_after={body_peak:6.1f}MB  body={size / 2 ** 20:5.1f}MB")
+        finally:
+            os.chdir(cwd)
+
+
+_TREE_PARAM_NAMES = {'depth': 'max_depth', 'leaf': 'min_samples_leaf', 'alpha': 'ccp_alpha'}
+
+
+def _tree_params(config):
+    """'full' or e.g. 'depth=12,leaf=5' -> RandomForestRegressor size parameters."""
+    params = {'max_depth': None, 'min_samples_leaf': 1, 'ccp_alpha': 0.0}
+    for item in filter(None, config.replace('full', '').split(',')):
+        key, value = item.split('=')
+        params[_TREE_PARAM_NAMES[key]] = float(value) if key == 'alpha' else int(value)
+    return params
+
+
+def _load_and_score(model_path, mapping_path, X, single_rows):
+    """In a fresh process: load through ModelRegistry, then time single-row and batch predicts."""
+    from registry import ModelRegistry
+
+    warnings.filterwarnings('ignore', message='X does not have valid feature names')
+    before = _private_mb(os.getpid())
+    start = time.perf_counter()
+    model = ModelRegistry(model_path, mapping_path).get().model
+    load_seconds = time.perf_counter() - start
+    loaded = _private_mb(os.getpid()) - before
+    model.n_jobs = 1
+    single = []
+    for i in range(single_rows):
+        start = time.perf_counter()
+        model.predict(X[i:i + 1])
+        single.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    predicted = model.predict(X)
+    batch_seconds = time.perf_counter() - start
+    return load_seconds, loaded, np.median(single), batch_seconds / len(X), predicted
+
+
+def bench_artifact(args):
+    """Pickle vs flat artifact, across tree size limits: size, load time, memory, latency and accuracy."""
+    from artifact import FLAT_SUFFIX
+    from features import FEATURE_HISTORY_DAYS, entity_features, model_features
+    from forecast import build_entity_matrix, horizon_dates
+    from registry import ModelRegistry
+    from training import train_model
+
+    df = seasonal_sales(args.groups, args.days)
+    cutoff = df['date'].max() - pd.Timedelta(days=7)
+    history, actual = df[df['date'] <= cutoff], df[df['date'] > cutoff]
+    body = history.to_csv(index=False).encode()
+    actual = actual.assign(date=actual['date'].dt.strftime('%Y-%m-%d')).set_index(['store_id', 'product_id', 'date'])
+    window = read_sales_window(io.BytesIO(body), window=FEATURE_HISTORY_DAYS)
+    entities = entity_features(window.frame)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for config in args.configs:
+            model, mappings, _ = train_model(read_training_frame(io.BytesIO(body)), tree_params=_tree_params(config))
+            encoders = [IdEncoder.from_mapping(mappings[key]) for key in ('store', 'product')]
+            pred = forecast_with_model(None, window.last_date, model, *encoders, entities=entities)
+            pred = pred.set_index(['store_id', 'product_id', 'date'])
+            mae = (pred['predicted_stock'] - actual.loc[pred.index, 'stock']).abs().mean()
+            # The matrix /api/predict scores: every group crossed with the horizon
+            index = entities.index
+            X = build_entity_matrix(encoders[0].encode(index.get_level_values(0)),
+                                    encoders[1].encode(index.get_level_values(1)), entities,
+                                    horizon_dates(window.last_date), model_features(model))[:args.rows]
+            depth = max(estimator.tree_.max_depth for estimator in model.estimators_)
+            nodes = sum(estimator.tree_.node_count for estimator in model.estimators_)
+            print(f"{config:<16} trees={len(model.estimators_)}  nodes={nodes:,}  depth={depth}  mae={mae:.2f}")
+            reference = None
+            for fmt, suffix in (('pickle', '.pkl'), ('flat', FLAT_SUFFIX)):
+                model_path = os.path.join(tmp, f'model{suffix}')
+                mapping_path = os.path.join(tmp, 'mappings.pkl')
+                ModelRegistry(model_path, mapping_path).save(model, mappings)
+                size_mb = os.path.getsize(model_path) / 2 ** 20
+                # A new process per load, so nothing is already in the interpreter's memory
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+                    load, private, single, per_row, predicted = pool.submit(
+                        _load_and_score, model_path, mapping_path, X, args.single_rows).result()
+                reference = predicted if reference is None else reference
+                print(f"  {fmt:<7} size={size_mb:8.1f}MB  load={load * 1000:8.1f}ms  private_mem=+{private:6.1f}MB  "
+                      f"single_row={single * 1000:6.2f}ms  batch={per_row * 1e6:6.2f}us/row  "
+                      f"identical={np.array_equal(predicted, reference)}")
+                os.remove(model_path)
+
+
+def _serve_models(workdir, fmt, max_models, model_ids, body):
+    """In a fresh process: request every model twice through /api/predict; latencies, store stats, memory."""
+    os.chdir(workdir)
+    warnings.filterwarnings('ignore')
+    import app as predictor
+    from cache import ResultCache
+    from registry import ModelStore
+
+    predictor.model_store = ModelStore(os.path.join(workdir, fmt), fmt, max_models=max_models)
+    # Nothing served from the rendered-result cache: every request gets its model and scores
+    predictor.result_cache = ResultCache(0)
+    client = predictor.app.test_client()
+    # Anonymous memory only: mapped flat forests are page cache the kernel can drop or share
+    before = _private_mb(os.getpid(), keys=('Anonymous',))
+    rounds = []
+    for _ in range(2):
+        latencies = []
+        for model_id in model_ids:
+            start = time.perf_counter()
+            response = client.post(f'/api/predict?model_id={model_id}', data={'file': (io.BytesIO(body), 'sales.csv')})
+            assert response.status_code == 200, response.get_data(as_text=True)
+            response.close()
+            latencies.append(time.perf_counter() - start)
+        rounds.append(sorted(latencies))
+    stats = predictor.model_store.stats()
+    predictor.train_queue.shutdown()
+    return rounds, stats, _private_mb(os.getpid(), keys=('Anonymous',)) - before
+
+
+def bench_models(args):
+    """Many per-tenant models served by one process, per artifact format and model LRU size."""
+    from registry import ModelStore
+    from training import train_model
+
+    df = seasonal_sales(args.groups, args.days)
+    body = df.to_csv(index=False).encode()
+    model, mappings, _ = train_model(read_training_frame(io.BytesIO(body)), tree_params=_tree_params(args.trees))
+    model_ids = [f'tenant-{i:04d}' for i in range(args.models)]
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in args.formats:
+            store = ModelStore(os.path.join(tmp, fmt), fmt)
+            start = time.perf_counter()
+            for model_id in model_ids:
+                store.save(model_id, model, mappings)
+            save_ms = (time.perf_counter() - start) / len(model_ids) * 1000
+            size_mb = sum(os.path.getsize(os.path.join(directory, name)) for directory, _, names
+                          in os.walk(os.path.join(tmp, fmt, model_ids[0])) for name in names) / 2 ** 20
+            print(f"{fmt}: {args.models} models of {size_mb:.1f}MB, save={save_ms:.1f}ms/model")
+            for max_models in args.cache_models:
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+                    (first, repeat), stats, private = pool.submit(_serve_models, tmp, fmt, max_models, model_ids,
+                                                                  body).result()
+                print(f"  cache={max_models:>5}  first p50={np.median(first) * 1000:7.1f}ms  "
+                      f"repeat p50={np.median(repeat) * 1000:7.1f}ms p99={repeat[int(len(repeat) * 0.99)] * 1000:7.1f}ms"
+                      f"  loads={stats['loads']:>5}  resident={stats['loaded']:>4} ({stats['bytes'] / 2 ** 20:7.1f}MB)"
+                      f"  anon_mem=+{private:7.1f}MB")
+
+
+def bench_horizon(args):
+    """Mean + quantile forecasts by horizon: one collapsed pass vs scoring every horizon row."""
+    import json
+
+    from features import FEATURE_HISTORY_DAYS, entity_features, model_features
+    from forecast import (_split_entities, build_entity_matrix, forecast_distribution, horizon_columns,
+                          horizon_dates, score_distribution)
+    from render import columnar_json
+    from training import train_model
+
+    df = seasonal_sales(args.groups, args.days)
+    cutoff = df['date'].max() - pd.Timedelta(days=7)
+    history, actual = df[df['date'] <= cutoff], df[df['date'] > cutoff]
+    body = history.to_csv(index=False).encode()
+    model, mappings, _ = train_model(read_training_frame(io.BytesIO(body)), tree_params=_tree_params(args.trees))
+    model.n_jobs = 1
+    encoders = [IdEncoder.from_mapping(mappings[key]) for key in ('store', 'product')]
+    window = read_sales_window(io.BytesIO(body), window=FEATURE_HISTORY_DAYS)
+    entities = entity_features(window.frame)
+    store_codes, product_codes, table, _ = _split_entities(entities, *encoders)
+    feature_names = model_features(model)
+    quantiles = tuple(args.quantiles)
+
+    def timed(fn):
+        start = time.perf_counter()
+        result = fn()
+        return result, time.perf_counter() - start
+
+    for horizon in args.horizons:
+        dates = horizon_dates(window.last_date, horizon)
+        forecast, seconds = timed(lambda: forecast_distribution(entities, window.last_date, model, *encoders,
+                                                                horizon, quantiles))
+        full, full_seconds = timed(lambda: score_distribution(
+            model, build_entity_matrix(store_codes, product_codes, table, dates, feature_names), quantiles))
+        full = full.reshape(len(store_codes), horizon, -1).transpose(2, 0, 1)
+        identical = np.array_equal(full[0], forecast.mean) and np.array_equal(full[1:], forecast.quantile_values)
+        point, point_seconds = timed(lambda: forecast_with_model(None, window.last_date, model, *encoders,
+                                                                 horizon=horizon, entities=entities))
+        columnar = columnar_json(forecast)
+        records = point.assign(**{f'q{q}': values.ravel() for q, values in zip(quantiles, forecast.quantile_values)})
+        records = json.dumps(records.to_dict(orient='records'), default=lambda v: v.item()).encode()
+        print(f"horizon={horizon:3d}  columns={len(horizon_columns(model, feature_names, dates)[0]):2d}  "
+              f"one_pass={seconds * 1000:8.1f}ms  all_rows={full_seconds * 1000:8.1f}ms  "
+              f"point_only={point_seconds * 1000:8.1f}ms  identical={identical}  "
+              f"json columnar={len(columnar) / 2 ** 20:6.2f}MB records={len(records) / 2 ** 20:6.2f}MB")
+
+    # How often the held-out week falls inside the outer quantiles
+    forecast = forecast_distribution(entities, window.last_date, model, *encoders, 7, quantiles)
+    stock = actual.set_index(['store_id', 'product_id', 'date'])['stock']
+    index = pd.MultiIndex.from_arrays([np.repeat(forecast.store_ids, 7), np.repeat(forecast.product_ids, 7),
+                                       np.tile(forecast.dates, len(forecast.store_ids))])
+    observed = stock.loc[index].to_numpy().reshape(forecast.mean.shape)
+    inside = (forecast.quantile_values[0] <= observed) & (observed <= forecast.quantile_values[-1])
+    print(f"held-out week inside [q{quantiles[0]}, q{quantiles[-1]}]: {inside.mean():.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    p = sub.add_parser('forecast', help='batched vs per-row /api/predict scoring')
+    p.add_argument('--groups', type=int, nargs='+', default=[1000, 10000, 100000])
+    p.add_argument('--trees', type=int, default=100)
+    p.add_argument('--legacy-groups', type=int, default=200,
+                   help='groups timed with the legacy loop before extrapolating')
+    p.set_defaults(func=bench_forecast)
+
+    p = sub.add_parser('ingest', help='peak RSS of streaming vs whole-file CSV ingestion')
+    p.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000, 5000000])
+    p.add_argument('--groups', type=int, default=1000)
+    p.add_argument('--modes', nargs='+', default=['legacy', 'streaming'], choices=['legacy', 'streaming'])
+    p.set_defaults(func=bench_ingest)
+
+    p = sub.add_parser('encoding', help='check train/predict id encoding is stable across uploads')
+    p.add_argument('--groups', type=int, default=400)
+    p.set_defaults(func=bench_encoding)
+
+    p = sub.add_parser('incremental', help='full retrain vs incremental update with new days')
+    p.add_argument('--groups', type=int, default=2000)
+    p.add_argument('--days', type=int, default=365)
+    p.add_argument('--new-days', type=int, default=1)
+    p.set_defaults(func=bench_incremental)
+
+    p = sub.add_parser('features', help='basic vs rolling features: accuracy and predict latency')
+    p.add_argument('--groups', type=int, default=500)
+    p.add_argument('--days', type=int, default=120)
+    p.set_defaults(func=bench_features)
+
+    p = sub.add_parser('partition', help='store-sharded scoring throughput by worker count')
+    p.add_argument('--groups', type=int, default=100000)
+    p.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    p.add_argument('--shard-groups', type=int, default=5000)
+    p.add_argument('--train-every', type=int, default=20, help='fit on every Nth group')
+    p.add_argument('--start-method', choices=['fork', 'forkserver', 'spawn'],
+                   help='worker start method (default: PREDICT_START_METHOD)')
+    p.add_argument('--pickled', action='store_true', help='ship the sklearn forest pickled, not as a flat file')
+    p.set_defaults(func=bench_partition)
+
+    p = sub.add_parser('stream', help='buffered vs streamed /api/predict: time to first byte and peak memory')
+    p.add_argument('--groups', type=int, nargs='+', default=[10000, 50000])
+    p.add_argument('--train-every', type=int, default=10, help='train on every Nth store to keep the fit short')
+    p.set_defaults(func=bench_stream)
+
+    p = sub.add_parser('artifact', help='pickle vs flat model artifact by tree size limits')
+    p.add_argument('--groups', type=int, default=2000)
+    p.add_argument('--days', type=int, default=120)
+    p.add_argument('--configs', nargs='+', default=['full', 'depth=16', 'depth=12', 'leaf=5'],
+                   help="tree size limits, e.g. full, depth=12, leaf=5, alpha=0.01 or depth=16,leaf=3")
+    p.add_argument('--rows', type=int, default=100000, help='rows in the batch predict')
+    p.add_argument('--single-rows', type=int, default=200, help='single-row predicts timed')
+    p.set_defaults(func=bench_artifact)
+
+    p = sub.add_parser('models', help='many per-tenant models in one process, by format and model cache size')
+    p.add_argument('--models', type=int, default=200)
+    p.add_argument('--groups', type=int, default=50)
+    p.add_argument('--days', type=int, default=60)
+    p.add_argument('--trees', default='depth=12', help="tree size limits, as for artifact ('full', 'depth=12', ...)")
+    p.add_argument('--formats', nargs='+', default=['pickle', 'flat'], choices=['pickle', 'flat'])
+    p.add_argument('--cache-models', type=int, nargs='+', default=[200, 50],
+                   help='MODEL_CACHE_MAX_MODELS values; below --models every round-robin request reloads')
+    p.set_defaults(func=bench_models)
+
+    p = sub.add_parser('horizon', help='mean + quantile forecasts by horizon: latency, output size, coverage')
+    p.add_argument('--groups', type=int, default=5000)
+    p.add_argument('--days', type=int, default=120)
+    p.add_argument('--trees', default='depth=12', help="tree size limits, as for artifact ('full', 'depth=12', ...)")
+    p.add_argument('--horizons', type=int, nargs='+', default=[7, 14, 30, 60, 90])
+    p.add_argument('--quantiles', type=float, nargs='+', default=[0.1, 0.5, 0.9])
+    p.set_defaults(func=bench_horizon)
+
+    args = parser.parse_args()
+    warnings.filterwarnings('ignore', message='X does not have valid feature names')
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
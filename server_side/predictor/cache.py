@@ -0,0 +1,146 @@
+import hashlib
+import os
+import pickle
+import shutil
+import threading
+from collections import OrderedDict, namedtuple
+
+# A rendered /api/predict response body plus what is needed to rebuild the Response
+CachedResult = namedtuple('CachedResult', ['body', 'mimetype', 'headers'])
+
+
+def stream_sha256(stream, chunk_size=1 << 20):
+    """Hash a seekable upload stream and rewind it so it can still be parsed."""
+    digest = hashlib.sha256()
+    for block in iter(lambda: stream.read(chunk_size), b''):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """LRU cache of rendered forecasts, bounded by total body size in bytes.
+
+    Entries are grouped by namespace (the model id) and model version. The first
+    lookup under a new version of a namespace (i.e. after that model was
+    retrained) drops everything cached for its older versions, in memory and on
+    disk; other models' entries stay. If `disk_dir` is set, entries are also
+    written there so they survive a restart; the disk tier has its own byte
+    budget and evicts oldest first.
+    """
+
+    def __init__(self, max_bytes, disk_dir=None, disk_max_bytes=0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._versions = {}
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _use_version(self, namespace, version):
+        if self._versions.get(namespace) == version:
+            return
+        self._versions[namespace] = version
+        stale = [key for key in self._entries if key[0] == namespace and key[1] != version]
+        for key in stale:
+            self._bytes -= len(self._entries.pop(key).body)
+        directory = os.path.join(self.disk_dir, namespace) if self.disk_dir else None
+        if directory and os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name != version:
+                    shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+    def _disk_path(self, namespace, version, key):
+        return os.path.join(self.disk_dir, namespace, version, f'{key}.pkl')
+
+    def get(self, version, key, namespace='default'):
+        with self._lock:
+            self._use_version(namespace, version)
+            entry = self._entries.get((namespace, version, key))
+            if entry is not None:
+                self._entries.move_to_end((namespace, version, key))
+                self.hits += 1
+                return entry
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(namespace, version, key), 'rb') as f:
+                    entry = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                entry = None
+            if entry is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._remember(namespace, version, key, entry)
+                return entry
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, version, key, entry, namespace='default'):
+        self._remember(namespace, version, key, entry)
+        if self.disk_dir and len(entry.body) <= self.disk_max_bytes:
+            path = self._disk_path(namespace, version, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.tmp.{os.getpid()}.{threading.get_ident()}'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self._trim_disk()
+
+    def _remember(self, namespace, version, key, entry):
+        size = len(entry.body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if version != self._versions.get(namespace):
+                return
+            old = self._entries.pop((namespace, version, key), None)
+            if old is not None:
+                self._bytes -= len(old.body)
+            self._entries[(namespace, version, key)] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+                self.evictions += 1
+
+    def _trim_disk(self):
+        files = []
+        for directory, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if name.endswith('.pkl'):
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'disk_dir': self.disk_dir,
+            }
@@ -0,0 +1,181 @@
+import importlib.util
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+import pandas as pd
+
+from ingest import GROUP_KEYS, concat_compact
+
+# (store, product, date) identifies a training row
+KEY_COLUMNS = GROUP_KEYS + ['date_ordinal']
+# Appends are merged into one segment once there are more than this many
+DATASET_MAX_SEGMENTS = int(os.environ.get('DATASET_MAX_SEGMENTS', 32))
+
+
+def _default_format():
+    # Parquet needs pyarrow (in requirment.txt). An install without it still works: pickle
+    # keeps the same compact dtypes, but is neither columnar nor readable outside pandas
+    return 'parquet' if importlib.util.find_spec('pyarrow') is not None else 'pickle'
+
+
+# Segment file format: parquet (the default with pyarrow installed), feather or pickle
+DATASET_FORMAT = os.environ.get('DATASET_FORMAT') or _default_format()
+_EXTENSIONS = {'parquet': '.parquet', 'feather': '.feather', 'pickle': '.pkl'}
+
+
+class TrainingDataset:
+    """Training history kept on disk as immutable segment files plus a manifest.
+
+    Each append writes only the rows whose (store, product, date) key is new as one
+    segment. The manifest records every segment's date range, so de-duplication
+    and reads of recent history only open the segments that overlap the dates
+    involved instead of the whole history.
+    """
+
+    def __init__(self, directory, fmt=DATASET_FORMAT):
+        if fmt not in _EXTENSIONS:
+            raise ValueError(f'Unknown dataset format {fmt!r}, choose from {sorted(_EXTENSIONS)}')
+        self.directory = directory
+        self.fmt = fmt
+        self._manifest_path = os.path.join(directory, 'manifest.json')
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def lock(self, timeout=3600, stale_after=6 * 3600):
+        """Cross-process lock for a whole training job (dataset update, fit and publish)."""
+        path = os.path.join(self.directory, '.lock')
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.stat(path).st_mtime > stale_after:
+                        # Left behind by a worker that was killed
+                        os.remove(path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f'Training dataset {self.directory} is locked')
+                time.sleep(0.5)
+        try:
+            os.write(fd, str(os.getpid()).encode())
+            os.close(fd)
+            yield self
+        finally:
+            os.remove(path)
+
+    def manifest(self):
+        try:
+            with open(self._manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'segments': [], 'rows': 0}
+
+    def _write_manifest(self, manifest):
+        tmp_path = f'{self._manifest_path}.tmp.{os.getpid()}'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path)
+
+    def _write_segment(self, frame):
+        name = f'{time.time_ns()}-{uuid.uuid4().hex[:8]}{_EXTENSIONS[self.fmt]}'
+        path = os.path.join(self.directory, name)
+        frame = frame.reset_index(drop=True)
+        if self.fmt == 'parquet':
+            frame.to_parquet(path, index=False)
+        elif self.fmt == 'feather':
+            frame.to_feather(path)
+        else:
+            frame.to_pickle(path)
+        return {'file': name, 'rows': len(frame),
+                'min_date': int(frame['date_ordinal'].min()), 'max_date': int(frame['date_ordinal'].max())}
+
+    def _read_segment(self, segment):
+        path = os.path.join(self.directory, segment['file'])
+        if path.endswith('.parquet'):
+            return pd.read_parquet(path)
+        if path.endswith('.feather'):
+            return pd.read_feather(path)
+        return pd.read_pickle(path)
+
+    def _read(self, segments, columns=None):
+        frames = [self._read_segment(segment) for segment in segments]
+        if columns is not None:
+            frames = [frame[columns] for frame in frames]
+        return concat_compact(frames) if frames else None
+
+    def read(self, min_date=None):
+        """Rows dated on or after the `min_date` ordinal (everything if None) as one compact frame."""
+        segments = [s for s in self.manifest()['segments'] if min_date is None or s['max_date'] >= min_date]
+        frame = self._read(segments)
+        if frame is not None and min_date is not None:
+            frame = frame[frame['date_ordinal'] >= min_date].reset_index(drop=True)
+        return frame
+
+    @property
+    def rows(self):
+        return self.manifest()['rows']
+
+    @property
+    def last_date(self):
+        segments = self.manifest()['segments']
+        return max(s['max_date'] for s in segments) if segments else None
+
+    def replace(self, frame):
+        """Make `frame` the whole history (later duplicates of a key win); returns the stored rows."""
+        frame = frame.drop_duplicates(KEY_COLUMNS, keep='last').reset_index(drop=True)
+        old = self.manifest()
+        segment = self._write_segment(frame)
+        self._write_manifest({**old, 'segments': [segment], 'rows': segment['rows']})
+        self._remove(old['segments'])
+        return frame
+
+    def append(self, frame):
+        """Add the rows of `frame` whose key is not stored yet; returns the rows that were added."""
+        frame = frame.drop_duplicates(KEY_COLUMNS, keep='last').reset_index(drop=True)
+        if frame.empty:
+            return frame
+        manifest = self.manifest()
+        lo, hi = int(frame['date_ordinal'].min()), int(frame['date_ordinal'].max())
+        overlapping = [s for s in manifest['segments'] if s['max_date'] >= lo and s['min_date'] <= hi]
+        existing = self._read(overlapping, KEY_COLUMNS)
+        if existing is not None:
+            existing = existing[existing['date_ordinal'].between(lo, hi)]
+            combined = concat_compact([existing.reset_index(drop=True), frame[KEY_COLUMNS]])
+            seen = combined.duplicated(KEY_COLUMNS, keep='first').to_numpy()[len(existing):]
+            frame = frame[~seen].reset_index(drop=True)
+        if frame.empty:
+            return frame
+        manifest['segments'].append(self._write_segment(frame))
+        manifest['rows'] += len(frame)
+        self._write_manifest(manifest)
+        if len(manifest['segments']) > DATASET_MAX_SEGMENTS:
+            self.compact()
+        return frame
+
+    def compact(self):
+        """Merge all segments into one."""
+        manifest = self.manifest()
+        if len(manifest['segments']) <= 1:
+            return
+        segment = self._write_segment(self._read(manifest['segments']))
+        self._write_manifest({**manifest, 'segments': [segment]})
+        self._remove(manifest['segments'])
+
+    def _remove(self, segments):
+        for segment in segments:
+            try:
+                os.remove(os.path.join(self.directory, segment['file']))
+            except FileNotFoundError:
+                pass
+
+    def set_meta(self, **fields):
+        manifest = self.manifest()
+        manifest.update(fields)
+        self._write_manifest(manifest)
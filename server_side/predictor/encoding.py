@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_string_dtype
+
+
+class IdEncoder:
+    """Stable store/product id -> integer code mapping fixed at training time.
+
+    Codes are positions in the sorted training categories (ids first seen by an
+    incremental update are appended after them), so an id keeps the same code no
+    matter which subset of ids (or in what order) a later upload contains.
+    Ids never seen during training encode to -1.
+    """
+
+    def __init__(self, categories):
+        self.categories = pd.Index(categories)
+
+    @classmethod
+    def fit(cls, values):
+        values = pd.Series(values)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return cls(values.cat.categories)
+        return cls(values.astype('category').cat.categories)
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        """Rebuild from the {code: id} dict stored in id_mappings.pkl."""
+        return cls([mapping[code] for code in range(len(mapping))])
+
+    def extend(self, values):
+        """Encoder that also knows the new ids in `values`.
+
+        New ids are appended after the existing categories, so every code a
+        trained model already uses keeps its meaning.
+        """
+        categories = self.categories
+        new = IdEncoder.fit(values).categories
+        if is_string_dtype(categories.dtype) or is_string_dtype(new.dtype):
+            categories, new = categories.astype(str), new.astype(str)
+        return IdEncoder(categories.append(new[~new.isin(categories)]))
+
+    def to_mapping(self):
+        return dict(enumerate(self.categories))
+
+    def encode(self, values):
+        values = pd.Series(values)
+        dtype = values.cat.categories.dtype if isinstance(values.dtype, pd.CategoricalDtype) else values.dtype
+        if is_string_dtype(self.categories.dtype) and not is_string_dtype(dtype):
+            # Trained on string ids but this upload parsed them as numbers
+            values = values.astype(str)
+        # Position in the training categories; ids not among them get -1
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Look up each distinct id once, then map the upload's own codes
+            lookup = np.append(self.categories.get_indexer(values.cat.categories), -1)
+            return lookup[values.cat.codes.to_numpy()]
+        return self.categories.get_indexer(values)
+
+    def decode(self, codes):
+        return self.categories.take(codes).to_numpy()
@@ -0,0 +1,169 @@
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from ingest import GROUP_KEYS
+
+ROLLING_WINDOWS = (7, 14, 28)
+# Most recent days per (store, product) group needed to compute every feature
+FEATURE_HISTORY_DAYS = max(ROLLING_WINDOWS)
+MEAN_COLUMNS = [f'sales_mean_{window}' for window in ROLLING_WINDOWS]
+
+# The original feature set: ids, date and same-day sales (trailing 7-day mean at predict time)
+BASIC_FEATURES = ['store_id', 'product_id', 'date_ordinal', 'sales']
+# Ids, date, weekday and the group's recent sales history as of the day before
+ROLLING_FEATURES = ['store_id', 'product_id', 'date_ordinal', 'day_of_week', *MEAN_COLUMNS, 'sales_trend']
+FEATURE_SETS = {'basic': BASIC_FEATURES, 'rolling': ROLLING_FEATURES}
+# Feature set used by new full retrains; incremental updates keep the model's own
+FEATURE_SET = os.environ.get('FEATURE_SET', 'rolling')
+
+
+def model_features(model):
+    """Feature names a fitted model expects (models fitted on arrays used the basic set)."""
+    names = getattr(model, 'feature_names_in_', None)
+    return BASIC_FEATURES if names is None else list(names)
+
+
+def day_of_week(date_ordinal):
+    # Ordinal 1 is Monday 0001-01-01, so this matches Timestamp.dayofweek
+    return (np.asarray(date_ordinal, dtype=np.int64) - 1) % 7
+
+
+def _sort_by_group(frame):
+    """Positions that order `frame` by store, product, then date (stable), plus each row's group start."""
+    order = np.lexsort((frame['date_ordinal'].to_numpy(),
+                        frame['product_id'].cat.codes.to_numpy(),
+                        frame['store_id'].cat.codes.to_numpy()))
+    store = frame['store_id'].cat.codes.to_numpy()[order]
+    product = frame['product_id'].cat.codes.to_numpy()[order]
+    new_group = np.ones(len(order), dtype=bool)
+    new_group[1:] = (store[1:] != store[:-1]) | (product[1:] != product[:-1])
+    group_start = np.maximum.accumulate(np.where(new_group, np.arange(len(order)), 0))
+    return order, group_start, new_group
+
+
+def _window_means(csum, group_start, end, window):
+    """Mean of rows (end - window, end] within each row's group; NaN where that is empty."""
+    start = np.maximum(end - window + 1, group_start)
+    count = end + 1 - start
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, (csum[end + 1] - csum[start]) / count, np.nan)
+
+
+def _with_categorical_ids(frame):
+    return frame.assign(**{col: frame[col].astype('category') for col in GROUP_KEYS
+                           if not isinstance(frame[col].dtype, pd.CategoricalDtype)})
+
+
+def training_features(frame):
+    """Per-row rolling features for fitting, computed with vectorized cumulative sums.
+
+    Each row's means cover only the group's earlier rows, which is what is known
+    when forecasting that day. A group's first row has no history and is dropped.
+    Returns the ROLLING_FEATURES columns plus `stock`, ordered by group and date.
+    """
+    frame = _with_categorical_ids(frame)
+    order, group_start, _ = _sort_by_group(frame)
+    frame = frame.iloc[order].reset_index(drop=True)
+    csum = np.concatenate([[0.0], np.cumsum(frame['sales'].to_numpy(dtype=np.float64))])
+    previous = np.arange(len(frame)) - 1
+    out = {col: frame[col] for col in ['store_id', 'product_id', 'date_ordinal']}
+    out['day_of_week'] = day_of_week(frame['date_ordinal'])
+    for window, col in zip(ROLLING_WINDOWS, MEAN_COLUMNS):
+        out[col] = _window_means(csum, group_start, previous, window)
+    out['sales_trend'] = out[MEAN_COLUMNS[0]] - out[MEAN_COLUMNS[-1]]
+    out['stock'] = frame['stock']
+    features = pd.DataFrame(out)
+    return features[previous >= group_start].reset_index(drop=True)
+
+
+def entity_features(frame):
+    """One row per (store, product) group with its rolling features as of its last day.
+
+    `frame` holds at least the last FEATURE_HISTORY_DAYS rows of each group (e.g.
+    ingest.read_sales_window). Indexed by the raw ids, sorted.
+    """
+    frame = _with_categorical_ids(frame)
+    if frame.empty:
+        return pd.DataFrame(columns=MEAN_COLUMNS + ['sales_trend'],
+                            index=pd.MultiIndex.from_arrays([[], []], names=GROUP_KEYS))
+    order, group_start, new_group = _sort_by_group(frame)
+    sales = frame['sales'].to_numpy(dtype=np.float64)[order]
+    csum = np.concatenate([[0.0], np.cumsum(sales)])
+    last = np.append(np.flatnonzero(new_group)[1:] - 1, len(order) - 1)
+    table = {col: _window_means(csum, group_start[last], last, window)
+             for window, col in zip(ROLLING_WINDOWS, MEAN_COLUMNS)}
+    table['sales_trend'] = table[MEAN_COLUMNS[0]] - table[MEAN_COLUMNS[-1]]
+    index = pd.MultiIndex.from_arrays([frame['store_id'].to_numpy()[order][last],
+                                       frame['product_id'].to_numpy()[order][last]], names=GROUP_KEYS)
+    return pd.DataFrame(table, index=index)
+
+
+class FeatureStore:
+    """Entity feature tables keyed by dataset version (the upload's sha256).
+
+    Building the table means parsing the upload; once stored, a predict against
+    the same data, under any model version, is a lookup plus a score. Tables are
+    kept in an in-memory LRU of `max_entries` and, if `directory` is set, on disk
+    (oldest files removed past `max_disk_entries`).
+    """
+
+    def __init__(self, directory=None, max_entries=32, max_disk_entries=1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.pkl')
+
+    def get(self, key):
+        """(table, last_date) for `key`, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key, table, last_date):
+        entry = (table, last_date)
+        self._remember(key, entry)
+        if self.directory:
+            path = self._path(key)
+            tmp_path = f'{path}.tmp.{os.getpid()}.{threading.get_ident()}'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self._trim_disk()
+        return entry
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _trim_disk(self):
+        files = sorted((e.stat().st_mtime, e.path) for e in os.scandir(self.directory) if e.name.endswith('.pkl'))
+        for _, path in files[:max(0, len(files) - self.max_disk_entries)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
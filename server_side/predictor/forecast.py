@@ -0,0 +1,357 @@
+import os
+import weakref
+from collections import namedtuple
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from artifact import FlatForest, tree_mean
+from features import BASIC_FEATURES, MEAN_COLUMNS, day_of_week, entity_features, model_features
+from instrumentation import metrics
+
+HORIZON_DAYS = 7
+SALES_WINDOW = 7
+# Upper bound on rows handed to a single model.predict call
+PREDICT_CHUNK_ROWS = int(os.environ.get('PREDICT_CHUNK_ROWS', 200000))
+# Longest horizon /api/forecast accepts
+MAX_HORIZON_DAYS = int(os.environ.get('MAX_HORIZON_DAYS', 90))
+# Upper bound on (row, tree) predictions held at once by score_distribution
+TREE_PREDICTION_PAIRS = int(os.environ.get('TREE_PREDICTION_PAIRS', 1 << 22))
+
+# Forecast groups (unseen ones last) with groups x horizon matrices: the mean and one per quantile
+DistributionForecast = namedtuple('DistributionForecast', ['store_ids', 'product_ids', 'dates', 'quantiles', 'mean',
+                                                           'quantile_values', 'unseen_groups'])
+# model -> highest date_ordinal split threshold in any of its trees
+_last_date_splits = weakref.WeakKeyDictionary()
+
+
+def trailing_sales_mean(df, keys, window=SALES_WINDOW):
+    """Mean of the last `window` sales per group, one row per group sorted by `keys`."""
+    tail = df.groupby(keys, sort=False).tail(window)
+    return tail.groupby(keys, sort=True)['sales'].mean()
+
+
+def horizon_dates(last_date, horizon=HORIZON_DAYS):
+    return pd.DatetimeIndex([last_date + pd.Timedelta(days=i) for i in range(1, horizon + 1)])
+
+
+def build_feature_matrix(store_codes, product_codes, sales, dates):
+    """Cross every group with every horizon date -> (groups * horizon, 4) float array."""
+    n_groups, horizon = len(store_codes), len(dates)
+    X = np.empty((n_groups * horizon, 4), dtype=np.float64)
+    X[:, 0] = np.repeat(np.asarray(store_codes, dtype=np.float64), horizon)
+    X[:, 1] = np.repeat(np.asarray(product_codes, dtype=np.float64), horizon)
+    X[:, 2] = np.tile(np.array([d.toordinal() for d in dates], dtype=np.float64), n_groups)
+    X[:, 3] = np.repeat(np.asarray(sales, dtype=np.float64), horizon)
+    return X
+
+
+def day_ordinals(dates):
+    """Day ordinals of a DatetimeIndex; arrays of ordinals pass through."""
+    if isinstance(dates, pd.DatetimeIndex):
+        return np.array([d.toordinal() for d in dates], dtype=np.int64)
+    return np.asarray(dates, dtype=np.int64)
+
+
+def build_entity_matrix(store_codes, product_codes, table, dates, feature_names, weekdays=None):
+    """Like build_feature_matrix, for any feature set, from per-group entity features.
+
+    `table` holds the groups' entity features (one row per group, same order as
+    the codes); they are repeated across the horizon while date and weekday vary.
+    `dates` may be day ordinals, and `weekdays` then overrides the weekday of each.
+    """
+    n_groups, horizon = len(store_codes), len(dates)
+    ordinals = day_ordinals(dates)
+    weekdays = day_of_week(ordinals) if weekdays is None else weekdays
+    X = np.empty((n_groups * horizon, len(feature_names)), dtype=np.float64)
+    for i, name in enumerate(feature_names):
+        if name == 'store_id':
+            X[:, i] = np.repeat(np.asarray(store_codes, dtype=np.float64), horizon)
+        elif name == 'product_id':
+            X[:, i] = np.repeat(np.asarray(product_codes, dtype=np.float64), horizon)
+        elif name == 'date_ordinal':
+            X[:, i] = np.tile(ordinals, n_groups)
+        elif name == 'day_of_week':
+            X[:, i] = np.tile(weekdays, n_groups)
+        elif name == 'sales':
+            # Basic models score on the trailing 7-day mean
+            X[:, i] = np.repeat(table[MEAN_COLUMNS[0]].to_numpy(dtype=np.float64), horizon)
+        else:
+            X[:, i] = np.repeat(table[name].to_numpy(dtype=np.float64), horizon)
+    return X
+
+
+def predict_in_chunks(model, X, chunk_rows=PREDICT_CHUNK_ROWS):
+    names = getattr(model, 'feature_names_in_', None)
+
+    def predict(rows):
+        if names is None or isinstance(model, FlatForest):
+            return model.predict(rows)
+        # Fitted on a named frame: score one with the same columns, so sklearn checks them instead of warning
+        return model.predict(pd.DataFrame(rows, columns=names, copy=False))
+
+    if len(X) <= chunk_rows:
+        return predict(X)
+    out = np.empty(len(X), dtype=np.float64)
+    for start in range(0, len(X), chunk_rows):
+        out[start:start + chunk_rows] = predict(X[start:start + chunk_rows])
+    return out
+
+
+def clamp_stock(values):
+    return np.maximum(0, np.round(values)).astype(np.int64)
+
+
+def tree_predictions(model, X):
+    """Every tree's prediction for every row of X, as a (rows, trees) array."""
+    if isinstance(model, FlatForest):
+        return model.predict_trees(X)
+    # What RandomForestRegressor.predict computes before averaging
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    out = np.empty((len(X), len(model.estimators_)), dtype=np.float64)
+    for t, estimator in enumerate(model.estimators_):
+        out[:, t] = estimator.predict(X, check_input=False)
+    return out
+
+
+def score_distribution(model, X, quantiles):
+    """Forest mean and `quantiles` of the trees' predictions, from one walk of the forest.
+
+    Returns a (rows, 1 + len(quantiles)) array of whole non-negative stock: the
+    mean, equal to model.predict, then each quantile.
+    """
+    n_trees = model.n_estimators if isinstance(model, FlatForest) else len(model.estimators_)
+    out = np.empty((len(X), 1 + len(quantiles)), dtype=np.int64)
+    block = max(1, TREE_PREDICTION_PAIRS // n_trees)
+    for start in range(0, len(X), block):
+        per_tree = tree_predictions(model, X[start:start + block])
+        stop = start + len(per_tree)
+        out[start:stop, 0] = clamp_stock(tree_mean(per_tree))
+        if len(quantiles):
+            out[start:stop, 1:] = clamp_stock(np.quantile(per_tree, quantiles, axis=1).T)
+    return out
+
+
+def last_date_split(model):
+    """Highest threshold any tree splits date_ordinal at (-inf if none does)."""
+    cached = _last_date_splits.get(model)
+    if cached is None:
+        feature = model_features(model).index('date_ordinal')
+        if isinstance(model, FlatForest):
+            thresholds = model.threshold[model.feature == feature]
+        else:
+            thresholds = np.concatenate([estimator.tree_.threshold[estimator.tree_.feature == feature]
+                                         for estimator in model.estimators_])
+        cached = _last_date_splits[model] = float(thresholds.max()) if len(thresholds) else -np.inf
+    return cached
+
+
+def horizon_columns(model, feature_names, dates):
+    """The distinct date columns scoring `dates` needs: (ordinals, weekdays, inverse).
+
+    Trees only compare dates with thresholds learned from training days, so
+    every date past the last threshold takes the same branches. Those dates are
+    scored as one stand-in ordinal and differ only by weekday, so past the
+    training data a horizon needs at most 7 columns (1 without a weekday
+    feature); column inverse[i] holds dates[i]'s predictions.
+    """
+    ordinals = day_ordinals(dates)
+    weekdays = day_of_week(ordinals)
+    if 'date_ordinal' in feature_names:
+        last_split = last_date_split(model)
+        stand_in = int(np.floor(last_split)) + 1 if np.isfinite(last_split) else int(ordinals[0])
+        ordinals = np.where(ordinals > last_split, stand_in, ordinals)
+    keys = np.stack([ordinals, weekdays if 'day_of_week' in feature_names else np.zeros_like(weekdays)], axis=1)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    return ordinals[first], weekdays[first], inverse.reshape(-1)
+
+
+def prediction_frame(store_ids, product_ids, dates, predicted):
+    horizon = len(dates)
+    return pd.DataFrame({
+        'store_id': np.repeat(store_ids, horizon),
+        'product_id': np.repeat(product_ids, horizon),
+        'date': np.tile(dates.strftime('%Y-%m-%d').to_numpy(dtype=object), len(store_ids)),
+        'predicted_stock': predicted,
+    })
+
+
+def forecast_with_model(df, last_date, model, store_encoder, product_encoder, horizon=HORIZON_DAYS, entities=None,
+                        forecaster=None):
+    """Score the whole horizon for every (store, product) group in one batch.
+
+    Ids are encoded with the encoders saved at training time. Groups with a store or
+    product the model has never seen get the trailing-mean fallback instead and are
+    appended after the scored groups; their count is left in attrs['unseen_groups'].
+
+    If `entities` (features.entity_features of the upload, e.g. from the feature
+    store) is given, groups are scored from it and `df` is not needed. Models
+    fitted on the rolling feature set always go through entity features, and are
+    scored by `forecaster` (a partition.PartitionedForecaster) when given.
+    """
+    feature_names = model_features(model)
+    if entities is None and feature_names != BASIC_FEATURES:
+        entities = entity_features(df)
+    if entities is not None:
+        return _forecast_entities(entities, last_date, model, store_encoder, product_encoder, horizon,
+                                  feature_names, forecaster)
+
+    with metrics.stage('encode'):
+        df = df.assign(store_code=store_encoder.encode(df['store_id']),
+                       product_code=product_encoder.encode(df['product_id']))
+        known = (df['store_code'] >= 0) & (df['product_code'] >= 0)
+
+    sales = trailing_sales_mean(df[known], ['store_code', 'product_code'])
+    store_codes = sales.index.get_level_values(0).to_numpy()
+    product_codes = sales.index.get_level_values(1).to_numpy()
+    dates = horizon_dates(last_date, horizon)
+
+    with metrics.stage('predict'):
+        X = build_feature_matrix(store_codes, product_codes, sales.to_numpy(), dates)
+        predicted = clamp_stock(predict_in_chunks(model, X)) if len(X) else np.empty(0, dtype=np.int64)
+    pred_df = prediction_frame(store_encoder.decode(store_codes),
+                               product_encoder.decode(product_codes), dates, predicted)
+
+    unseen_groups = 0
+    if not known.all():
+        unseen = forecast_fallback(df[~known], last_date, horizon)
+        unseen_groups = len(unseen) // horizon
+        pred_df = pd.concat([pred_df, unseen], ignore_index=True)
+    pred_df.attrs['unseen_groups'] = unseen_groups
+    return pred_df
+
+
+def _split_entities(entities, store_encoder, product_encoder):
+    """Known groups ordered by (store code, product code), plus the groups with an unseen id."""
+    with metrics.stage('encode'):
+        store_codes = store_encoder.encode(entities.index.get_level_values(0))
+        product_codes = product_encoder.encode(entities.index.get_level_values(1))
+        known = (store_codes >= 0) & (product_codes >= 0)
+        order = np.lexsort((product_codes[known], store_codes[known]))
+    return store_codes[known][order], product_codes[known][order], entities[known].iloc[order], entities[~known]
+
+
+def _unseen_frame(unseen, dates):
+    # Same fallback as forecast_fallback: the trailing 7-day sales mean
+    return prediction_frame(unseen.index.get_level_values(0).to_numpy(),
+                            unseen.index.get_level_values(1).to_numpy(), dates,
+                            np.repeat(clamp_stock(unseen[MEAN_COLUMNS[0]].to_numpy()), len(dates)))
+
+
+def _forecast_entities(entities, last_date, model, store_encoder, product_encoder, horizon, feature_names,
+                       forecaster=None):
+    store_codes, product_codes, table, unseen = _split_entities(entities, store_encoder, product_encoder)
+    dates = horizon_dates(last_date, horizon)
+
+    with metrics.stage('predict'):
+        if forecaster is not None:
+            predicted = forecaster.score(model, store_codes, product_codes, table, dates, feature_names)
+        else:
+            X = build_entity_matrix(store_codes, product_codes, table, dates, feature_names)
+            predicted = clamp_stock(predict_in_chunks(model, X)) if len(X) else np.empty(0, dtype=np.int64)
+    pred_df = prediction_frame(store_encoder.decode(store_codes),
+                               product_encoder.decode(product_codes), dates, predicted)
+
+    if len(unseen):
+        pred_df = pd.concat([pred_df, _unseen_frame(unseen, dates)], ignore_index=True)
+    pred_df.attrs['unseen_groups'] = len(unseen)
+    return pred_df
+
+
+def iter_forecast(entities, last_date, model, store_encoder, product_encoder, forecaster,
+                  chunk_groups, horizon=HORIZON_DAYS):
+    """Streaming forecast_with_model: returns (unseen_groups, iterator of prediction frames).
+
+    Groups are scored in shards of about `chunk_groups` whole stores by
+    `forecaster` (a partition.PartitionedForecaster) and each shard's frame is
+    yielded as soon as it is scored, so only one shard's output is in memory.
+    Concatenated, the frames equal forecast_with_model's result.
+    """
+    store_codes, product_codes, table, unseen = _split_entities(entities, store_encoder, product_encoder)
+    dates = horizon_dates(last_date, horizon)
+    feature_names = model_features(model)
+
+    def frames():
+        shards = forecaster.iter_score(model, store_codes, product_codes, table, dates, feature_names, chunk_groups)
+        while True:
+            # Only the scoring is timed, not the time the response writer holds each frame
+            with metrics.stage('predict'):
+                shard = next(shards, None)
+            if shard is None:
+                break
+            start, stop, predicted = shard
+            yield prediction_frame(store_encoder.decode(store_codes[start:stop]),
+                                   product_encoder.decode(product_codes[start:stop]), dates, predicted)
+        if len(unseen):
+            yield _unseen_frame(unseen, dates)
+
+    return len(unseen), frames()
+
+
+def forecast_fallback(df, last_date, horizon=HORIZON_DAYS):
+    """No trained model: repeat each group's trailing sales mean across the horizon."""
+    sales = trailing_sales_mean(df, ['store_id', 'product_id'])
+    dates = horizon_dates(last_date, horizon)
+    predicted = np.repeat(clamp_stock(sales.to_numpy()), len(dates))
+    return prediction_frame(sales.index.get_level_values(0).to_numpy(),
+                            sales.index.get_level_values(1).to_numpy(), dates, predicted)
+
+
+def iter_fallback(df, last_date, chunk_groups, horizon=HORIZON_DAYS):
+    """Streaming forecast_fallback: its frames, `chunk_groups` groups at a time.
+
+    Only the per-group means are computed up front; concatenated, the frames
+    equal forecast_fallback's result.
+    """
+    sales = trailing_sales_mean(df, ['store_id', 'product_id'])
+    dates = horizon_dates(last_date, horizon)
+    stock = clamp_stock(sales.to_numpy())
+    store_ids = sales.index.get_level_values(0).to_numpy()
+    product_ids = sales.index.get_level_values(1).to_numpy()
+    for start in range(0, len(sales), chunk_groups):
+        stop = start + chunk_groups
+        yield prediction_frame(store_ids[start:stop], product_ids[start:stop], dates,
+                               np.repeat(stock[start:stop], len(dates)))
+
+
+def forecast_distribution(entities, last_date, model, store_encoder, product_encoder, horizon=HORIZON_DAYS,
+                          quantiles=(), forecaster=None):
+    """Mean and quantile forecasts of every group for `horizon` days, from one scoring pass.
+
+    The quantiles are taken over the forest's per-tree predictions, which
+    scoring computes anyway, and every horizon date is scored from the distinct
+    columns of horizon_columns, so a longer horizon adds little scoring. The mean
+    matches forecast_with_model. Groups with an unseen id (counted in
+    unseen_groups) come last, and they, or all groups when `model` is None,
+    get the trailing sales mean for every statistic.
+    """
+    dates = horizon_dates(last_date, horizon)
+    quantiles = tuple(quantiles)
+    if model is None:
+        unseen = entities
+        scored = np.empty((1 + len(quantiles), 0, horizon), dtype=np.int64)
+    else:
+        store_codes, product_codes, table, unseen = _split_entities(entities, store_encoder, product_encoder)
+        feature_names = model_features(model)
+        ordinals, weekdays, inverse = horizon_columns(model, feature_names, dates)
+        with metrics.stage('predict'):
+            scorer = partial(score_distribution, quantiles=quantiles)
+            if forecaster is not None:
+                scored = forecaster.score(model, store_codes, product_codes, table, ordinals, feature_names,
+                                          weekdays=weekdays, scorer=scorer)
+            else:
+                scored = scorer(model, build_entity_matrix(store_codes, product_codes, table, ordinals,
+                                                           feature_names, weekdays))
+        # (groups * columns, statistics) -> (statistics, groups, horizon)
+        scored = scored.reshape(len(store_codes), len(ordinals), 1 + len(quantiles)).transpose(2, 0, 1)
+        scored = scored[:, :, inverse]
+    fallback = np.repeat(clamp_stock(unseen[MEAN_COLUMNS[0]].to_numpy())[:, None], horizon, axis=1)
+    values = np.concatenate([scored, np.broadcast_to(fallback, (len(scored),) + fallback.shape)], axis=1)
+    store_ids = unseen.index.get_level_values(0).to_numpy()
+    product_ids = unseen.index.get_level_values(1).to_numpy()
+    if model is not None:
+        store_ids = np.concatenate([store_encoder.decode(store_codes), store_ids])
+        product_ids = np.concatenate([product_encoder.decode(product_codes), product_ids])
+    return DistributionForecast(store_ids, product_ids, dates, quantiles, values[0], values[1:],
+                                len(unseen) if model is not None else 0)
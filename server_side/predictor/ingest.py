@@ -0,0 +1,117 @@
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_integer_dtype, union_categoricals
+
+REQUIRED_COLUMNS = {'store_id', 'product_id', 'date', 'sales', 'stock'}
+GROUP_KEYS = ['store_id', 'product_id']
+CSV_CHUNK_ROWS = int(os.environ.get('CSV_CHUNK_ROWS', 250000))
+UNIX_EPOCH_ORDINAL = 719163  # date(1970, 1, 1).toordinal()
+
+# Last `window` rows of every (store, product) group plus the latest date in the file
+SalesWindow = namedtuple('SalesWindow', ['frame', 'last_date'])
+
+
+class IngestError(ValueError):
+    """Upload could not be parsed; the message is returned to the client as-is."""
+
+
+def date_to_ordinal(dates):
+    """Vectorized equivalent of dates.map(pd.Timestamp.toordinal)."""
+    days = dates.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]').astype(np.int64)
+    return (days + UNIX_EPOCH_ORDINAL).astype(np.int32)
+
+
+def _compact_numeric(series):
+    return series.astype(np.int32) if is_integer_dtype(series) else series
+
+
+def _read_chunks(file, chunk_rows):
+    try:
+        reader = pd.read_csv(file, chunksize=chunk_rows)
+    except Exception as e:
+        raise IngestError(f'Failed to read CSV: {str(e)}')
+    with reader:
+        while True:
+            try:
+                chunk = next(reader)
+            except StopIteration:
+                return
+            except Exception as e:
+                raise IngestError(f'Failed to read CSV: {str(e)}')
+            yield chunk
+
+
+def iter_sales_chunks(file, chunk_rows=CSV_CHUNK_ROWS):
+    """Yield the upload as compact frames of at most `chunk_rows` rows.
+
+    Each frame has categorical store/product ids, an int32 `date_ordinal` and
+    int32 sales/stock when the column is integral.
+    """
+    for chunk in _read_chunks(file, chunk_rows):
+        if not REQUIRED_COLUMNS.issubset(chunk.columns):
+            raise IngestError(f'Missing columns. Required: {REQUIRED_COLUMNS}')
+        try:
+            dates = pd.to_datetime(chunk['date'])
+        except Exception as e:
+            raise IngestError(f'Invalid date format: {str(e)}')
+        yield pd.DataFrame({
+            'store_id': chunk['store_id'].astype('category'),
+            'product_id': chunk['product_id'].astype('category'),
+            'date_ordinal': date_to_ordinal(dates),
+            'sales': _compact_numeric(chunk['sales']),
+            'stock': _compact_numeric(chunk['stock']),
+        })
+
+
+def concat_compact(frames):
+    """pd.concat that keeps id columns categorical, with sorted union categories."""
+    if len(frames) == 1:
+        return frames[0]
+    frames = [frame.copy(deep=False) for frame in frames]
+    for col in GROUP_KEYS:
+        columns = [f[col] for f in frames]
+        try:
+            categories = union_categoricals(columns, sort_categories=True).categories
+        except TypeError:
+            # Chunks inferred different id dtypes (e.g. ints then strings). Reading the
+            # whole file at once would have parsed every id as a string, so do the same.
+            columns = [c.cat.rename_categories(c.cat.categories.astype(str)) for c in columns]
+            categories = union_categoricals(columns, sort_categories=True).categories
+        for frame, column in zip(frames, columns):
+            frame[col] = column.cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_training_frame(file, chunk_rows=CSV_CHUNK_ROWS):
+    """Whole upload as one compact frame (the forest needs every row to fit)."""
+    frames = list(iter_sales_chunks(file, chunk_rows))
+    if not frames:
+        raise IngestError('Failed to read CSV: no data rows')
+    return concat_compact(frames)
+
+
+def read_sales_window(file, window=7, chunk_rows=CSV_CHUNK_ROWS):
+    """Stream the upload keeping only what /api/predict needs.
+
+    Memory is bounded by `chunk_rows` plus `window` rows per group, regardless of
+    how long the sales history is. The window holds each group's most recent dates
+    (file order breaks ties), so row order in the upload does not matter.
+    """
+    tail = None
+    last_ordinal = None
+    for chunk in iter_sales_chunks(file, chunk_rows):
+        if chunk.empty:
+            continue
+        chunk_last = int(chunk['date_ordinal'].max())
+        last_ordinal = chunk_last if last_ordinal is None else max(last_ordinal, chunk_last)
+        part = chunk[GROUP_KEYS + ['date_ordinal', 'sales']]
+        tail = part if tail is None else concat_compact([tail, part])
+        tail = tail.sort_values('date_ordinal', kind='stable')
+        tail = tail.groupby(GROUP_KEYS, sort=False, observed=True, dropna=False).tail(window)
+
+    if tail is None:
+        return SalesWindow(pd.DataFrame(columns=GROUP_KEYS + ['date_ordinal', 'sales']), None)
+    return SalesWindow(tail.reset_index(drop=True), pd.Timestamp.fromordinal(last_ordinal))
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from instrumentation import metrics
+
+TERMINAL_STATUSES = {'succeeded', 'failed'}
+
+
+def spool_upload(file, directory, chunk_size=1 << 20):
+    """Copy an uploaded file to disk while hashing it; returns (path, sha256 hex)."""
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, path = tempfile.mkstemp(dir=directory, suffix='.upload.csv')
+    with os.fdopen(fd, 'wb') as out:
+        while True:
+            block = file.read(chunk_size)
+            if not block:
+                break
+            digest.update(block)
+            out.write(block)
+    return path, digest.hexdigest()
+
+
+class JobStore:
+    """Job status as one small JSON file per job.
+
+    Files rather than process memory so that the training worker process can report
+    progress and any gunicorn worker can answer GET /api/train/<id>.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f'{job_id}.json')
+
+    def get(self, job_id):
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def update(self, job_id, **fields):
+        job = self.get(job_id) or {'id': job_id}
+        job.update(fields)
+        tmp_path = f'{self._path(job_id)}.tmp.{os.getpid()}'
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._path(job_id))
+        return job
+
+
+class TrainingQueue:
+    """Runs training jobs on a process pool, at most `max_concurrent` at a time.
+
+    A submission whose dataset hash matches a job that is still queued or running
+    returns that job instead of starting a second identical fit. That check is
+    per queue, i.e. per server process; jobs themselves are shared via `store`.
+    """
+
+    def __init__(self, store, max_concurrent=1):
+        self.store = store
+        self._pool = ProcessPoolExecutor(max_workers=max_concurrent, mp_context=get_context('spawn'))
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def submit(self, dataset_hash, fn, *args):
+        """Queue fn(job_id, *args); returns (job, created)."""
+        with self._lock:
+            job_id = self._active.get(dataset_hash)
+            if job_id is not None:
+                return self.store.get(job_id), False
+            job_id = uuid.uuid4().hex
+            job = self.store.update(job_id, status='queued', stage='queued', progress=0.0,
+                                    dataset_hash=dataset_hash, submitted_at=time.time())
+            self._active[dataset_hash] = job_id
+            future = self._pool.submit(fn, job_id, *args)
+        future.add_done_callback(lambda f: self._finished(dataset_hash, job_id, f))
+        return job, True
+
+    def _finished(self, dataset_hash, job_id, future):
+        with self._lock:
+            self._active.pop(dataset_hash, None)
+        error = future.exception()
+        job = self.store.get(job_id) or {}
+        if error is not None and job.get('status') not in TERMINAL_STATUSES:
+            # The worker died before it could record the failure itself
+            job = self.store.update(job_id, status='failed', error=str(error), finished_at=time.time())
+        # Jobs run in the pool's processes, so their metrics are recorded here
+        metrics.inc('training_jobs_total', status=job.get('status', 'unknown'), mode=job.get('mode', 'unknown'))
+        if job.get('started_at') and job.get('finished_at'):
+            metrics.observe('training_job_seconds', job['finished_at'] - job['started_at'], mode=job.get('mode'))
+        if job.get('fit_seconds') is not None:
+            metrics.observe('stage_seconds', job['fit_seconds'], stage='fit')
+
+    def shutdown(self, wait=True):
+        """Stop the pool, waiting for running jobs when `wait`."""
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,209 @@
+import os
+import tempfile
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import get_all_start_methods, get_context
+
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+
+from artifact import FLAT_SUFFIX, FlatForest
+from forecast import build_entity_matrix, clamp_stock, predict_in_chunks
+
+# Processes scoring /api/predict shards; 0 or 1 scores in the request process
+PREDICT_WORKERS = int(os.environ.get('PREDICT_WORKERS', 0))
+# Approximate (store, product) groups per shard; shards always hold whole stores
+PREDICT_SHARD_GROUPS = int(os.environ.get('PREDICT_SHARD_GROUPS', 5000))
+# Forking a threaded server (Flask, gunicorn threads) can deadlock the child on a lock
+# another thread held, so workers start from a clean forkserver (or spawn) by default.
+PREDICT_START_METHOD = os.environ.get('PREDICT_START_METHOD') or (
+    'forkserver' if 'forkserver' in get_all_start_methods() else 'spawn')
+# Pickled models with a live worker pool; flat forests all share one more pool
+PREDICT_MAX_POOLS = int(os.environ.get('PREDICT_MAX_POOLS', 4))
+# Ship pickled forests to workers as a flat forest file they all map, instead of a private copy each.
+# Flat scoring takes several times the CPU of sklearn's compiled trees; with 0, a single-threaded
+# server can still share the forest copy-on-write by setting PREDICT_START_METHOD=fork.
+PREDICT_FLAT_WORKERS = os.environ.get('PREDICT_FLAT_WORKERS', '1') == '1'
+# Where those flat forests are written (the temp dir by default)
+PREDICT_FLAT_DIR = os.environ.get('PREDICT_FLAT_DIR') or tempfile.gettempdir()
+
+# The pool's model in a worker process, set once by _init_worker
+_worker_model = None
+
+
+def _init_worker(model):
+    global _worker_model
+    _worker_model = model
+
+
+def _score_stock(model, X):
+    return clamp_stock(predict_in_chunks(model, X))
+
+
+def _score_shard(store_codes, product_codes, table, dates, feature_names, model=None, weekdays=None,
+                 scorer=_score_stock):
+    model = _worker_model if model is None else model
+    if model.n_jobs != 1:
+        # One process per core already; tree-level threads would only oversubscribe
+        model.n_jobs = 1
+    X = build_entity_matrix(store_codes, product_codes, table, dates, feature_names, weekdays)
+    return scorer(model, X)
+
+
+def _ships_by_path(model):
+    # A flat forest loaded from a file pickles as its path (FlatForest.__reduce__)
+    return getattr(model, 'path', None) is not None
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def store_shards(store_codes, shard_groups):
+    """Split groups sorted by store into [start, stop) runs of about `shard_groups` whole stores."""
+    n = len(store_codes)
+    if n == 0:
+        return []
+    store_starts = np.flatnonzero(np.r_[True, store_codes[1:] != store_codes[:-1]])
+    bounds = [0]
+    for start in store_starts[1:]:
+        if start - bounds[-1] >= shard_groups:
+            bounds.append(int(start))
+    bounds.append(n)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class PartitionedForecaster:
+    """Scores forecast groups in store shards across process pools.
+
+    Flat forests loaded from a file travel with each shard as their path, so
+    one shared pool serves all of them, across reloads too, and workers map
+    the same file. With `flat_workers` a pickled sklearn forest is first
+    written once to `flat_dir` as a flat forest and then shipped the same way:
+    unpickled, each worker would hold a private copy of the whole model. The
+    file is removed when the model object is garbage collected.
+
+    Any other model gets a pool tied to that model object: its workers get the
+    model once when they start. Up to `max_pools` of them are kept, least
+    recently used first out, so requests alternating between tenants reuse
+    their pools instead of rebuilding one per switch.
+    Shards are contiguous runs of the sorted groups and their predictions are
+    concatenated in shard order, so the output is the same as scoring
+    everything in one process.
+    """
+
+    def __init__(self, workers=PREDICT_WORKERS, shard_groups=PREDICT_SHARD_GROUPS,
+                 start_method=PREDICT_START_METHOD, max_pools=PREDICT_MAX_POOLS,
+                 flat_workers=PREDICT_FLAT_WORKERS, flat_dir=PREDICT_FLAT_DIR):
+        self.workers = workers
+        self.shard_groups = shard_groups
+        self.start_method = start_method
+        self.max_pools = max_pools
+        self.flat_workers = flat_workers
+        self.flat_dir = flat_dir
+        # sklearn forest -> its FlatForest file, for as long as the forest is alive
+        self._flat_models = weakref.WeakKeyDictionary()
+        # id(model) -> (model, pool); the entry holds the model, so its id is not reused meanwhile
+        self._pools = OrderedDict()
+        self._shared_pool = None
+        self.pools_started = 0
+        self._lock = threading.Lock()
+
+    def _new_pool(self, model=None):
+        # Pool processes get their arguments by fork (copy-on-write) or by pickling
+        initializer, initargs = (None, ()) if model is None else (_init_worker, (model,))
+        self.pools_started += 1
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context(self.start_method),
+                                   initializer=initializer, initargs=initargs)
+
+    def _flat(self, model):
+        """`model` as a mapped flat forest, converting a sklearn forest on first use; else None."""
+        if _ships_by_path(model):
+            return model
+        if not self.flat_workers or not isinstance(model, RandomForestRegressor):
+            return None
+        with self._lock:
+            forest = self._flat_models.get(model)
+            if forest is None:
+                os.makedirs(self.flat_dir, exist_ok=True)
+                path = os.path.join(self.flat_dir, f'predelix-{uuid.uuid4().hex}{FLAT_SUFFIX}')
+                FlatForest.from_model(model).save(path)
+                forest = self._flat_models[model] = FlatForest.load(path)
+                weakref.finalize(model, _remove, path)
+            return forest
+
+    def _pool_for(self, model):
+        with self._lock:
+            if _ships_by_path(model):
+                if self._shared_pool is None:
+                    self._shared_pool = self._new_pool()
+                return self._shared_pool
+            entry = self._pools.get(id(model))
+            if entry is None:
+                entry = self._pools[id(model)] = (model, self._new_pool(model))
+                while len(self._pools) > max(self.max_pools, 1):
+                    # Shards already submitted to an evicted pool still finish
+                    _, (_, evicted) = self._pools.popitem(last=False)
+                    evicted.shutdown(wait=False)
+            self._pools.move_to_end(id(model))
+            return entry[1]
+
+    def iter_score(self, model, store_codes, product_codes, table, dates, feature_names, shard_groups=None,
+                   weekdays=None, scorer=_score_stock):
+        """Yield (start, stop, predicted) for each shard in order, as soon as it is scored.
+
+        Without a pool the shards are scored lazily in this process, so the first
+        one is ready after scoring only it. `scorer(model, X)` turns a shard's
+        feature matrix into its output (whole stock by default); it must pickle.
+        """
+        shards = store_shards(store_codes, shard_groups or self.shard_groups)
+        futures = None
+        if self.workers > 1 and len(shards) > 1:
+            flat = self._flat(model)
+            pool = self._pool_for(model if flat is None else flat)
+            try:
+                futures = [pool.submit(_score_shard, store_codes[start:stop], product_codes[start:stop],
+                                       table.iloc[start:stop], dates, feature_names, flat, weekdays, scorer)
+                           for start, stop in shards]
+            except RuntimeError:
+                # The pool was evicted for another model while this request was starting
+                futures = None
+        try:
+            for i, (start, stop) in enumerate(shards):
+                if futures is not None:
+                    yield start, stop, futures[i].result()
+                    continue
+                X = build_entity_matrix(store_codes[start:stop], product_codes[start:stop],
+                                        table.iloc[start:stop], dates, feature_names, weekdays)
+                yield start, stop, scorer(model, X)
+        finally:
+            if futures is not None:
+                # Closed early: drop the shards not started yet and let the started ones open
+                # the model's file before `model`, and with it the file, can be released
+                for future in futures:
+                    future.cancel()
+                wait(futures)
+
+    def score(self, model, store_codes, product_codes, table, dates, feature_names, weekdays=None,
+              scorer=_score_stock):
+        """Predicted stock for every group x date, in the order of the given groups."""
+        parts = [predicted for _, _, predicted in
+                 self.iter_score(model, store_codes, product_codes, table, dates, feature_names,
+                                 weekdays=weekdays, scorer=scorer)]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def shutdown(self):
+        with self._lock:
+            pools = [pool for _, pool in self._pools.values()]
+            if self._shared_pool is not None:
+                pools.append(self._shared_pool)
+            self._pools.clear()
+            self._shared_pool = None
+        for pool in pools:
+            pool.shutdown()
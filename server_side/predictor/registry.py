@@ -0,0 +1,341 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import joblib
+
+from artifact import FLAT_SUFFIX, FlatForest, load_flat_model, save_flat_model
+from encoding import IdEncoder
+from instrumentation import get_logger, metrics
+
+log = get_logger('predictor.registry')
+
+# A loaded model plus the id mappings it was trained with. Requests hold on to
+# the snapshot they started with, so a reload never changes a model mid-request.
+# `metadata` is the flat artifact's metadata (empty for pickled models). `version`
+# identifies the artifact files on disk (mtime and size); `name` is the ModelStore
+# version directory it was loaded from ('v000003'), None outside a ModelStore.
+ModelSnapshot = namedtuple('ModelSnapshot', ['version', 'model', 'mappings', 'encoders', 'metadata', 'name'],
+                           defaults=[{}, None])
+
+# Model ids name a directory, so they are limited to a safe character set
+MODEL_ID_PATTERN = re.compile(r'[A-Za-z0-9][A-Za-z0-9_.-]{0,63}')
+# File names inside a version directory
+PICKLE_MODEL_FILE = 'model.pkl'
+PICKLE_MAPPING_FILE = 'id_mappings.pkl'
+FLAT_MODEL_FILE = 'model' + FLAT_SUFFIX
+META_FILE = 'meta.json'
+CURRENT_FILE = 'CURRENT'
+
+
+def atomic_dump(value, path):
+    """joblib.dump to a temp file then rename, so readers never see a partial artifact."""
+    tmp_path = f'{path}.tmp.{os.getpid()}.{threading.get_ident()}'
+    joblib.dump(value, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class ModelRegistry:
+    """Keeps the current model resident and reloads it when the artifact on disk changes.
+
+    Loading with `mmap_mode` maps the numpy arrays in the pickle from the page cache
+    (shared by every gunicorn worker) instead of buffering them through the unpickler.
+    Note that sklearn's Tree.__setstate__ still memcpy's nodes into its own buffers,
+    so each worker ends up with one private copy of the forest rather than two.
+
+    A `model_path` ending in artifact.FLAT_SUFFIX is a FlatForest file instead:
+    one artifact holding the trees, id mappings and metadata, whose arrays stay
+    mapped from the page cache, so workers share a single copy. `mapping_path`
+    is not used then.
+    """
+
+    def __init__(self, model_path, mapping_path, mmap_mode='r', name=None):
+        self.model_path = model_path
+        self.mapping_path = mapping_path
+        self.mmap_mode = mmap_mode
+        self.name = name
+        self.flat = model_path.endswith(FLAT_SUFFIX)
+        self.loads = 0
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def _artifact_version(self):
+        try:
+            model_stat = os.stat(self.model_path)
+            if self.flat:
+                return (model_stat.st_mtime_ns, model_stat.st_size)
+            mapping_stat = os.stat(self.mapping_path)
+        except FileNotFoundError:
+            return None
+        return (model_stat.st_mtime_ns, model_stat.st_size,
+                mapping_stat.st_mtime_ns, mapping_stat.st_size)
+
+    def get(self):
+        """Return the current ModelSnapshot, or None if no model has been trained yet."""
+        version = self._artifact_version()
+        snapshot = self._snapshot
+        if version is None:
+            return None
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.version == version:
+                return snapshot
+            with metrics.stage('load', format='flat' if self.flat else 'pickle'):
+                if self.flat:
+                    model, mappings = load_flat_model(self.model_path, mmap=self.mmap_mode is not None)
+                    metadata = model.metadata
+                else:
+                    model = joblib.load(self.model_path, mmap_mode=self.mmap_mode)
+                    mappings = joblib.load(self.mapping_path)
+                    metadata = {}
+            # Swapping the reference is atomic; in-flight requests keep the old snapshot
+            encoders = {key: IdEncoder.from_mapping(mapping) for key, mapping in mappings.items()}
+            self._snapshot = ModelSnapshot(version, model, mappings, encoders, metadata, self.name)
+            self.loads += 1
+            log.info("✅ Loaded model", path=self.model_path, version=version[0], load=self.loads)
+            return self._snapshot
+
+    def save(self, model, mappings, **metadata):
+        """Write a new model/mapping pair; every worker picks it up on its next get().
+
+        `metadata` (mse, data hash, ...) is stored in flat artifacts only. Returns
+        the model file's mtime_ns, which identifies this artifact version.
+        """
+        if self.flat:
+            save_flat_model(self.model_path, model, mappings, **metadata)
+            return os.stat(self.model_path).st_mtime_ns
+        atomic_dump(mappings, self.mapping_path)
+        atomic_dump(model, self.model_path)
+        return os.stat(self.model_path).st_mtime_ns
+
+
+def model_nbytes(model):
+    """Approximate memory held by a loaded model's trees (mapped pages included for flat forests)."""
+    if isinstance(model, FlatForest):
+        return model.nbytes
+    # sklearn's 64-byte node struct plus the node value array
+    return sum(estimator.tree_.node_count * 64 + estimator.tree_.value.nbytes
+               for estimator in getattr(model, 'estimators_', []))
+
+
+def _version_number(name):
+    return int(name[1:]) if name.startswith('v') and name[1:].isdigit() else None
+
+
+def _version_names(directory):
+    """Version directory names in `directory`, oldest first."""
+    return sorted((name for name in os.listdir(directory) if _version_number(name) is not None),
+                  key=_version_number)
+
+
+class ModelStore:
+    """Models for many tenants or datasets, each published in numbered versions under `root`.
+
+        <root>/<model_id>/v000003/   one artifact (model.pkl + id_mappings.pkl, or model.forest) and meta.json
+        <root>/<model_id>/CURRENT    name of the published version
+
+    A version directory is complete before CURRENT is replaced by a rename, so
+    readers see either the old or the new model, never the model of one job
+    with the mappings of another. Version numbers are claimed with mkdir, so
+    concurrent jobs never write into the same directory. After a publish only
+    the newest `keep_versions` are kept.
+
+    Loaded models stay in an LRU bounded by count and by approximate tree bytes.
+    `get` costs a stat of CURRENT and of the artifact when the model is resident;
+    it loads only after a publish or an eviction. Evicted snapshots stay valid
+    for the requests still holding them.
+    """
+
+    def __init__(self, root, fmt='pickle', mmap_mode='r', max_models=64, max_bytes=4 * 2 ** 30, keep_versions=3):
+        if fmt not in ('pickle', 'flat'):
+            raise ValueError(f"Unknown model format {fmt!r}, choose from ['flat', 'pickle']")
+        self.root = root
+        self.fmt = fmt
+        self.mmap_mode = mmap_mode
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.keep_versions = keep_versions
+        self.loads = 0
+        self.evictions = 0
+        # model id -> (version name, ModelRegistry, tree bytes or None until loaded)
+        self._loaded = OrderedDict()
+        self._bytes = 0
+        # model id -> (CURRENT stat, version name)
+        self._pointers = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def valid_id(model_id):
+        return isinstance(model_id, str) and MODEL_ID_PATTERN.fullmatch(model_id) is not None
+
+    def _directory(self, model_id):
+        if not self.valid_id(model_id):
+            raise ValueError(f'Invalid model id {model_id!r}')
+        return os.path.join(self.root, model_id)
+
+    @staticmethod
+    def _artifact_paths(version_dir, fmt=None):
+        """(model path, mapping path) in a version directory; without `fmt`, whichever format is there."""
+        flat_path = os.path.join(version_dir, FLAT_MODEL_FILE)
+        if fmt == 'flat' or (fmt is None and os.path.exists(flat_path)):
+            return flat_path, None
+        return os.path.join(version_dir, PICKLE_MODEL_FILE), os.path.join(version_dir, PICKLE_MAPPING_FILE)
+
+    def current_version(self, model_id):
+        """Name of the published version of `model_id`, or None if it has none."""
+        path = os.path.join(self._directory(model_id), CURRENT_FILE)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        cached = self._pointers.get(model_id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        with open(path) as f:
+            version = f.read().strip()
+        self._pointers[model_id] = (key, version)
+        return version
+
+    def get(self, model_id):
+        """ModelSnapshot of the published version of `model_id`, or None if it was never trained."""
+        version = self.current_version(model_id)
+        if version is None:
+            return None
+        with self._lock:
+            entry = self._loaded.get(model_id)
+            if entry is None or entry[0] != version:
+                if entry is not None:
+                    self._bytes -= entry[2] or 0
+                model_path, mapping_path = self._artifact_paths(os.path.join(self.root, model_id, version))
+                registry = ModelRegistry(model_path, mapping_path, self.mmap_mode, name=version)
+                entry = self._loaded[model_id] = (version, registry, None)
+            self._loaded.move_to_end(model_id)
+        registry = entry[1]
+        loads = registry.loads
+        # Loading happens under the registry's own lock, so other models are served meanwhile
+        snapshot = registry.get()
+        if snapshot is not None and registry.loads != loads:
+            self._account(model_id, registry, model_nbytes(snapshot.model))
+        return snapshot
+
+    def _account(self, model_id, registry, nbytes):
+        with self._lock:
+            self.loads += 1
+            entry = self._loaded.get(model_id)
+            if entry is None or entry[1] is not registry:
+                return
+            self._bytes += nbytes - (entry[2] or 0)
+            self._loaded[model_id] = (entry[0], registry, nbytes)
+            # The model just loaded always stays, even when it alone is over the byte budget
+            while len(self._loaded) > 1 and (len(self._loaded) > self.max_models or self._bytes > self.max_bytes):
+                evicted_id, (_, _, evicted_bytes) = self._loaded.popitem(last=False)
+                if evicted_id == model_id:
+                    self._loaded[model_id] = (entry[0], registry, nbytes)
+                    break
+                self._bytes -= evicted_bytes or 0
+                self._pointers.pop(evicted_id, None)
+                self.evictions += 1
+                log.info("♻️  Evicted model", model_id=evicted_id, bytes=evicted_bytes)
+
+    def save(self, model_id, model, mappings, **metadata):
+        """Write `model` as a new version of `model_id` and publish it; returns the version name."""
+        version, version_dir = self._new_version(model_id)
+        ModelRegistry(*self._artifact_paths(version_dir, self.fmt)).save(model, mappings, **metadata)
+        self._write_meta(version_dir, {**metadata, 'version': version, 'format': self.fmt, 'saved_at': time.time()})
+        self.publish(model_id, version)
+        return version
+
+    def import_files(self, model_id, model_path, mapping_path=None, **metadata):
+        """Publish existing artifact files (e.g. a single pre-store model) as a new version of `model_id`."""
+        fmt = 'flat' if model_path.endswith(FLAT_SUFFIX) else 'pickle'
+        version, version_dir = self._new_version(model_id)
+        target_model, target_mapping = self._artifact_paths(version_dir, fmt)
+        shutil.copy2(model_path, target_model)
+        if target_mapping is not None:
+            shutil.copy2(mapping_path, target_mapping)
+        self._write_meta(version_dir, {**metadata, 'version': version, 'format': fmt, 'saved_at': time.time(),
+                                       'imported_from': model_path})
+        self.publish(model_id, version)
+        return version
+
+    def _new_version(self, model_id):
+        """Claim the next version number with mkdir; returns (name, directory)."""
+        directory = self._directory(model_id)
+        os.makedirs(directory, exist_ok=True)
+        names = _version_names(directory)
+        number = _version_number(names[-1]) + 1 if names else 1
+        while True:
+            version = f'v{number:06d}'
+            try:
+                os.mkdir(os.path.join(directory, version))
+                return version, os.path.join(directory, version)
+            except FileExistsError:
+                number += 1
+
+    @staticmethod
+    def _write_meta(version_dir, meta):
+        with open(os.path.join(version_dir, META_FILE), 'w') as f:
+            json.dump(meta, f, default=str)
+
+    def publish(self, model_id, version):
+        """Make `version` the one served for `model_id` (also used to roll back), then prune old versions."""
+        directory = self._directory(model_id)
+        if _version_number(str(version)) is None or not os.path.isdir(os.path.join(directory, version)):
+            raise ValueError(f'Model {model_id!r} has no version {version!r}')
+        path = os.path.join(directory, CURRENT_FILE)
+        tmp_path = f'{path}.tmp.{os.getpid()}.{threading.get_ident()}'
+        with open(tmp_path, 'w') as f:
+            f.write(version)
+        os.replace(tmp_path, path)
+        log.info("✅ Published model", model_id=model_id, version=version)
+        self._prune(model_id, version)
+
+    def _prune(self, model_id, current):
+        directory = self._directory(model_id)
+        names = _version_names(directory)
+        # Processes still serving a removed version keep their open (or mapped) files
+        for name in names[:-self.keep_versions] if self.keep_versions > 0 else []:
+            if name != current:
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+    def model_ids(self):
+        """Ids with a published version."""
+        return sorted(name for name in os.listdir(self.root)
+                      if self.valid_id(name) and os.path.exists(os.path.join(self.root, name, CURRENT_FILE)))
+
+    def versions(self, model_id):
+        """meta.json of every stored version of `model_id`, oldest first, with the published one flagged."""
+        directory = self._directory(model_id)
+        if not os.path.isdir(directory):
+            return []
+        current = self.current_version(model_id)
+        versions = []
+        for name in _version_names(directory):
+            try:
+                with open(os.path.join(directory, name, META_FILE)) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                # Still being written by a training job
+                continue
+            versions.append({**meta, 'version': name, 'current': name == current})
+        return versions
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': len(self._loaded),
+                'bytes': self._bytes,
+                'max_models': self.max_models,
+                'max_bytes': self.max_bytes,
+                'loads': self.loads,
+                'evictions': self.evictions,
+            }
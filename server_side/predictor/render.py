@@ -0,0 +1,84 @@
+import json
+import os
+import zlib
+
+# Columns of a /api/predict result, in output order
+PREDICTION_COLUMNS = ['store_id', 'product_id', 'date', 'predicted_stock']
+# Groups scored and written per streamed chunk
+PREDICT_STREAM_CHUNK_GROUPS = int(os.environ.get('PREDICT_STREAM_CHUNK_GROUPS', 2000))
+PREDICT_GZIP_LEVEL = int(os.environ.get('PREDICT_GZIP_LEVEL', 6))
+# Quantiles /api/forecast returns when the request names none
+DEFAULT_QUANTILES = (0.1, 0.5, 0.9)
+
+
+def iter_csv(frames):
+    header = True
+    for frame in frames:
+        yield frame.to_csv(index=False, header=header).encode()
+        header = False
+    if header:
+        yield (','.join(PREDICTION_COLUMNS) + '\n').encode()
+
+
+def _json_lines(frame):
+    text = frame.to_json(orient='records', lines=True)
+    return text if text.endswith('\n') else text + '\n'
+
+
+def iter_ndjson(frames):
+    for frame in frames:
+        if len(frame):
+            yield _json_lines(frame).encode()
+
+
+def iter_json_array(frames):
+    """One JSON array of records, written frame by frame."""
+    separator = '['
+    for frame in frames:
+        if len(frame):
+            yield (separator + _json_lines(frame).rstrip('\n').replace('\n', ',')).encode()
+            separator = ','
+    yield b'[]' if separator == '[' else b']'
+
+
+# format -> (chunk writer, mimetype)
+STREAM_FORMATS = {
+    'csv': (iter_csv, 'text/csv'),
+    'json': (iter_json_array, 'application/json'),
+    'ndjson': (iter_ndjson, 'application/x-ndjson'),
+}
+
+
+def gzip_chunks(chunks, level=PREDICT_GZIP_LEVEL):
+    """Gzip a stream of byte chunks, flushing after each so clients see data as it is produced."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _plain(value):
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+def columnar_json(forecast, **fields):
+    """A forecast.DistributionForecast as one JSON object of columns.
+
+    Ids are one array per key, and the mean and each quantile one row per
+    group of `horizon` values, so ids and dates are written once instead of
+    on every (group, date, statistic) record.
+    """
+    payload = {
+        **fields,
+        'horizon': len(forecast.dates),
+        'dates': list(forecast.dates.strftime('%Y-%m-%d')),
+        'quantiles': list(forecast.quantiles),
+        'store_id': forecast.store_ids.tolist(),
+        'product_id': forecast.product_ids.tolist(),
+        'mean': forecast.mean.tolist(),
+        'quantile_values': forecast.quantile_values.tolist(),
+        'unseen_groups': forecast.unseen_groups,
+    }
+    return json.dumps(payload, separators=(',', ':'), default=_plain).encode()
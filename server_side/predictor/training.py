@@ -0,0 +1,233 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_squared_error
+from sklearn.model_selection import train_test_split
+
+from artifact import FlatForest
+from dataset import KEY_COLUMNS, TrainingDataset
+from encoding import IdEncoder
+from features import BASIC_FEATURES, FEATURE_HISTORY_DAYS, FEATURE_SET, FEATURE_SETS, model_features, training_features
+from ingest import read_training_frame
+from instrumentation import get_logger
+from jobs import JobStore
+from registry import ModelStore
+
+log = get_logger('predictor.training')
+
+N_ESTIMATORS = 100
+# Trees are grown in batches of this size so a job can report progress. With
+# warm_start sklearn draws per-tree seeds in the same sequence as a single fit,
+# so the resulting forest is identical.
+TREES_PER_STEP = 10
+TRAIN_N_JOBS = int(os.environ.get('TRAIN_N_JOBS', -1))
+
+# Bounds on tree size. Unset, trees are grown fully (hundreds of MB for 100 trees
+# on a large history); a depth limit, bigger leaves or cost-complexity pruning
+# give a much smaller artifact that loads and scores faster.
+TREE_MAX_DEPTH = int(os.environ['TREE_MAX_DEPTH']) if os.environ.get('TREE_MAX_DEPTH') else None
+TREE_MIN_SAMPLES_LEAF = int(os.environ.get('TREE_MIN_SAMPLES_LEAF', 1))
+TREE_CCP_ALPHA = float(os.environ.get('TREE_CCP_ALPHA', 0.0))
+TREE_SIZE_PARAMS = {'max_depth': TREE_MAX_DEPTH, 'min_samples_leaf': TREE_MIN_SAMPLES_LEAF, 'ccp_alpha': TREE_CCP_ALPHA}
+
+# Incremental updates add this many trees, fitted on the last INCREMENTAL_WINDOW_DAYS
+# of history; past INCREMENTAL_MAX_TREES the oldest trees are dropped
+INCREMENTAL_TREES = int(os.environ.get('INCREMENTAL_TREES', 10))
+INCREMENTAL_WINDOW_DAYS = int(os.environ.get('INCREMENTAL_WINDOW_DAYS', 28))
+INCREMENTAL_MAX_TREES = int(os.environ.get('INCREMENTAL_MAX_TREES', 300))
+
+TRAINING_MODES = ('full', 'incremental')
+
+
+def _feature_frame(df, feature_names):
+    """Training rows with the columns `feature_names` needs (ids still raw) plus stock."""
+    if feature_names == BASIC_FEATURES:
+        return df
+    return training_features(df)
+
+
+def train_model(df, n_jobs=TRAIN_N_JOBS, progress=None, feature_set=FEATURE_SET, tree_params=None):
+    """Fit the stock forest on a frame from ingest.read_training_frame.
+
+    Returns (model, mappings, mse). `progress`, if given, is called with the
+    fraction of trees grown so far. `feature_set` names an entry of
+    features.FEATURE_SETS; the fitted model remembers its feature names.
+    `tree_params` overrides TREE_SIZE_PARAMS.
+    """
+    feature_names = FEATURE_SETS[feature_set]
+    features = _feature_frame(df, feature_names)
+    if len(features) < 2:
+        # Every group has a single day, so there is no history to build rolling features from
+        log.warning("⚠️  Not enough history per group for rolling features, using the basic feature set")
+        feature_names, features = BASIC_FEATURES, df
+    df = features
+
+    # Save mapping of encoded to original values; predict re-uses these codes
+    store_encoder = IdEncoder.fit(df['store_id'])
+    product_encoder = IdEncoder.fit(df['product_id'])
+    mappings = {'store': store_encoder.to_mapping(), 'product': product_encoder.to_mapping()}
+
+    df['store_id'] = store_encoder.encode(df['store_id'])
+    df['product_id'] = product_encoder.encode(df['product_id'])
+
+    X = df[feature_names]
+    y = df['stock']
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    model = RandomForestRegressor(n_estimators=TREES_PER_STEP, random_state=42, n_jobs=n_jobs, warm_start=True,
+                                  **(TREE_SIZE_PARAMS if tree_params is None else tree_params))
+    for n_trees in range(TREES_PER_STEP, N_ESTIMATORS + 1, TREES_PER_STEP):
+        model.set_params(n_estimators=n_trees)
+        model.fit(X_train, y_train)
+        if progress is not None:
+            progress(n_trees / N_ESTIMATORS)
+    model.set_params(warm_start=False)
+
+    y_pred = model.predict(X_test)
+    mse = mean_squared_error(y_test, y_pred)
+    return model, mappings, mse
+
+
+def _fresh_seed():
+    return int(np.random.RandomState().randint(np.iinfo(np.int32).max))
+
+
+def update_model(model, mappings, df, n_jobs=TRAIN_N_JOBS, n_trees=INCREMENTAL_TREES,
+                 max_trees=INCREMENTAL_MAX_TREES, progress=None, fit_from=None, new_rows=None):
+    """Grow `n_trees` more trees on `df` (recent history including the new rows).
+
+    Uses warm_start, so the existing trees are kept as they are (a FlatForest
+    gets the new trees appended). Ids not seen
+    before get codes after the existing ones. Features are built with the model's
+    own feature set; rows dated before the `fit_from` ordinal only provide history
+    for them. Returns (model, mappings, mse) like train_model.
+
+    The existing trees were fitted on the older rows, so the mse is measured on
+    a hold-out split of the rows no tree has seen: those whose (store, product,
+    date) key is in `new_rows` (every fitted row if None). The held-out rows
+    are not fitted by the new trees either. With no such row the mse is None.
+    """
+    feature_names = model_features(model)
+    df = _feature_frame(df, feature_names)
+    if fit_from is not None:
+        df = df[df['date_ordinal'] >= fit_from].reset_index(drop=True)
+    unseen = np.ones(len(df), dtype=bool)
+    if new_rows is not None:
+        unseen = pd.MultiIndex.from_frame(df[KEY_COLUMNS].astype(object)).isin(
+            pd.MultiIndex.from_frame(new_rows[KEY_COLUMNS].astype(object)))
+    unseen = np.flatnonzero(unseen)
+    held_out = np.zeros(len(df), dtype=bool)
+    held_out[np.random.RandomState(42).permutation(unseen)[:max(1, round(0.2 * len(unseen)))]] = True
+    store_encoder = IdEncoder.from_mapping(mappings['store']).extend(df['store_id'])
+    product_encoder = IdEncoder.from_mapping(mappings['product']).extend(df['product_id'])
+    mappings = {'store': store_encoder.to_mapping(), 'product': product_encoder.to_mapping()}
+
+    df['store_id'] = store_encoder.encode(df['store_id'])
+    df['product_id'] = product_encoder.encode(df['product_id'])
+
+    X, y = df[feature_names], df['stock']
+    X_train, X_test, y_train, y_test = X[~held_out], X[held_out], y[~held_out], y[held_out]
+    if isinstance(model, FlatForest):
+        # A flat forest cannot grow trees itself: fit the new ones alone with the same size limits, then append.
+        # Once trees have been dropped, seeding by tree count would repeat the last update's seeds
+        seed = model.n_estimators if model.n_estimators < max_trees else _fresh_seed()
+        grower, start = RandomForestRegressor(random_state=seed, **model.params), 0
+    else:
+        grower, start = model, len(model.estimators_)
+    grower.set_params(warm_start=True, n_jobs=n_jobs)
+    for grown in [*range(TREES_PER_STEP, n_trees, TREES_PER_STEP), n_trees]:
+        grower.set_params(n_estimators=start + grown)
+        grower.fit(X_train, y_train)
+        if progress is not None:
+            progress(grown / n_trees)
+    grower.set_params(warm_start=False)
+    if isinstance(model, FlatForest):
+        model = model.append(FlatForest.from_model(grower), max_trees)
+    elif len(model.estimators_) > max_trees:
+        # Forget the oldest trees so the forest follows recent history and stays bounded
+        model.estimators_ = model.estimators_[-max_trees:]
+        # warm_start skips as many seeds as there are trees, so the next update would redraw the seeds
+        # of trees that are still kept; continue from a new sequence instead
+        model.set_params(n_estimators=max_trees, random_state=_fresh_seed())
+
+    mse = mean_squared_error(y_test, model.predict(X_test)) if len(X_test) else None
+    return model, mappings, mse
+
+
+def run_training_job(job_id, upload_path, jobs_dir, models_dir, model_id, model_format, dataset_dir,
+                     mode='full', n_jobs=TRAIN_N_JOBS, data_hash=None):
+    """Process-pool entry point: parse the spooled upload, fit, publish, record status.
+
+    `full` replaces the stored training history of `model_id` with the upload and
+    refits from scratch. `incremental` appends the upload's new (store, product,
+    date) rows to the history and adds trees to the current model; it falls back
+    to `full` when there is no model or stored history yet. The model is
+    published as a new version in the ModelStore at `models_dir`; `data_hash`
+    (the upload's sha256) is recorded in its metadata.
+    """
+    store = JobStore(jobs_dir)
+    store.update(job_id, status='running', stage='parsing', progress=0.05, started_at=time.time(), model_id=model_id)
+    # One history per model, whose lock also serializes the model's jobs
+    dataset = TrainingDataset(os.path.join(dataset_dir, model_id))
+    try:
+        df = read_training_frame(upload_path)
+        with dataset.lock():
+            models = ModelStore(models_dir, model_format, mmap_mode=None, max_models=1)
+            current = models.get(model_id) if mode == 'incremental' else None
+            if mode == 'incremental' and (current is None or not dataset.rows):
+                log.warning("⚠️  No model or stored history yet, doing a full retrain", job_id=job_id)
+                mode = 'full'
+            store.update(job_id, mode=mode)
+
+            def progress(done):
+                store.update(job_id, progress=round(0.1 + 0.8 * done, 3))
+
+            if mode == 'full':
+                history = dataset.replace(df)
+                store.update(job_id, stage='fitting', progress=0.1, rows=len(df), history_rows=len(history))
+                started = time.perf_counter()
+                model, mappings, mse = train_model(history, n_jobs, progress=progress)
+                fit_seconds = time.perf_counter() - started
+                dataset.set_meta(full_fit={'seconds': fit_seconds, 'rows': len(history)})
+                timing = {'fit_seconds': round(fit_seconds, 3)}
+            else:
+                added = dataset.append(df)
+                store.update(job_id, rows=len(df), new_rows=len(added), history_rows=dataset.rows)
+                if added.empty:
+                    store.update(job_id, status='succeeded', stage='done', progress=1.0,
+                                 message='No new rows, model unchanged', finished_at=time.time())
+                    log.info("✅ Training job has no new rows", job_id=job_id)
+                    return
+                window_start = min(dataset.last_date - INCREMENTAL_WINDOW_DAYS + 1, int(added['date_ordinal'].min()))
+                # Rolling features of the first fitted day need FEATURE_HISTORY_DAYS before it
+                recent = dataset.read(min_date=window_start - FEATURE_HISTORY_DAYS)
+                store.update(job_id, stage='fitting', progress=0.1, fit_rows=len(recent))
+                started = time.perf_counter()
+                model, mappings, mse = update_model(current.model, current.mappings, recent, n_jobs,
+                                                    progress=progress, fit_from=window_start, new_rows=added)
+                fit_seconds = time.perf_counter() - started
+                timing = {'fit_seconds': round(fit_seconds, 3), 'trees': model.n_estimators}
+                full_fit = dataset.manifest().get('full_fit')
+                if full_fit and full_fit['rows']:
+                    # Last measured full retrain, scaled to the current history size
+                    full_seconds = full_fit['seconds'] * dataset.rows / full_fit['rows']
+                    timing.update(full_retrain_seconds_estimate=round(full_seconds, 3),
+                                  speedup=round(full_seconds / fit_seconds, 1))
+
+            store.update(job_id, stage='saving', progress=0.95)
+            version = models.save(model_id, model, mappings, mse=mse, data_sha256=data_hash, mode=mode,
+                                  trained_rows=dataset.rows)
+    except Exception as e:
+        log.error("❌ Training job failed", exc_info=True, job_id=job_id, error=str(e))
+        store.update(job_id, status='failed', stage='failed', error=str(e), finished_at=time.time())
+        return
+    finally:
+        os.remove(upload_path)
+
+    store.update(job_id, status='succeeded', stage='done', progress=1.0, mse=mse,
+                 artifact_version=version, finished_at=time.time(), **timing)
+    log.info("✅ Training job finished", job_id=job_id, model_id=model_id, version=version, mode=mode,
+             mse=None if mse is None else round(mse, 3), fit_seconds=round(fit_seconds, 2))
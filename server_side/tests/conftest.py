@@ -0,0 +1,43 @@
+import io
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The services are flat script directories; make their modules importable the way they import each
+# other, and instrumentation.py the way their entry points (app.py, delivery_call.py) do
+_SERVER_SIDE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for _directory in ('predictor', 'delivery_helper'):
+    _path = os.path.join(_SERVER_SIDE, _directory)
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
+if _SERVER_SIDE not in sys.path:
+    sys.path.append(_SERVER_SIDE)
+
+
+def sales_frame(stores=3, products=4, days=40, start='2024-01-01', seed=0):
+    """Daily sales/stock rows for every (store, product), with weekly seasonality."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, periods=days)
+    n_groups = stores * products
+    level = rng.uniform(5, 40, (n_groups, 1))
+    weekly = np.array([0.8, 0.9, 1.0, 1.0, 1.2, 1.5, 1.3])[dates.dayofweek.to_numpy()]
+    sales = rng.poisson(level * weekly)
+    return pd.DataFrame({
+        'store_id': np.repeat([f'S{s}' for s in range(stores)], products * days),
+        'product_id': np.tile(np.repeat([f'P{p}' for p in range(products)], days), stores),
+        'date': np.tile(dates.strftime('%Y-%m-%d'), n_groups),
+        'sales': sales.ravel(),
+        'stock': (2 * sales + rng.integers(0, 10, sales.shape)).ravel(),
+    })
+
+
+def csv_upload(frame):
+    return io.BytesIO(frame.to_csv(index=False).encode())
+
+
+@pytest.fixture
+def sales():
+    return sales_frame()
@@ -0,0 +1,96 @@
+import gzip
+import importlib
+import json
+import os
+import time
+
+import pytest
+
+from conftest import csv_upload, sales_frame
+
+
+@pytest.fixture(scope='module')
+def predictor(tmp_path_factory):
+    """The predictor app with its models, jobs and caches in a temporary directory."""
+    workdir = tmp_path_factory.mktemp('predictor')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        module = importlib.import_module('app')
+        yield module
+        module.train_queue.shutdown()
+    finally:
+        os.chdir(cwd)
+
+
+def train(client, frame, **params):
+    return client.post('/api/train', query_string=params, data={'file': (csv_upload(frame), 'sales.csv')})
+
+
+def wait_for(client, job_id, timeout=120):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f'/api/train/{job_id}').get_json()
+        if job['status'] in ('succeeded', 'failed') or time.monotonic() > deadline:
+            return job
+        time.sleep(0.2)
+
+
+def test_train_returns_a_job_to_poll(predictor):
+    client = predictor.app.test_client()
+    frame = sales_frame(stores=2, products=2, days=30)
+    response = train(client, frame, model_id='tenant-a')
+    assert response.status_code == 202
+    job = response.get_json()
+    assert job['status'] == 'queued' and job['status_url'] == f"/api/train/{job['job_id']}"
+
+    # The same upload while the first is still queued or running joins it
+    again = train(client, frame, model_id='tenant-a').get_json()
+    assert again['job_id'] == job['job_id'] and again['message'].startswith('Identical')
+
+    done = wait_for(client, job['job_id'])
+    assert done['status'] == 'succeeded' and done['progress'] == 1.0 and done['model_id'] == 'tenant-a'
+    assert predictor.model_store.current_version('tenant-a') is not None
+    # Once it finished, the same upload trains again
+    assert train(client, frame, model_id='tenant-a').get_json()['job_id'] != job['job_id']
+
+
+def test_train_rejects_bad_input_before_queueing(predictor):
+    client = predictor.app.test_client()
+    frame = sales_frame(stores=1, products=1, days=10)
+    assert train(client, frame.drop(columns='sales')).status_code == 400
+    assert train(client, frame, mode='sideways').status_code == 400
+    assert client.get('/api/train/not-a-job').status_code == 404
+
+
+@pytest.mark.parametrize('model_id', ['tenant-a', 'no-model-yet'])
+def test_streamed_predict_matches_the_buffered_one(predictor, model_id):
+    client = predictor.app.test_client()
+    frame = sales_frame(stores=2, products=2, days=30)
+    if model_id == 'tenant-a' and predictor.model_store.current_version(model_id) is None:
+        wait_for(client, train(client, frame, model_id=model_id).get_json()['job_id'])
+
+    def predict(query, **headers):
+        return client.post(f'/api/predict?model_id={model_id}&{query}', headers=headers,
+                           data={'file': (csv_upload(frame), 'sales.csv')})
+
+    buffered = predict('').get_json()
+    streamed = predict('stream=1', **{'Accept-Encoding': 'gzip'})
+    assert streamed.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(streamed.data)) == buffered
+    ndjson = predict('format=ndjson').get_data(as_text=True)
+    assert [json.loads(line) for line in ndjson.splitlines()] == buffered
+
+
+def test_metrics_report_requests_stages_and_models(predictor):
+    client = predictor.app.test_client()
+    response = client.post('/api/predict?model_id=tenant-a',
+                           data={'file': (csv_upload(sales_frame(stores=2, products=2, days=30)), 'sales.csv')})
+    response.get_data()
+    response.close()
+
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'predelix_http_requests_total{endpoint="/api/predict",method="POST",service="predictor",status="200"}' \
+        in body
+    assert 'predelix_stage_seconds_count{stage="parse"}' in body
+    assert '# TYPE predelix_models_loaded gauge' in body
@@ -0,0 +1,66 @@
+import pickle
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+
+import artifact
+from artifact import FlatForest, load_flat_model, save_flat_model
+
+
+@pytest.fixture(scope='module')
+def fitted():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(400, 5))
+    X[rng.random(X.shape) < 0.05] = np.nan
+    y = np.nan_to_num(X[:, 0]) * 3 + np.nan_to_num(X[:, 1]) ** 2 + rng.normal(size=len(X))
+    model = RandomForestRegressor(n_estimators=12, max_depth=8, random_state=0, n_jobs=1).fit(X, y)
+    X_new = rng.normal(size=(300, 5))
+    X_new[rng.random(X_new.shape) < 0.05] = np.nan
+    return model, X_new
+
+
+def test_flat_forest_predicts_exactly_like_sklearn(fitted, monkeypatch):
+    model, X = fitted
+    forest = FlatForest.from_model(model)
+    # Including rows with missing values, which follow each split's learned direction
+    np.testing.assert_array_equal(forest.predict(X), model.predict(X))
+    np.testing.assert_array_equal(forest.predict_trees(X),
+                                  np.column_stack([tree.predict(X) for tree in model.estimators_]))
+    # Scoring in small blocks of (row, tree) pairs gives the same result
+    monkeypatch.setattr(artifact, 'FOREST_BLOCK_PAIRS', 50)
+    np.testing.assert_array_equal(forest.predict(X), model.predict(X))
+
+
+def test_saved_forest_maps_and_pickles_as_its_path(fitted, tmp_path):
+    model, X = fitted
+    path = str(tmp_path / f'model{artifact.FLAT_SUFFIX}')
+    save_flat_model(path, model, {'store': {0: 'S1', 1: 'S2'}}, mse=1.5)
+    forest, mappings = load_flat_model(path)
+    assert isinstance(forest.value, np.ndarray) and not forest.value.flags.writeable
+    assert mappings == {'store': {0: 'S1', 1: 'S2'}} and forest.metadata['mse'] == 1.5
+    np.testing.assert_array_equal(forest.predict(X), model.predict(X))
+
+    payload = pickle.dumps(forest)
+    assert path.encode() in payload and len(payload) < 1024
+    np.testing.assert_array_equal(pickle.loads(payload).predict(X), model.predict(X))
+    # An unsaved forest pickles its arrays
+    assert len(pickle.dumps(FlatForest.from_model(model))) > forest.nbytes
+
+
+def test_append_keeps_the_newest_trees(fitted):
+    model, X = fitted
+    older = FlatForest.from_model(model)
+    newer = FlatForest.from_model(RandomForestRegressor(n_estimators=4, random_state=1, n_jobs=1).fit(
+        np.nan_to_num(X), np.nan_to_num(X[:, 2])))
+    combined = older.append(newer)
+    assert combined.n_estimators == 16
+    np.testing.assert_array_equal(combined.predict_trees(X)[:, 12:], newer.predict_trees(X))
+
+    newest = older.append(newer, max_trees=6)
+    np.testing.assert_array_equal(newest.predict_trees(X), combined.predict_trees(X)[:, -6:])
+
+
+def test_wrong_width_is_rejected(fitted):
+    with pytest.raises(ValueError, match='expected'):
+        FlatForest.from_model(fitted[0]).predict(np.zeros((2, 4)))
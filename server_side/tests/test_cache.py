@@ -0,0 +1,67 @@
+import io
+
+from cache import CachedResult, ResultCache, stream_sha256
+
+
+def entry(body=b'[]'):
+    return CachedResult(body, 'application/json', {})
+
+
+def test_upload_hash_rewinds_the_stream():
+    stream = io.BytesIO(b'store_id,product_id\n1,2\n')
+    assert stream_sha256(stream) == stream_sha256(io.BytesIO(b'store_id,product_id\n1,2\n'))
+    assert stream.read() == b'store_id,product_id\n1,2\n'
+    assert stream_sha256(io.BytesIO(b'other')) != stream_sha256(io.BytesIO(b'store_id,product_id\n1,2\n'))
+
+
+def test_hit_for_same_version_and_key():
+    cache = ResultCache(1 << 20)
+    assert cache.get('v1', 'upload.json') is None
+    cache.put('v1', 'upload.json', entry(b'[1]'))
+    assert cache.get('v1', 'upload.json').body == b'[1]'
+    assert cache.get('v1', 'upload.csv') is None
+    assert cache.stats()['hits'] == 1
+
+
+def test_new_model_version_misses_and_drops_old_entries():
+    cache = ResultCache(1 << 20)
+    cache.get('v1', 'upload.json')
+    cache.put('v1', 'upload.json', entry())
+    assert cache.get('v2', 'upload.json') is None
+    assert cache.stats()['entries'] == 0
+    # A request still rendering under the old version does not repopulate it
+    cache.put('v1', 'upload.json', entry())
+    assert cache.get('v1', 'upload.json') is None
+
+
+def test_versions_are_per_namespace():
+    cache = ResultCache(1 << 20)
+    for namespace in ('a', 'b'):
+        cache.get('v1', 'k', namespace=namespace)
+        cache.put('v1', 'k', entry(namespace.encode()), namespace=namespace)
+    assert cache.get('v2', 'k', namespace='a') is None
+    assert cache.get('v1', 'k', namespace='b').body == b'b'
+
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = ResultCache(10)
+    cache.get('v1', 'a')
+    cache.put('v1', 'a', entry(b'aaaa'))
+    cache.put('v1', 'b', entry(b'bbbb'))
+    cache.get('v1', 'a')
+    cache.put('v1', 'c', entry(b'cccc'))
+    assert cache.get('v1', 'b') is None
+    assert cache.get('v1', 'a') is not None and cache.get('v1', 'c') is not None
+    cache.put('v1', 'big', entry(b'x' * 11))
+    assert cache.get('v1', 'big') is None
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    cache = ResultCache(1 << 20, str(tmp_path), 1 << 20)
+    cache.get('v1', 'k', namespace='m')
+    cache.put('v1', 'k', entry(b'disk'), namespace='m')
+    restarted = ResultCache(1 << 20, str(tmp_path), 1 << 20)
+    assert restarted.get('v1', 'k', namespace='m').body == b'disk'
+    assert restarted.stats()['disk_hits'] == 1
+    assert restarted.get('v2', 'k', namespace='m') is None
+    assert not (tmp_path / 'm' / 'v1').exists()
@@ -0,0 +1,118 @@
+import pandas as pd
+import pytest
+
+from call_store import CallStore
+from retry_missed_calls import RetryScheduler, normalize_e164
+
+
+class ScriptedDialer:
+    """Dialer double: numbers in `failing` fail, every other call is placed."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.dialed = []
+
+    def dial(self, customers, webhook_base_url):
+        for customer in customers:
+            self.dialed.append(customer['row_id'])
+            failed = customer['mobile_number'] in self.failing
+            yield {'row': customer['row_id'], 'number': customer['mobile_number'], 'name': customer.get('name'),
+                   'status': 'failed' if failed else 'initiated', 'error': 'busy' if failed else None,
+                   'sid': None if failed else f"CA{customer['row_id']}"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = CallStore(str(tmp_path / 'calls.sqlite3'))
+    store.import_frame(pd.DataFrame({
+        'name': ['Asha', 'Ravi', 'Meera'],
+        'mobile_number': ['+918817577592', '08817577593', '918817577594.0'],
+        'address': ['A', 'B', 'C'],
+    }))
+    return store
+
+
+def test_import_keeps_upload_order_and_extra_columns(store):
+    assert store.count() == 3
+    assert [row_id for row_id, _ in store.numbers()] == [0, 1, 2]
+    assert store.get(1)['address'] == 'B'
+    assert list(store.to_frame().columns[:3]) == ['name', 'mobile_number', 'address']
+
+
+def test_update_touches_one_row_and_pending_follows_responses(store):
+    assert store.update(1, response='https://api.twilio.com/rec/1')
+    assert not store.update(99, response='x')
+    assert [customer['row_id'] for customer in store.pending()] == [0, 2]
+    assert store.get(0)['response'] is None
+
+
+def test_reimport_clears_results_and_retries(store):
+    store.update(0, response='x')
+    store.set_retry(0, 1, 0.0)
+    store.import_frame(store.to_frame().drop(columns=['response']))
+    assert store.retries() == [] and len(store.pending()) == 3
+
+
+@pytest.mark.parametrize('number, expected', [
+    ('+91 88175-77592', '+918817577592'),
+    ('918817577592.0', '+918817577592'),
+    ('008817577592', '+8817577592'),
+    ('08817577592', '+918817577592'),
+    ('8817577592', '+918817577592'),
+    ('abc', None),
+])
+def test_normalize_e164(number, expected):
+    assert normalize_e164(number) == expected
+
+
+def test_missed_numbers_match_customers_in_any_format(store):
+    scheduler = RetryScheduler(store, ScriptedDialer())
+    queued, unmatched = scheduler.schedule_missed([{'mobile_number': '8817577593'},
+                                                   {'mobile_number': '+91 88175 77594'},
+                                                   {'mobile_number': '1234567890'}])
+    assert queued == 2 and unmatched == ['1234567890']
+    # Already queued customers are not queued twice
+    assert scheduler.schedule_missed([{'mobile_number': '8817577593'}]) == (0, [])
+    assert [entry['row_id'] for entry in store.retries()] == [1, 2]
+
+
+def test_failed_retries_back_off_until_attempts_run_out(store):
+    dialer = ScriptedDialer(failing={'+918817577593'})
+    scheduler = RetryScheduler(store, dialer, max_attempts=2, base_delay=10, max_delay=10)
+    scheduler.schedule_missed([{'mobile_number': '08817577593'}], now=0)
+
+    assert [result['retry'] for result in scheduler.run_once('https://hooks', now=0)] == [1]
+    entry = store.get_retry(1)
+    assert entry['attempts'] == 1 and entry['last_error'] == 'busy'
+    # Not due again until the backoff has passed
+    assert list(scheduler.run_once('https://hooks', now=entry['next_attempt_at'] - 1)) == []
+    list(scheduler.run_once('https://hooks', now=entry['next_attempt_at']))
+    assert store.get_retry(1)['attempts'] == 2
+    assert list(scheduler.run_once('https://hooks', now=1e12)) == []
+    status = scheduler.status()
+    assert status['queued'] == 0 and status['exhausted'] == 1
+    assert dialer.dialed == [1, 1]
+
+
+def test_successful_retry_leaves_the_queue(store):
+    scheduler = RetryScheduler(store, ScriptedDialer())
+    scheduler.record_failure(2, 'busy', now=0)
+    results = list(scheduler.run_once('https://hooks', now=1e12))
+    assert [result['status'] for result in results] == ['initiated']
+    assert store.retries() == []
+
+
+def test_retry_round_needs_a_webhook_url(store):
+    with pytest.raises(ValueError):
+        list(RetryScheduler(store, ScriptedDialer()).run_once())
+
+
+def test_campaign_success_clears_an_earlier_failure(store):
+    scheduler = RetryScheduler(store, ScriptedDialer(), base_delay=10, max_delay=10)
+    # First campaign: the call to row 0 fails and is queued for a retry
+    scheduler.record_failure(0, 'busy', now=0)
+    assert [customer['row_id'] for customer in scheduler.due(now=1e12)] == [0]
+    # Next campaign reaches them, as trigger_calls reports each placed call
+    scheduler.record_success(0)
+    assert scheduler.due(now=1e12) == []
+    assert list(scheduler.run_once('https://hooks', now=1e12)) == []
@@ -0,0 +1,55 @@
+import pandas as pd
+
+from conftest import csv_upload, sales_frame
+from dataset import TrainingDataset
+from ingest import read_training_frame
+
+
+def history(days, start='2024-01-01', **kwargs):
+    return read_training_frame(csv_upload(sales_frame(stores=2, products=2, days=days, start=start, **kwargs)))
+
+
+def test_append_keeps_only_new_keys(tmp_path):
+    dataset = TrainingDataset(str(tmp_path), fmt='pickle')
+    first = history(10)
+    assert len(dataset.append(first)) == len(first)
+    # Overlapping upload: days 6-15, of which 6-10 are already stored
+    added = dataset.append(history(10, start='2024-01-06', seed=1))
+    assert len(added) == 4 * 5
+    assert added['date_ordinal'].min() == first['date_ordinal'].max() + 1
+    assert dataset.rows == 4 * 15
+    stored = dataset.read()
+    assert not stored.duplicated(['store_id', 'product_id', 'date_ordinal']).any()
+    assert dataset.append(history(3, start='2024-01-02')).empty
+    assert dataset.rows == 4 * 15
+
+
+def test_stored_rows_keep_their_first_values(tmp_path):
+    dataset = TrainingDataset(str(tmp_path), fmt='pickle')
+    dataset.append(history(5))
+    dataset.append(history(5, seed=1))
+    pd.testing.assert_frame_equal(dataset.read().sort_values(['store_id', 'product_id', 'date_ordinal'])
+                                  .reset_index(drop=True), history(5).reset_index(drop=True), check_dtype=False,
+                                  check_categorical=False)
+
+
+def test_read_from_date_and_compaction(tmp_path):
+    dataset = TrainingDataset(str(tmp_path), fmt='pickle')
+    for day in range(1, 6):
+        dataset.append(history(2, start=f'2024-01-{2 * day - 1:02d}'))
+    assert len(dataset.manifest()['segments']) == 5
+    cutoff = dataset.last_date - 1
+    assert (dataset.read(min_date=cutoff)['date_ordinal'] >= cutoff).all()
+    assert len(dataset.read(min_date=cutoff)) == 4 * 2
+    dataset.compact()
+    assert len(dataset.manifest()['segments']) == 1
+    assert dataset.rows == len(dataset.read()) == 4 * 10
+
+
+def test_replace_drops_duplicate_keys(tmp_path):
+    dataset = TrainingDataset(str(tmp_path), fmt='pickle')
+    dataset.append(history(5))
+    frame = history(3)
+    replaced = dataset.replace(pd.concat([frame, frame.assign(stock=0)], ignore_index=True))
+    assert len(replaced) == dataset.rows == 4 * 3
+    assert (replaced['stock'] == 0).all()
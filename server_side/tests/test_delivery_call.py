@@ -0,0 +1,82 @@
+import importlib
+import io
+import json
+import os
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def delivery(tmp_path_factory):
+    """delivery_call against the fake Twilio client, with its files in a temporary directory."""
+    workdir = tmp_path_factory.mktemp('delivery')
+    env = {'CALLS_DB': str(workdir / 'calls.sqlite3'), 'INPUT_CSV': str(workdir / 'input.csv'),
+           'USE_FAKE_TWILIO': '1', 'FAKE_TWILIO_LATENCY': '0', 'TRANSCRIBE_BACKEND': 'stub',
+           'DIAL_RATE_PER_SEC': '1000', 'DIAL_MAX_ATTEMPTS': '1', 'RECORDINGS_DIR': str(workdir)}
+    saved = {key: os.environ.get(key) for key in env}
+    cwd = os.getcwd()
+    os.environ.update(env)
+    os.chdir(workdir)
+    try:
+        yield importlib.import_module('delivery_call')
+    finally:
+        os.chdir(cwd)
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def trigger(client):
+    response = client.post('/api/trigger_calls', json={'webhook_base_url': 'https://hooks.example'})
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_answered_campaign_clears_an_earlier_retry(delivery):
+    client = delivery.app.test_client()
+    csv = b'name,mobile_number\nAsha,+918817577592\n'
+    assert client.post('/api/upload_customers', data={'file': (io.BytesIO(csv), 'c.csv')}).status_code == 200
+
+    delivery.client.error_rate = 1.0
+    assert trigger(client)[-1]['failed_calls'] == 1
+    assert [customer['row_id'] for customer in delivery.retry_scheduler.due(now=1e12)] == [0]
+
+    delivery.client.error_rate = 0.0
+    assert trigger(client)[-1]['successful_calls'] == 1
+    assert delivery.retry_scheduler.due(now=1e12) == []
+
+
+def test_campaign_dials_everyone_after_the_client_disconnects(delivery):
+    client = delivery.app.test_client()
+    csv = 'name,mobile_number\n' + ''.join(f'Customer {i},+9188175{i:05d}\n' for i in range(40))
+    assert client.post('/api/upload_customers', data={'file': (io.BytesIO(csv.encode()), 'c.csv')}).status_code == 200
+    delivery.client.error_rate = 0.0
+    delivery.client.latency = 0.01
+    placed = len(delivery.client.placed)
+
+    response = client.post('/api/trigger_calls', json={'webhook_base_url': 'https://hooks.example'}, buffered=False)
+    first = json.loads(next(iter(response.response)))
+    response.close()
+    assert first['status'] == 'initiated'
+
+    campaign = delivery._campaign
+    assert campaign.join(timeout=30)
+    assert len(campaign.results) == campaign.total == 40
+    assert len(delivery.client.placed) - placed == 40
+    delivery.client.latency = 0.0
+
+
+def test_second_request_follows_the_running_campaign(delivery):
+    client = delivery.app.test_client()
+    delivery.client.latency = 0.05
+    try:
+        first = client.post('/api/trigger_calls', json={'webhook_base_url': 'https://hooks.example'}, buffered=False)
+        campaign = delivery._campaign
+        lines = trigger(client)
+        first.close()
+        assert delivery._campaign is campaign
+        assert lines[-1]['total_calls'] == campaign.total
+        assert len(lines) == campaign.total + 1
+    finally:
+        delivery.client.latency = 0.0
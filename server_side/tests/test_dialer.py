@@ -0,0 +1,80 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from twilio.base.exceptions import TwilioRestException
+
+from dialer import Campaign, Dialer, TokenBucket, is_retryable
+from fake_twilio import FakeTwilioClient
+
+
+class ScriptedClient:
+    """calls.create raises the next scripted HTTP status per number (None places the call)."""
+
+    def __init__(self, script):
+        self.script = {number: list(statuses) for number, statuses in script.items()}
+        self.attempts = []
+        self.calls = self
+
+    def create(self, to, from_, url):
+        self.attempts.append(to)
+        statuses = self.script.get(to)
+        status = statuses.pop(0) if statuses else None
+        if status is not None:
+            raise TwilioRestException(status, '/Calls.json', f'HTTP {status}')
+        return SimpleNamespace(sid=f'CA{len(self.attempts)}')
+
+
+def customers(*numbers):
+    return [{'row_id': i, 'mobile_number': number, 'name': f'Customer {i}'} for i, number in enumerate(numbers)]
+
+
+def test_token_bucket_holds_the_rate_after_the_burst():
+    bucket = TokenBucket(rate=50, capacity=5)
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - start < 0.05
+    for _ in range(10):
+        bucket.acquire()
+    # Ten more tokens at 50/s take about 0.2s
+    assert 0.18 <= time.monotonic() - start < 1.0
+
+
+@pytest.mark.parametrize('status, retryable', [(429, True), (500, True), (503, True), (400, False),
+                                               (404, False), (None, True)])
+def test_only_throttling_server_and_network_errors_are_retried(status, retryable):
+    error = ConnectionError('reset') if status is None else TwilioRestException(status, '/Calls.json')
+    assert is_retryable(error) is retryable
+
+
+def test_dialer_retries_retryable_errors_only():
+    client = ScriptedClient({'+1': [429, 503], '+2': [400], '+3': [500, 500, 500]})
+    dialer = Dialer(client, '+10', rate=1000, max_attempts=3, backoff=0)
+    results = {result['number']: result for result in dialer.dial(customers('+1', '+2', '+3', '+4'), 'https://x')}
+
+    assert results['+1']['status'] == 'initiated' and results['+1']['attempts'] == 3
+    assert results['+2']['status'] == 'failed' and results['+2']['attempts'] == 1
+    assert results['+3']['status'] == 'failed' and results['+3']['attempts'] == 3
+    assert results['+4']['status'] == 'initiated' and results['+4']['attempts'] == 1
+    assert sorted(client.attempts) == ['+1'] * 3 + ['+2'] + ['+3'] * 3 + ['+4']
+
+
+def test_dialer_keeps_to_the_rate_limit():
+    client = FakeTwilioClient(latency=0, jitter=0)
+    dialer = Dialer(client, '+10', rate=40, workers=8)
+    start = time.monotonic()
+    results = list(dialer.dial(customers(*[f'+1{i:04d}' for i in range(60)]), 'https://x'))
+    # A 40-call burst, then 20 more at 40/s
+    assert time.monotonic() - start >= 0.45
+    assert len(results) == len(client.placed) == 60
+
+
+def test_campaign_reports_a_failed_run():
+    def run():
+        yield {'status': 'initiated'}
+        raise RuntimeError('store went away')
+
+    campaign = Campaign(run).start()
+    assert list(campaign.follow()) == [{'status': 'initiated'}]
+    assert campaign.join(1) and campaign.error == 'store went away'
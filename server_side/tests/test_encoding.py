@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+from conftest import csv_upload, sales_frame
+from encoding import IdEncoder
+from forecast import forecast_with_model
+from ingest import read_sales_window, read_training_frame
+from training import train_model
+
+
+def test_codes_are_training_category_positions():
+    encoder = IdEncoder.fit(['b', 'c', 'a', 'b'])
+    assert list(encoder.categories) == ['a', 'b', 'c']
+    assert encoder.encode(['a', 'b', 'c']).tolist() == [0, 1, 2]
+
+
+def test_subset_and_shuffled_uploads_keep_codes():
+    encoder = IdEncoder.fit(['S0', 'S1', 'S2', 'S3'])
+    # Per-upload category codes would give S2 code 0 and S3 code 1 here
+    assert encoder.encode(['S3', 'S2']).tolist() == [3, 2]
+    assert encoder.encode(pd.Series(['S1', 'S3', 'S0'], dtype='category')).tolist() == [1, 3, 0]
+
+
+def test_unseen_ids_encode_to_minus_one():
+    encoder = IdEncoder.fit([10, 20])
+    assert encoder.encode([20, 30, 10]).tolist() == [1, -1, 0]
+
+
+def test_numeric_upload_of_string_trained_ids():
+    encoder = IdEncoder.fit(['1', '2', '10'])
+    assert encoder.encode(pd.Series([10, 2])).tolist() == [1, 2]
+
+
+def test_mapping_round_trip_and_extend_keep_codes():
+    encoder = IdEncoder.fit(['b', 'a'])
+    restored = IdEncoder.from_mapping(encoder.to_mapping())
+    assert list(restored.categories) == ['a', 'b']
+    extended = restored.extend(['c', 'a', '0'])
+    assert extended.encode(['a', 'b', 'c', '0']).tolist() == [0, 1, 3, 2]
+    np.testing.assert_array_equal(extended.decode(np.array([3, 0])), ['c', 'a'])
+
+
+def test_predict_on_subset_upload_matches_full_upload():
+    frame = sales_frame(stores=3, products=3, days=30)
+    model, mappings, _ = train_model(read_training_frame(csv_upload(frame)), n_jobs=1, feature_set='basic')
+    encoders = [IdEncoder.from_mapping(mappings[key]) for key in ('store', 'product')]
+    full = read_sales_window(csv_upload(frame), window=28)
+    full_pred = forecast_with_model(full.frame, full.last_date, model, *encoders)
+
+    subset = frame[frame['store_id'] != 'S0'].sample(frac=1, random_state=0)
+    part = read_sales_window(csv_upload(subset), window=28)
+    part_pred = forecast_with_model(part.frame, part.last_date, model, *encoders)
+
+    expected = full_pred[full_pred['store_id'] != 'S0'].reset_index(drop=True)
+    pd.testing.assert_frame_equal(part_pred, expected, check_dtype=False, check_categorical=False)
+
+
+def test_unseen_groups_use_the_sales_average():
+    frame = sales_frame(stores=2, products=2, days=30)
+    model, mappings, _ = train_model(read_training_frame(csv_upload(frame)), n_jobs=1, feature_set='basic')
+    encoders = [IdEncoder.from_mapping(mappings[key]) for key in ('store', 'product')]
+    new_store = frame[frame['store_id'] == 'S0'].assign(store_id='S9', sales=7)
+    upload = read_sales_window(csv_upload(pd.concat([frame, new_store])), window=28)
+    pred = forecast_with_model(upload.frame, upload.last_date, model, *encoders)
+
+    assert pred.attrs['unseen_groups'] == 2
+    unseen = pred[pred['store_id'] == 'S9']
+    assert len(unseen) == 2 * 7
+    assert (unseen['predicted_stock'] == 7).all()
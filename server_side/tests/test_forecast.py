@@ -0,0 +1,103 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import csv_upload, sales_frame
+from encoding import IdEncoder
+from features import FEATURE_HISTORY_DAYS, entity_features, model_features
+from forecast import (_split_entities, build_entity_matrix, forecast_distribution, forecast_fallback,
+                      forecast_with_model, horizon_columns, horizon_dates, iter_fallback, predict_in_chunks,
+                      score_distribution)
+from ingest import read_sales_window, read_training_frame
+from training import train_model
+
+
+@pytest.fixture(scope='module', params=['basic', 'rolling'])
+def trained(request):
+    frame = sales_frame(stores=3, products=4, days=45)
+    model, mappings, _ = train_model(read_training_frame(csv_upload(frame)), n_jobs=1, feature_set=request.param)
+    encoders = [IdEncoder.from_mapping(mappings[key]) for key in ('store', 'product')]
+    window = read_sales_window(csv_upload(frame), window=FEATURE_HISTORY_DAYS)
+    return model, encoders, window
+
+
+def test_batched_horizon_matches_per_day_loop():
+    frame = sales_frame(stores=2, products=3, days=30)
+    model, mappings, _ = train_model(read_training_frame(csv_upload(frame)), n_jobs=1, feature_set='basic')
+    encoders = [IdEncoder.from_mapping(mappings[key]) for key in ('store', 'product')]
+    window = read_sales_window(csv_upload(frame), window=FEATURE_HISTORY_DAYS)
+    pred = forecast_with_model(window.frame, window.last_date, model, *encoders)
+
+    # The original endpoint: one model.predict per group and day
+    expected = []
+    for (store, product), group in frame.groupby(['store_id', 'product_id']):
+        sales = group['sales'].tail(7).mean()
+        codes = [encoders[0].encode([store])[0], encoders[1].encode([product])[0]]
+        for i in range(1, 8):
+            day = window.last_date + pd.Timedelta(days=i)
+            X = pd.DataFrame([[*codes, day.toordinal(), sales]], columns=model_features(model))
+            expected.append((store, product, day.strftime('%Y-%m-%d'), max(0, round(model.predict(X)[0]))))
+    expected = pd.DataFrame(expected, columns=['store_id', 'product_id', 'date', 'predicted_stock'])
+    pd.testing.assert_frame_equal(pred, expected, check_dtype=False, check_categorical=False)
+
+
+def test_entity_features_match_the_upload_path(trained):
+    model, encoders, window = trained
+    from_frame = forecast_with_model(window.frame, window.last_date, model, *encoders)
+    from_entities = forecast_with_model(None, window.last_date, model, *encoders,
+                                        entities=entity_features(window.frame))
+    pd.testing.assert_frame_equal(from_frame, from_entities, check_dtype=False, check_categorical=False)
+
+
+@pytest.mark.parametrize('horizon', [1, 7, 30, 90])
+def test_distribution_matches_scoring_every_day(trained, horizon):
+    model, encoders, window = trained
+    entities = entity_features(window.frame)
+    quantiles = (0.1, 0.5, 0.9)
+    forecast = forecast_distribution(entities, window.last_date, model, *encoders, horizon, quantiles)
+
+    store_codes, product_codes, table, _ = _split_entities(entities, *encoders)
+    dates = horizon_dates(window.last_date, horizon)
+    X = build_entity_matrix(store_codes, product_codes, table, dates, model_features(model))
+    scored = score_distribution(model, X, quantiles).reshape(len(store_codes), horizon, -1)
+    np.testing.assert_array_equal(forecast.mean, scored[:, :, 0])
+    np.testing.assert_array_equal(forecast.quantile_values, scored[:, :, 1:].transpose(2, 0, 1))
+    assert (forecast.quantile_values[0] <= forecast.quantile_values[-1]).all()
+    assert len(horizon_columns(model, model_features(model), dates)[0]) <= 7
+
+
+def test_distribution_mean_matches_predict(trained):
+    model, encoders, window = trained
+    pred = forecast_with_model(window.frame, window.last_date, model, *encoders)
+    forecast = forecast_distribution(entity_features(window.frame), window.last_date, model, *encoders, 7, (0.5,))
+    np.testing.assert_array_equal(forecast.mean.ravel(), pred['predicted_stock'].to_numpy())
+
+
+def test_distribution_without_model_is_the_sales_average():
+    window = read_sales_window(csv_upload(sales_frame(stores=1, products=2, days=10)), window=FEATURE_HISTORY_DAYS)
+    forecast = forecast_distribution(entity_features(window.frame), window.last_date, None, None, None, 14, (0.1, 0.9))
+    fallback = forecast_fallback(window.frame, window.last_date, 14)
+    np.testing.assert_array_equal(forecast.mean.ravel(), fallback['predicted_stock'].to_numpy())
+    np.testing.assert_array_equal(forecast.quantile_values[0], forecast.mean)
+    assert forecast.unseen_groups == 0
+
+
+def test_streamed_fallback_matches_and_yields_per_chunk():
+    window = read_sales_window(csv_upload(sales_frame(stores=3, products=4, days=20)), window=FEATURE_HISTORY_DAYS)
+    frames = list(iter_fallback(window.frame, window.last_date, chunk_groups=5, horizon=3))
+    assert [len(frame) for frame in frames] == [15, 15, 6]
+    pd.testing.assert_frame_equal(pd.concat(frames, ignore_index=True),
+                                  forecast_fallback(window.frame, window.last_date, 3))
+
+
+def test_chunked_predict_matches_and_does_not_warn(trained):
+    model, encoders, window = trained
+    store_codes, product_codes, table, _ = _split_entities(entity_features(window.frame), *encoders)
+    X = build_entity_matrix(store_codes, product_codes, table, horizon_dates(window.last_date, 7),
+                            model_features(model))
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        chunked = predict_in_chunks(model, X, chunk_rows=10)
+    np.testing.assert_array_equal(chunked, predict_in_chunks(model, X))
@@ -0,0 +1,113 @@
+import io
+import json
+import logging
+
+import pytest
+from flask import Flask, Response
+
+from instrumentation import Metrics, configure_logging, get_logger, instrument_app
+
+
+def test_render_is_prometheus_text():
+    m = Metrics(buckets=(0.1, 1))
+    m.describe('calls_total', 'Calls placed')
+    m.inc('calls_total', status='ok')
+    m.inc('calls_total', 2, status='ok')
+    m.inc('calls_total', reason='say "hi"\n')
+    for seconds in (0.05, 0.5, 5):
+        m.observe('stage_seconds', seconds, stage='dial')
+    m.gauge('queue_depth', lambda: {(('queue', 'retry'),): 4})
+    m.gauge('broken', lambda: 1 / 0)
+
+    lines = m.render().splitlines()
+    assert '# HELP predelix_calls_total Calls placed' in lines
+    assert '# TYPE predelix_calls_total counter' in lines
+    assert 'predelix_calls_total{status="ok"} 3' in lines
+    assert 'predelix_calls_total{reason="say \\"hi\\"\\n"} 1' in lines
+    # Buckets are cumulative and end with +Inf
+    assert [line for line in lines if line.startswith('predelix_stage_seconds')] == [
+        'predelix_stage_seconds_bucket{stage="dial",le="0.1"} 1',
+        'predelix_stage_seconds_bucket{stage="dial",le="1"} 2',
+        'predelix_stage_seconds_bucket{stage="dial",le="+Inf"} 3',
+        'predelix_stage_seconds_sum{stage="dial"} 5.550000',
+        'predelix_stage_seconds_count{stage="dial"} 3',
+    ]
+    assert 'predelix_queue_depth{queue="retry"} 4' in lines
+    # A failing gauge is skipped, not fatal
+    assert not [line for line in lines if 'broken' in line]
+
+
+def test_disabled_metrics_record_nothing():
+    m = Metrics(enabled=False)
+    m.inc('calls_total')
+    with m.stage('dial'):
+        pass
+    assert m.snapshot() == ({}, {})
+
+
+@pytest.fixture
+def log_output():
+    stream = io.StringIO()
+    configure_logging(level='INFO', fmt='json', stream=stream)
+    yield stream
+    configure_logging()
+
+
+def test_structured_logger_writes_fields_as_json(log_output):
+    log = get_logger('test')
+    log.info('✅ Loaded model', version='v000001', groups=3)
+    log.debug('not written', groups=4)
+    try:
+        raise ValueError('bad row')
+    except ValueError:
+        log.error('❌ Failed', exc_info=True, row=7)
+
+    entries = [json.loads(line) for line in log_output.getvalue().splitlines()]
+    assert [entry['msg'] for entry in entries] == ['✅ Loaded model', '❌ Failed']
+    assert entries[0]['logger'] == 'predelix.test' and entries[0]['level'] == 'info'
+    assert entries[0]['version'] == 'v000001' and entries[0]['groups'] == 3
+    assert entries[1]['row'] == 7 and 'ValueError: bad row' in entries[1]['exc']
+    assert not log.enabled(logging.DEBUG)
+
+
+def test_instrumented_app_times_requests_by_route(tmp_path):
+    profiles = []
+
+    class Profiler:
+        def start(self):
+            return self
+
+        def stop(self, path):
+            profiles.append(path)
+
+    app = Flask(__name__)
+    instrument_app(app, 'svc', profiler=Profiler, profile_rate=1, profile_dir=str(tmp_path))
+
+    @app.route('/items/<item_id>')
+    def item(item_id):
+        return {'id': item_id}
+
+    @app.route('/stream')
+    def stream():
+        return Response(iter([b'a', b'b']))
+
+    client = app.test_client()
+
+    def get(path):
+        response = client.get(path)
+        # Requests are recorded once the body has been sent, i.e. when the response is closed
+        response.get_data()
+        response.close()
+        return response
+
+    assert get('/items/1').status_code == 200
+    assert get('/items/2').status_code == 200
+    assert get('/stream').data == b'ab'
+    assert get('/missing').status_code == 404
+
+    body = get('/metrics').get_data(as_text=True)
+    assert 'predelix_http_requests_total{endpoint="/items/<item_id>",method="GET",service="svc",status="200"} 2' \
+        in body
+    assert 'predelix_http_request_seconds_count{endpoint="/stream",method="GET",service="svc"} 1' in body
+    assert 'endpoint="unmatched",method="GET",service="svc",status="404"' in body
+    assert any(path.startswith(str(tmp_path / 'svc-items_item_id-')) for path in profiles)
@@ -0,0 +1,59 @@
+import io
+import os
+import time
+
+import pytest
+
+from jobs import JobStore, TrainingQueue, spool_upload
+
+
+def _slow_job(job_id, directory, seconds, fail=False):
+    time.sleep(seconds)
+    if fail:
+        raise RuntimeError('fit exploded')
+    JobStore(directory).update(job_id, status='succeeded')
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = TrainingQueue(JobStore(str(tmp_path)))
+    yield queue
+    queue.shutdown()
+
+
+def test_spool_upload_hashes_what_it_writes(tmp_path):
+    path, digest = spool_upload(io.BytesIO(b'store_id,product_id\n1,2\n'), str(tmp_path), chunk_size=4)
+    with open(path, 'rb') as f:
+        assert f.read() == b'store_id,product_id\n1,2\n'
+    assert digest == spool_upload(io.BytesIO(b'store_id,product_id\n1,2\n'), str(tmp_path))[1]
+
+
+def test_job_store_merges_updates(tmp_path):
+    store = JobStore(str(tmp_path))
+    assert store.get('missing') is None
+    store.update('a', status='queued', progress=0.0)
+    assert store.update('a', progress=0.5) == {'id': 'a', 'status': 'queued', 'progress': 0.5}
+    assert store.get('a')['progress'] == 0.5
+    assert not [name for name in os.listdir(tmp_path) if '.tmp.' in name]
+
+
+def test_identical_dataset_joins_the_queued_job(queue):
+    directory = queue.store.directory
+    job, created = queue.submit('hash-1', _slow_job, directory, 1.0)
+    assert created and job['status'] == 'queued'
+    same, created = queue.submit('hash-1', _slow_job, directory, 1.0)
+    assert not created and same['id'] == job['id']
+    other, created = queue.submit('hash-2', _slow_job, directory, 0.0)
+    assert created and other['id'] != job['id']
+
+    queue.shutdown()
+    assert queue.store.get(job['id'])['status'] == 'succeeded'
+    # Finished jobs no longer absorb new submissions
+    assert queue._active == {}
+
+
+def test_worker_exception_marks_the_job_failed(queue):
+    job, _ = queue.submit('hash-1', _slow_job, queue.store.directory, 0.0, True)
+    queue.shutdown()
+    failed = queue.store.get(job['id'])
+    assert failed['status'] == 'failed' and 'fit exploded' in failed['error']
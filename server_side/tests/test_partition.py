@@ -0,0 +1,73 @@
+import copy
+import gc
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from conftest import csv_upload, sales_frame
+from encoding import IdEncoder
+from features import FEATURE_HISTORY_DAYS, entity_features
+from forecast import _split_entities, build_entity_matrix, horizon_dates, model_features
+from ingest import read_sales_window, read_training_frame
+from artifact import FlatForest
+from partition import PartitionedForecaster, _score_stock, store_shards
+from training import train_model
+
+
+@pytest.fixture(scope='module')
+def scoring():
+    frame = sales_frame(stores=4, products=3, days=45)
+    model, mappings, _ = train_model(read_training_frame(csv_upload(frame)), n_jobs=1, feature_set='rolling')
+    encoders = [IdEncoder.from_mapping(mappings[key]) for key in ('store', 'product')]
+    window = read_sales_window(csv_upload(frame), window=FEATURE_HISTORY_DAYS)
+    store_codes, product_codes, table, _ = _split_entities(entity_features(window.frame), *encoders)
+    args = (store_codes, product_codes, table, horizon_dates(window.last_date, 7), model_features(model))
+    return model, args
+
+
+def test_store_shards_keep_stores_whole():
+    codes = np.array([0, 0, 0, 1, 1, 2, 3, 3, 3, 3])
+    assert store_shards(codes, 4) == [(0, 5), (5, 10)]
+    assert store_shards(codes, 1) == [(0, 3), (3, 5), (5, 6), (6, 10)]
+    assert store_shards(codes[:0], 4) == []
+
+
+def test_pools_are_kept_per_model(scoring):
+    model, args = scoring
+    # Another tenant's model (or the same one reloaded) is a different object
+    models = [model, copy.deepcopy(model)]
+    expected = _score_stock(model, build_entity_matrix(*args))
+    forecaster = PartitionedForecaster(workers=2, shard_groups=1, start_method='spawn', max_pools=2,
+                                       flat_workers=False)
+    try:
+        for current in models + models:
+            np.testing.assert_array_equal(forecaster.score(current, *args), expected)
+        # Alternating between the two starts one pool each, not one per switch
+        assert forecaster.pools_started == 2
+        forecaster.score(copy.deepcopy(model), *args)
+        assert forecaster.pools_started == 3 and len(forecaster._pools) == 2
+    finally:
+        forecaster.shutdown()
+
+
+def test_sklearn_forests_reach_workers_as_a_mapped_file(scoring, tmp_path):
+    model, args = scoring
+    model = copy.deepcopy(model)
+    expected = _score_stock(model, build_entity_matrix(*args))
+    forecaster = PartitionedForecaster(workers=2, shard_groups=1, start_method='spawn', flat_dir=str(tmp_path))
+    try:
+        for current in (model, model, copy.deepcopy(model)):
+            np.testing.assert_array_equal(forecaster.score(current, *args), expected)
+        # Every model, converted or not, is scored by the one shared pool
+        assert forecaster.pools_started == 1 and not forecaster._pools
+        shipped = forecaster._flat(model)
+        assert isinstance(shipped, FlatForest) and os.path.dirname(shipped.path) == str(tmp_path)
+        # What a shard carries is the file's path, not the forest
+        assert len(pickle.dumps(shipped)) < 1024 < len(pickle.dumps(model))
+        del model, shipped, current
+        gc.collect()
+        assert os.listdir(tmp_path) == []
+    finally:
+        forecaster.shutdown()
@@ -0,0 +1,79 @@
+import pytest
+
+from conftest import csv_upload, sales_frame
+from ingest import read_training_frame
+from registry import ModelStore, model_nbytes
+from training import train_model
+
+
+@pytest.fixture(scope='module')
+def model():
+    frame = sales_frame(stores=2, products=2, days=30)
+    model, mappings, _ = train_model(read_training_frame(csv_upload(frame)), n_jobs=1, feature_set='basic')
+    return model, mappings
+
+
+@pytest.mark.parametrize('fmt', ['pickle', 'flat'])
+def test_snapshot_carries_the_published_version_name(tmp_path, model, fmt):
+    store = ModelStore(str(tmp_path), fmt=fmt)
+    assert store.get('default') is None
+    first = store.save('default', *model)
+    second = store.save('default', *model)
+    assert (first, second) == ('v000001', 'v000002')
+    assert store.get('default').name == second
+    store.publish('default', first)
+    assert store.get('default').name == first
+    assert [v['version'] for v in store.versions('default') if v['current']] == [first]
+
+
+def loaded_ids(store):
+    return list(store._loaded)
+
+
+def test_least_recently_used_models_are_evicted_by_count(tmp_path, model):
+    store = ModelStore(str(tmp_path), max_models=2)
+    for model_id in ('a', 'b', 'c'):
+        store.save(model_id, *model)
+    store.get('a')
+    store.get('b')
+    store.get('a')
+    store.get('c')
+    # b was used least recently, so c replaced it
+    assert loaded_ids(store) == ['a', 'c']
+    assert store.stats()['evictions'] == 1 and store.stats()['loads'] == 3
+    # A resident model is not loaded again; an evicted one is
+    store.get('a')
+    assert store.stats()['loads'] == 3
+    assert store.get('b') is not None and store.stats()['loads'] == 4 and loaded_ids(store) == ['a', 'b']
+
+
+@pytest.mark.parametrize('fmt', ['pickle', 'flat'])
+def test_models_are_evicted_to_fit_the_byte_budget(tmp_path, model, fmt):
+    store = ModelStore(str(tmp_path), fmt=fmt)
+    store.save('a', *model)
+    size = model_nbytes(store.get('a').model)
+    assert store.stats()['bytes'] == size > 0
+
+    store = ModelStore(str(tmp_path), fmt=fmt, max_bytes=int(size * 2.5))
+    snapshots = {}
+    for model_id in ('a', 'b', 'c'):
+        if model_id != 'a':
+            store.save(model_id, *model)
+        snapshots[model_id] = store.get(model_id)
+    assert loaded_ids(store) == ['b', 'c'] and store.stats()['bytes'] == 2 * size
+    # Snapshots handed out before an eviction keep working
+    assert model_nbytes(snapshots['a'].model) == size and snapshots['a'].mappings == model[1]
+
+    # One model over the whole budget is still served, on its own
+    store.max_bytes = size // 2
+    store.get('a')
+    assert loaded_ids(store) == ['a'] and store.stats()['bytes'] == size
+
+
+def test_publishing_a_new_version_replaces_the_loaded_one(tmp_path, model):
+    store = ModelStore(str(tmp_path))
+    first = store.save('a', *model)
+    size = model_nbytes(store.get('a').model)
+    store.save('a', *model)
+    assert store.get('a').name != first
+    assert loaded_ids(store) == ['a'] and store.stats()['bytes'] == size and store.stats()['loads'] == 2
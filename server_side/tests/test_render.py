@@ -0,0 +1,70 @@
+import gzip
+import io
+import json
+import zlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from forecast import DistributionForecast, horizon_dates, prediction_frame
+from render import PREDICTION_COLUMNS, columnar_json, gzip_chunks, iter_csv, iter_json_array, iter_ndjson
+
+
+def frames(*sizes):
+    """Prediction frames of `sizes` groups x 2 days, with ids that need JSON escaping."""
+    dates = horizon_dates(pd.Timestamp('2024-03-01'), 2)
+    out, offset = [], 0
+    for size in sizes:
+        groups = np.arange(offset, offset + size)
+        out.append(prediction_frame(np.array([f'S"{g}' for g in groups], dtype=object), groups, dates,
+                                    np.arange(2 * size) + 2 * offset))
+        offset += size
+    return out
+
+
+def records(parts):
+    return pd.concat(parts, ignore_index=True).to_dict(orient='records') if parts else []
+
+
+@pytest.mark.parametrize('sizes', [(3, 1, 2), (2,), (0, 2, 0), (0,), ()])
+def test_json_array_is_one_valid_document(sizes):
+    parts = frames(*sizes)
+    body = b''.join(iter_json_array(parts))
+    assert json.loads(body) == records(parts)
+
+
+@pytest.mark.parametrize('sizes', [(3, 1, 2), (0, 2), ()])
+def test_ndjson_is_one_record_per_line(sizes):
+    parts = frames(*sizes)
+    body = b''.join(iter_ndjson(parts)).decode()
+    assert [json.loads(line) for line in body.splitlines()] == records(parts)
+    assert body == '' or body.endswith('\n')
+
+
+@pytest.mark.parametrize('sizes', [(3, 1, 2), ()])
+def test_csv_has_one_header(sizes):
+    parts = frames(*sizes)
+    chunks = list(iter_csv(parts))
+    assert chunks[0].startswith((','.join(PREDICTION_COLUMNS) + '\n').encode())
+    parsed = pd.read_csv(io.BytesIO(b''.join(chunks)))
+    assert list(parsed.columns) == PREDICTION_COLUMNS and len(parsed) == 2 * sum(sizes)
+
+
+def test_gzip_chunks_decode_incrementally_and_in_full():
+    chunks = list(iter_ndjson(frames(3, 1, 2)))
+    compressed = list(gzip_chunks(iter(chunks)))
+    assert gzip.decompress(b''.join(compressed)) == b''.join(chunks)
+    # Each chunk is flushed, so a client can decode the first one before the rest arrive
+    decoder = zlib.decompressobj(31)
+    assert decoder.decompress(compressed[0]) == chunks[0]
+
+
+def test_columnar_json_writes_ids_and_dates_once():
+    forecast = DistributionForecast(store_ids=np.array(['S1', 'S2'], dtype=object), product_ids=np.array([1, 2]),
+                                    dates=horizon_dates(pd.Timestamp('2024-03-01'), 2), quantiles=(0.1, 0.9),
+                                    mean=np.array([[1, 2], [3, 4]]),
+                                    quantile_values=np.zeros((2, 2, 2), dtype=np.int64), unseen_groups=0)
+    payload = json.loads(columnar_json(forecast, model_version='v1'))
+    assert payload['dates'] == ['2024-03-02', '2024-03-03'] and payload['store_id'] == ['S1', 'S2']
+    assert payload['mean'] == [[1, 2], [3, 4]] and payload['model_version'] == 'v1'
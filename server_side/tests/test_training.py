@@ -0,0 +1,42 @@
+import numpy as np
+
+from conftest import csv_upload, sales_frame
+from dataset import KEY_COLUMNS
+from ingest import read_training_frame
+from training import train_model, update_model
+
+
+def frames(days=40, new_days=5):
+    history = read_training_frame(csv_upload(sales_frame(days=days)))
+    cutoff = history['date_ordinal'].max() - new_days
+    return history, history[history['date_ordinal'] > cutoff]
+
+
+def test_incremental_mse_is_measured_on_rows_no_tree_has_seen():
+    history, new = frames()
+    model, mappings, _ = train_model(history[~history.index.isin(new.index)].copy(), n_jobs=1, feature_set='basic')
+    # New days whose stock no tree could predict: an in-sample score would hide that
+    history.loc[new.index, 'stock'] += 1000
+    _, _, mse = update_model(model, mappings, history, n_jobs=1, fit_from=int(new['date_ordinal'].min()),
+                             new_rows=history.loc[new.index, KEY_COLUMNS])
+    assert mse > 500 ** 2
+
+
+def test_dropping_old_trees_does_not_repeat_seeds():
+    history, _ = frames(days=20)
+    model, mappings, _ = train_model(history.copy(), n_jobs=1, feature_set='basic')
+    for _ in range(3):
+        model, mappings, _ = update_model(model, mappings, history.copy(), n_jobs=1, n_trees=10, max_trees=100)
+    seeds = [estimator.random_state for estimator in model.estimators_]
+    assert len(model.estimators_) == 100
+    assert len(set(seeds)) == len(seeds)
+    assert np.isfinite(update_model(model, mappings, history.copy(), n_jobs=1, n_trees=10, max_trees=100)[2])
+
+
+def test_no_unseen_rows_leaves_mse_unset():
+    history, new = frames()
+    model, mappings, _ = train_model(history.copy(), n_jobs=1, feature_set='basic')
+    # None of the uploaded keys made it into the fitted rows, so nothing can be held out
+    _, _, mse = update_model(model, mappings, history.copy(), n_jobs=1, n_trees=10,
+                             new_rows=new[KEY_COLUMNS].assign(store_id='unknown'))
+    assert mse is None
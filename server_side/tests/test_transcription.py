@@ -0,0 +1,143 @@
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from call_store import CallStore
+from transcription import (DONE, DOWNLOADING, FAILED, PENDING_STATUSES, QUEUED, StubBackend, TranscriptionPipeline,
+                           _synthesize_wavs, make_backend, recording_paths, transcribe_files)
+
+
+class Response:
+    def __init__(self, status_code, content=b''):
+        self.status_code = status_code
+        self.ok = status_code == 200
+        self.content = content
+
+
+class RecordingSession:
+    """requests.Session double serving `audio` once the recording is `ready_after` polls old."""
+
+    def __init__(self, audio, ready_after=0):
+        self.audio = audio
+        self.ready_after = ready_after
+        self.urls = []
+
+    def get(self, url, timeout=None):
+        self.urls.append(url)
+        polls = sum(u.endswith('.wav') for u in self.urls)
+        return Response(200, self.audio) if url.endswith('.wav') and polls > self.ready_after else Response(404)
+
+
+@pytest.fixture
+def wavs(tmp_path):
+    _synthesize_wavs(str(tmp_path), 3, seconds=0.5)
+    return sorted(str(path) for path in tmp_path.glob('recording_*.wav'))
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        make_backend('nope')
+
+
+def test_batch_reports_failures_per_clip(wavs, tmp_path):
+    broken = tmp_path / 'recording_9.wav'
+    broken.write_bytes(b'not audio')
+    results = StubBackend(text='ok').transcribe_batch([wavs[0], str(broken)])
+    assert [(result.text, result.error is None) for result in results] == [('ok', True), (None, False)]
+    assert results[0].audio_seconds == pytest.approx(0.5)
+
+
+def test_transcribe_files_keeps_input_order(wavs):
+    results = list(transcribe_files(wavs, 'stub', workers=2, batch_size=2, text='hello'))
+    assert [result.path for result in results] == wavs
+    assert all(result.text == 'hello' for result in results)
+
+
+def test_recording_paths_include_extensionless_downloads(wavs, tmp_path):
+    # The pipeline saves a recording fetched without an extension as recording_<row>.audio
+    audio = tmp_path / 'recording_3.audio'
+    audio.write_bytes(open(wavs[0], 'rb').read())
+    (tmp_path / 'recording_4.mp3').write_bytes(b'mp3')
+    (tmp_path / 'notes.txt').write_text('x')
+    paths, skipped = recording_paths(str(tmp_path))
+    assert paths == sorted(wavs + [str(audio)])
+    assert skipped == 1
+    assert next(transcribe_files([str(audio)], 'stub', workers=1, text='ok')).text == 'ok'
+
+
+def test_pipeline_polls_until_the_recording_is_ready(wavs, tmp_path):
+    store = CallStore(str(tmp_path / 'calls.sqlite3'))
+    store.import_frame(pd.DataFrame({'name': ['Asha', 'Ravi'], 'mobile_number': ['+911', '+912']}))
+    audio_dir = tmp_path / 'audio'
+    audio_dir.mkdir()
+    pipeline = TranscriptionPipeline(store, 'sid', 'token', backend=StubBackend(text='after 5 pm'),
+                                     audio_dir=str(audio_dir), max_wait=1.0, initial_delay=0.01)
+    with open(wavs[0], 'rb') as f:
+        pipeline.session = RecordingSession(f.read(), ready_after=2)
+    store.update(0, response='https://api.twilio.com/Recordings/RE0')
+    pipeline.submit(0, 'https://api.twilio.com/Recordings/RE0')
+    pipeline._pool.shutdown(wait=True)
+    record = store.get(0)
+    assert (record['transcription'], record['transcription_status']) == ('after 5 pm', DONE)
+    assert (audio_dir / 'recording_0.wav').exists()
+
+
+def test_pipeline_gives_up_when_no_recording_appears(tmp_path):
+    store = CallStore(str(tmp_path / 'calls.sqlite3'))
+    store.import_frame(pd.DataFrame({'name': ['Asha'], 'mobile_number': ['+911']}))
+    pipeline = TranscriptionPipeline(store, 'sid', 'token', backend=StubBackend(), audio_dir=str(tmp_path),
+                                     max_wait=0.05, initial_delay=0.01)
+    pipeline.session = RecordingSession(b'', ready_after=10 ** 6)
+    pipeline.submit(0, 'https://api.twilio.com/Recordings/RE0')
+    pipeline._pool.shutdown(wait=True)
+    assert store.get(0)['transcription_status'] == FAILED
+    assert store.pending_transcriptions([FAILED]) == [(0, None, pipeline.owner)]
+
+
+@pytest.fixture
+def processes():
+    """Pids of live processes standing in for other server workers, and of one that has exited."""
+    live = [subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)']) for _ in range(3)]
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    yield [str(process.pid) for process in live], str(exited.pid)
+    for process in live:
+        process.kill()
+        process.wait()
+
+
+def test_resume_takes_over_only_rows_whose_owner_exited(wavs, tmp_path, processes):
+    (worker_a, worker_b, other), exited = processes
+    store = CallStore(str(tmp_path / 'calls.sqlite3'))
+    store.import_frame(pd.DataFrame({'name': ['Asha', 'Ravi', 'Meera'], 'mobile_number': ['+911', '+912', '+913']}))
+    url = 'https://api.twilio.com/Recordings/RE'
+    store.update(0, response=url, transcription_status=QUEUED, transcription_owner=other)
+    store.update(1, response=url, transcription_status=DOWNLOADING, transcription_owner=exited)
+    # Left by a version that did not record owners
+    store.update(2, response=url, transcription_status=QUEUED)
+
+    with open(wavs[0], 'rb') as f:
+        audio = f.read()
+    pipelines = []
+    for owner in (worker_a, worker_b):
+        pipeline = TranscriptionPipeline(store, 'sid', 'token', backend=StubBackend(text='ok'),
+                                         audio_dir=str(tmp_path), initial_delay=0.01, owner=owner)
+        pipeline.session = RecordingSession(audio)
+        pipelines.append(pipeline)
+    # Both workers resume at start-up; each orphaned row goes to exactly one of them
+    assert [pipeline.resume() for pipeline in pipelines] == [2, 0]
+    for pipeline in pipelines:
+        pipeline._pool.shutdown(wait=True)
+    assert [len(pipeline.session.urls) for pipeline in pipelines] == [2, 0]
+    assert [store.get(row)['transcription_status'] for row in range(3)] == [QUEUED, DONE, DONE]
+
+
+def test_a_claim_succeeds_once(tmp_path):
+    store = CallStore(str(tmp_path / 'calls.sqlite3'))
+    store.import_frame(pd.DataFrame({'name': ['Asha'], 'mobile_number': ['+911']}))
+    store.update(0, transcription_status=QUEUED, transcription_owner='1')
+    assert store.claim_transcription(0, '2', '1', PENDING_STATUSES)
+    assert not store.claim_transcription(0, '3', '1', PENDING_STATUSES)
+    assert store.pending_transcriptions(PENDING_STATUSES) == [(0, None, '2')]